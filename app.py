@@ -1,64 +1,2646 @@
-from flask import Flask, request, jsonify, render_template, redirect, url_for, flash
+from flask import Flask, request, jsonify, render_template, redirect, url_for, flash, g, has_request_context
+from flask import Response, make_response, session, stream_with_context
+from flask.json.provider import DefaultJSONProvider
+import click
 import mysql.connector
 from mysql.connector import Error
 import os
-from datetime import datetime
+import atexit
+import base64
+import binascii
+import bisect
+import hashlib
+import collections
+import contextlib
+import csv
+import decimal
+import io
+import itertools
+import math
+import queue
+import random
+import re
+import sqlite3
+import struct
+import threading
+import time
+import uuid
+from datetime import date, datetime, timedelta
 import json
+import sys
+import zlib
+from reading_archive import ArchiveStore, COLUMNS as ARCHIVE_COLUMNS
+from storage import EXPORT_COLUMNS, FILTER_OPERATORS, ReadingFilter, ReadingRepository, SQLiteRepository
+from storage import StorageError, Validator, parse_sensor_fields, reading_metrics, search_index, sensor_column
+from storage import sensor_value, stats_deltas
+
+try:
+    import orjson  # optional: faster JSON encoding of API responses
+except ImportError:
+    orjson = None
 
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-change-in-production'
 
-# Database configuration
-DB_CONFIG = {
-    'host': '61.19.114.86',
-    'port': 54000,
-    'user': 'std01',
-    'password': 'std01',
-    'database': 'std01_iot_data'  # You may need to create this database
-}
+# Database configuration
+DB_CONFIG = {
+    'host': os.environ.get('DB_HOST', '61.19.114.86'),
+    'port': int(os.environ.get('DB_PORT', 54000)),
+    'user': os.environ.get('DB_USER', 'std01'),
+    'password': os.environ.get('DB_PASSWORD', 'std01'),
+    'database': os.environ.get('DB_NAME', 'std01_iot_data')  # You may need to create this database
+}
+
+# Connection pool configuration
+POOL_CONFIG = {
+    'pool_size': int(os.environ.get('DB_POOL_SIZE', 10)),           # idle connections kept open
+    'max_overflow': int(os.environ.get('DB_POOL_MAX_OVERFLOW', 20)), # extra connections allowed under load
+    'recycle': int(os.environ.get('DB_POOL_RECYCLE', 3600)),         # seconds before a connection is replaced
+    'pre_ping': os.environ.get('DB_POOL_PRE_PING', '1') == '1',      # ping idle connections before reuse
+    'timeout': float(os.environ.get('DB_POOL_TIMEOUT', 10))          # seconds to wait for a free connection
+}
+
+class PooledConnection:
+    """Wrapper around a pooled connection; close() returns it to the pool"""
+    
+    def __init__(self, pool, connection):
+        self._pool = pool
+        self._connection = connection
+        self.created_at = time.monotonic()
+        self.request_scoped = False
+        self.in_use = True
+    
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+    
+    def cursor(self, *args, **kwargs):
+        cursor = self._connection.cursor(*args, **kwargs)
+        if METRICS_CONFIG['enabled'] or SLOW_QUERY_CONFIG['enabled']:
+            return InstrumentedCursor(cursor)
+        return cursor
+    
+    def close(self):
+        """Return the connection to the pool (no-op while bound to a request)"""
+        if self.request_scoped or not self.in_use:
+            return
+        self._pool.release(self)
+
+class ConnectionPool:
+    """Thread-safe database connection pool with overflow, recycling and pre-ping"""
+    
+    def __init__(self, creator, pool_size=10, max_overflow=20, recycle=3600, pre_ping=True, timeout=10):
+        self._creator = creator
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self.recycle = recycle
+        self.pre_ping = pre_ping
+        self.timeout = timeout
+        self._idle = []
+        self._checked_out = 0
+        self._lock = threading.Condition()
+        self._stats = {
+            "created": 0,
+            "recycled": 0,
+            "ping_failures": 0,
+            "timeouts": 0,
+            "acquired": 0
+        }
+    
+    def _discard(self, pooled):
+        try:
+            pooled._connection.close()
+        except Exception:
+            pass
+    
+    def _is_usable(self, pooled):
+        if self.recycle and time.monotonic() - pooled.created_at > self.recycle:
+            return "recycled"
+        if self.pre_ping:
+            try:
+                pooled._connection.ping(reconnect=False)
+            except Exception:
+                return "ping_failures"
+        return None
+    
+    def acquire(self):
+        """Borrow a connection, opening a new one if none is idle"""
+        deadline = time.monotonic() + self.timeout
+        with self._lock:
+            while not self._idle and self._checked_out >= self.pool_size + self.max_overflow:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats["timeouts"] += 1
+                    raise Error(msg="Timed out waiting for a pooled database connection")
+                self._lock.wait(remaining)
+            pooled = self._idle.pop() if self._idle else None
+            self._checked_out += 1
+        
+        # Validate or open connections outside the lock so slow handshakes don't block releases
+        try:
+            if pooled is not None:
+                reason = self._is_usable(pooled)
+                if reason:
+                    self._discard(pooled)
+                    pooled = None
+                    with self._lock:
+                        self._stats[reason] += 1
+            if pooled is None:
+                pooled = PooledConnection(self, self._creator())
+                with self._lock:
+                    self._stats["created"] += 1
+        except Exception:
+            with self._lock:
+                self._checked_out -= 1
+                self._lock.notify()
+            raise
+        
+        pooled.in_use = True
+        with self._lock:
+            self._stats["acquired"] += 1
+        return pooled
+    
+    def release(self, pooled, discard=False):
+        """
+        Return a connection to the pool, rolling back any open transaction.
+        With `discard` (e.g. unread results are pending) it is closed instead.
+        """
+        if not pooled.in_use:
+            return
+        pooled.in_use = False
+        pooled.request_scoped = False
+        healthy = not discard
+        try:
+            if healthy and pooled._connection.in_transaction:
+                pooled._connection.rollback()
+        except Exception:
+            healthy = False
+        
+        with self._lock:
+            self._checked_out -= 1
+            if healthy and len(self._idle) < self.pool_size:
+                self._idle.append(pooled)
+                pooled = None
+            self._lock.notify()
+        
+        if pooled is not None:
+            self._discard(pooled)
+    
+    def stats(self):
+        """Return a snapshot of pool usage counters"""
+        with self._lock:
+            return {
+                "pool_size": self.pool_size,
+                "max_overflow": self.max_overflow,
+                "checked_out": self._checked_out,
+                "idle": len(self._idle),
+                "overflow": max(0, self._checked_out - self.pool_size),
+                **self._stats
+            }
+
+def _create_mysql_connection():
+    return mysql.connector.connect(**DB_CONFIG)
+
+db_pool = ConnectionPool(_create_mysql_connection, **POOL_CONFIG)
+
+def _timed_acquire():
+    started = time.perf_counter()
+    connection = db_pool.acquire()
+    if METRICS_CONFIG['enabled']:
+        pool_wait.observe((), time.perf_counter() - started)
+    return connection
+
+def get_db_connection():
+    """
+    Return a pooled database connection.
+    Inside a Flask request one connection is borrowed and shared via `g`,
+    and returned to the pool on teardown.
+    """
+    try:
+        if has_request_context():
+            if 'db_connection' not in g:
+                connection = _timed_acquire()
+                connection.request_scoped = True
+                g.db_connection = connection
+            return g.db_connection
+        return _timed_acquire()
+    except Error as e:
+        print(f"Error connecting to MySQL: {e}")
+        return None
+
+@app.teardown_request
+def release_db_connection(exception=None):
+    """Return the request's database connection to the pool"""
+    connection = g.pop('db_connection', None)
+    if connection is not None:
+        db_pool.release(connection)
+
+def discard_db_connection(connection):
+    """Close a borrowed connection instead of pooling it, e.g. when unread rows are pending"""
+    if has_request_context() and g.get('db_connection') is connection:
+        g.pop('db_connection')
+    db_pool.release(connection, discard=True)
+
+# ========================
+# METRICS
+# ========================
+
+METRICS_CONFIG = {
+    'enabled': os.environ.get('METRICS_ENABLED', '1') == '1',
+    'request_buckets': (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+    'query_buckets': (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+}
+
+def _label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(names, values, extra=''):
+    pairs = [f'{name}="{_label_value(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+class MetricHistogram:
+    """Thread-safe Prometheus histogram keyed by label values"""
+
+    def __init__(self, name, help_text, label_names, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series = {}  # label values -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, label_values, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {labels: list(values) for labels, values in self._series.items()}
+        for labels, values in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), values):
+                cumulative += count
+                bucket_labels = _format_labels(self.label_names, labels, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, labels)} {values[-1]:.6f}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, labels)} {cumulative}")
+        return lines
+
+class MetricCounter:
+    """Thread-safe Prometheus counter keyed by label values"""
+
+    def __init__(self, name, help_text, label_names):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._series = collections.Counter()
+        self._lock = threading.Lock()
+
+    def inc(self, label_values, amount=1):
+        with self._lock:
+            self._series[label_values] += amount
+
+    def render(self):
+        with self._lock:
+            series = dict(self._series)
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        lines.extend(
+            f"{self.name}{_format_labels(self.label_names, labels)} {value}" for labels, value in sorted(series.items())
+        )
+        return lines
+
+request_latency = MetricHistogram(
+    'iot_http_request_duration_seconds', "Time until the response starts, by route and status",
+    ('method', 'route', 'status'), METRICS_CONFIG['request_buckets']
+)
+query_latency = MetricHistogram(
+    'iot_db_query_duration_seconds', "Database execute plus fetch time, by route and query kind",
+    ('route', 'query'), METRICS_CONFIG['query_buckets']
+)
+query_rows = MetricCounter('iot_db_query_rows_total', "Rows fetched, by route and query kind", ('route', 'query'))
+pool_wait = MetricHistogram(
+    'iot_db_pool_acquire_seconds', "Time spent borrowing a pooled connection", (), METRICS_CONFIG['query_buckets']
+)
+_in_flight = {"requests": 0}
+_in_flight_lock = threading.Lock()
+
+_QUERY_VERB = re.compile(r'\s*(\w+)')
+_QUERY_TABLE = re.compile(r'\b(?:FROM|INTO|UPDATE|TABLE|JOIN)\s+`?(\w+)', re.IGNORECASE)
+_query_kinds = {}
+
+def query_kind(sql):
+    """Label for a statement: its verb and first table, e.g. "SELECT iot_readings" """
+    kind = _query_kinds.get(sql)
+    if kind is None:
+        verb = _QUERY_VERB.match(sql)
+        table = _QUERY_TABLE.search(sql)
+        kind = verb.group(1).upper() if verb else 'OTHER'
+        if table:
+            kind = f"{kind} {table.group(1)}"
+        # Statements built with a variable number of placeholders stay bounded
+        if len(_query_kinds) < 1000:
+            _query_kinds[sql] = kind
+    return kind
+
+def current_route():
+    if has_request_context():
+        return request.url_rule.rule if request.url_rule else 'unmatched'
+    return 'background'
+
+class InstrumentedCursor:
+    """
+    Cursor wrapper that times each statement from execute() through its fetches
+    and counts fetched rows. A statement is recorded (in the metrics and, above
+    the threshold, the slow-query log) at the next execute() or close().
+    """
+
+    __slots__ = ('_cursor', '_kind', '_elapsed', '_rows', '_operation', '_params', '_many')
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self._kind = None
+        self._elapsed = 0.0
+        self._rows = 0
+        self._operation = None
+        self._params = None
+        self._many = False
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def _record(self):
+        if self._kind is None:
+            return
+        route = current_route()
+        if METRICS_CONFIG['enabled']:
+            query_latency.observe((route, self._kind), self._elapsed)
+            if self._rows:
+                query_rows.inc((route, self._kind), self._rows)
+        if SLOW_QUERY_CONFIG['enabled'] and self._elapsed >= slow_query_log.threshold:
+            rows = self._rows or max(self._cursor.rowcount or 0, 0)
+            slow_query_log.record(route, self._kind, self._operation, self._params, self._elapsed, rows, self._many)
+        self._kind = None
+
+    def _begin(self, operation, params, many):
+        self._record()
+        self._kind, self._elapsed, self._rows = query_kind(operation), 0.0, 0
+        self._operation, self._params, self._many = operation, params, many
+
+    def _timed(self, method, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            self._elapsed += time.perf_counter() - started
+
+    def execute(self, operation, params=(), *args, **kwargs):
+        self._begin(operation, params, False)
+        return self._timed(self._cursor.execute, operation, params, *args, **kwargs)
+
+    def executemany(self, operation, seq_params, *args, **kwargs):
+        self._begin(operation, seq_params, True)
+        return self._timed(self._cursor.executemany, operation, seq_params, *args, **kwargs)
+
+    def fetchone(self):
+        row = self._timed(self._cursor.fetchone)
+        if row is not None:
+            self._rows += 1
+        return row
+
+    def fetchmany(self, *args, **kwargs):
+        rows = self._timed(self._cursor.fetchmany, *args, **kwargs)
+        self._rows += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._timed(self._cursor.fetchall)
+        self._rows += len(rows)
+        return rows
+
+    def close(self):
+        self._record()
+        return self._cursor.close()
+
+@app.before_request
+def start_request_timer():
+    if METRICS_CONFIG['enabled']:
+        g.metrics_started = time.perf_counter()
+        with _in_flight_lock:
+            _in_flight["requests"] += 1
+
+@app.after_request
+def record_request_metrics(response):
+    """Registered before the other after_request hooks, so it runs last and includes them"""
+    started = g.pop('metrics_started', None)
+    if started is not None:
+        request_latency.observe((request.method, current_route(), str(response.status_code)), time.perf_counter() - started)
+        g.metrics_in_flight = True
+    return response
+
+@app.teardown_request
+def finish_request_metrics(exception=None):
+    # Streamed responses stay in flight until their stream closes
+    started = g.pop('metrics_started', None)
+    if started is not None:
+        # An unhandled exception skipped after_request
+        request_latency.observe((request.method, current_route(), '500'), time.perf_counter() - started)
+    if started is not None or g.pop('metrics_in_flight', False):
+        with _in_flight_lock:
+            _in_flight["requests"] -= 1
+
+def _stats_samples(prefix, help_text, stats):
+    """Numeric fields of a stats() snapshot as untyped samples"""
+    lines = []
+    for key, value in stats.items():
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            continue
+        name = f"{prefix}_{key}"
+        lines += [f"# HELP {name} {help_text} ({key})", f"# TYPE {name} untyped", f"{name} {value}"]
+    return lines
+
+def render_metrics():
+    """All metrics in the Prometheus text exposition format (version 0.0.4)"""
+    with _in_flight_lock:
+        in_flight = _in_flight["requests"]
+    lines = [
+        "# HELP iot_http_requests_in_flight Requests being handled, including open streams",
+        "# TYPE iot_http_requests_in_flight gauge",
+        f"iot_http_requests_in_flight {in_flight}"
+    ]
+    for metric in (request_latency, query_latency, query_rows, pool_wait):
+        lines += metric.render()
+    lines += _stats_samples('iot_db_pool', "Connection pool", db_pool.stats())
+    lines += _stats_samples('iot_storage', "Storage backend", storage.stats())
+    lines += _stats_samples('iot_reading_cache', "Latest-readings cache", reading_cache.stats())
+    lines += _stats_samples('iot_ingest', "Write-behind ingest buffer", ingest_buffer.stats())
+    lines += _stats_samples('iot_stream', "Live reading stream", reading_broadcaster.stats())
+    lines += _stats_samples('iot_jobs', "Background jobs", job_executor.stats())
+    return '\n'.join(lines) + '\n'
+
+# ========================
+# SLOW QUERY LOG
+# ========================
+
+SLOW_QUERY_CONFIG = {
+    'enabled': os.environ.get('SLOW_QUERY_LOG', '1') == '1',
+    'threshold_ms': float(os.environ.get('SLOW_QUERY_MS', 200)),          # statements at least this slow are logged
+    'capacity': int(os.environ.get('SLOW_QUERY_CAPACITY', 200)),           # records kept in the ring
+    'sample_rate': float(os.environ.get('SLOW_QUERY_SAMPLE_RATE', 1.0)),  # fraction of slow statements kept as records
+    'max_shapes': int(os.environ.get('SLOW_QUERY_MAX_SHAPES', 500)),       # distinct normalized statements tracked
+    'explain': os.environ.get('SLOW_QUERY_EXPLAIN', '1') == '1'
+}
+
+_SQL_STRING = re.compile(r"'(?:[^'\\]|\\.|'')*'")
+_SQL_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_SQL_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)(?:\s*,\s*\(\s*\?(?:\s*,\s*\?)*\s*\))*')
+
+def normalize_sql(sql):
+    """
+    Statement shape: literals and placeholders become ?, IN lists and
+    multi-row VALUES collapse to (...), whitespace is collapsed.
+    """
+    sql = ' '.join(sql.split())
+    sql = _SQL_STRING.sub('?', sql.replace('%s', '?'))
+    sql = _SQL_NUMBER.sub('?', sql)
+    return _SQL_LIST.sub('(...)', sql)
+
+def _fingerprint(value):
+    return hashlib.sha1(repr(value).encode()).hexdigest()[:12]
+
+class SlowQueryLog:
+    """
+    Bounded ring of slow statement executions plus per-shape totals. The first
+    time a SELECT, UPDATE or DELETE shape is seen, a background thread asks
+    the storage backend to EXPLAIN it once, using that execution's parameters.
+    """
+
+    EXPLAIN_VERBS = ('SELECT', 'UPDATE', 'DELETE')
+
+    def __init__(self, threshold_ms=200, capacity=200, sample_rate=1.0, max_shapes=500, explain=True):
+        self.threshold = threshold_ms / 1000
+        self.sample_rate = sample_rate
+        self.max_shapes = max_shapes
+        self.explain = explain
+        self._records = collections.deque(maxlen=capacity)
+        self._shapes = {}
+        self._dropped_shapes = 0
+        self._lock = threading.Lock()
+        self._explain_queue = queue.Queue(maxsize=100)
+        self._thread = None
+
+    def record(self, route, kind, operation, params, elapsed, rows, many=False):
+        normalized = normalize_sql(operation)
+        shape = _fingerprint(normalized)
+        duration_ms = round(elapsed * 1000, 3)
+        now = datetime.now().isoformat()
+        with self._lock:
+            stats = self._shapes.get(shape)
+            new_shape = stats is None
+            if new_shape:
+                if len(self._shapes) >= self.max_shapes:
+                    self._dropped_shapes += 1
+                    return
+                stats = self._shapes[shape] = {
+                    "shape": shape,
+                    "sql": normalized,
+                    "query": kind,
+                    "count": 0,
+                    "total_ms": 0.0,
+                    "max_ms": 0.0,
+                    "first_seen": now,
+                    "last_seen": now,
+                    "explain": None,
+                    "explain_error": None
+                }
+            stats["count"] += 1
+            stats["total_ms"] = round(stats["total_ms"] + duration_ms, 3)
+            stats["max_ms"] = max(stats["max_ms"], duration_ms)
+            stats["last_seen"] = now
+            if self.sample_rate >= 1 or random.random() < self.sample_rate:
+                self._records.append({
+                    "at": now,
+                    "route": route,
+                    "shape": shape,
+                    "sql": normalized,
+                    "params_fingerprint": _fingerprint(params) if params is not None else None,
+                    "param_count": len(params) if params is not None else 0,
+                    "executemany": many,
+                    "duration_ms": duration_ms,
+                    "rows": rows
+                })
+        if new_shape and self.explain and not many and kind.split()[0] in self.EXPLAIN_VERBS and ' ' in kind:
+            self._queue_explain(shape, operation, params)
+
+    def _queue_explain(self, shape, operation, params):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._explain_loop, name="slow-query-explain", daemon=True)
+                    self._thread.start()
+        try:
+            self._explain_queue.put_nowait((shape, operation, params))
+        except queue.Full:
+            pass
+
+    def _explain_loop(self):
+        while True:
+            shape, operation, params = self._explain_queue.get()
+            plan, error = storage.explain(operation, params)
+            with self._lock:
+                stats = self._shapes.get(shape)
+                if stats is not None:
+                    stats["explain"], stats["explain_error"] = plan, error
+
+    def snapshot(self, limit=50):
+        """Newest records first and shapes by total time"""
+        with self._lock:
+            records = list(self._records)[-limit:][::-1] if limit else []
+            shapes = sorted((dict(stats) for stats in self._shapes.values()), key=lambda stats: -stats["total_ms"])
+            dropped = self._dropped_shapes
+        return {
+            "threshold_ms": self.threshold * 1000,
+            "sample_rate": self.sample_rate,
+            "capacity": self._records.maxlen,
+            "dropped_shapes": dropped,
+            "records": records,
+            "shapes": shapes
+        }
+
+    def clear(self):
+        with self._lock:
+            self._records.clear()
+            self._shapes.clear()
+            self._dropped_shapes = 0
+
+slow_query_log = SlowQueryLog(
+    threshold_ms=SLOW_QUERY_CONFIG['threshold_ms'],
+    capacity=SLOW_QUERY_CONFIG['capacity'],
+    sample_rate=SLOW_QUERY_CONFIG['sample_rate'],
+    max_shapes=SLOW_QUERY_CONFIG['max_shapes'],
+    explain=SLOW_QUERY_CONFIG['explain']
+)
+
+# ========================
+# JSON AND RESPONSE COMPRESSION
+# ========================
+
+# Large JSON responses are compressed when the client sends Accept-Encoding
+COMPRESS_CONFIG = {
+    'enabled': os.environ.get('RESPONSE_COMPRESSION', '1') == '1',
+    'min_size': int(os.environ.get('RESPONSE_COMPRESS_MIN_SIZE', 1024)),  # bytes; smaller bodies are sent as-is
+    'level': int(os.environ.get('RESPONSE_COMPRESS_LEVEL', 6)),
+    'mimetypes': ('application/json', 'text/html', 'text/plain')
+}
+
+def _json_default(value):
+    """Types neither encoder handles natively; datetimes are ISO 8601 on both paths"""
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    if hasattr(value, '__html__'):
+        return str(value.__html__())
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    JSON provider backed by orjson when it is installed (datetimes, dataclasses
+    and UUIDs are encoded natively), falling back to the standard library.
+    Calls that pass encoder options use the standard library.
+    """
+
+    def dumps(self, obj, **kwargs):
+        if orjson is not None and not kwargs:
+            return self._orjson_dumps(obj).decode()
+        kwargs.setdefault('default', _json_default)
+        kwargs.setdefault('ensure_ascii', self.ensure_ascii)
+        kwargs.setdefault('sort_keys', self.sort_keys)
+        return json.dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        if orjson is not None and not kwargs:
+            return orjson.loads(s)
+        return json.loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        if orjson is None:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        pretty = self.compact is False or (self.compact is None and self._app.debug)
+        body = self._orjson_dumps(obj, orjson.OPT_INDENT_2 if pretty else 0)
+        return self._app.response_class(body + b'\n', mimetype=self.mimetype)
+
+    def _orjson_dumps(self, obj, option=0):
+        option |= orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=_json_default, option=option)
+
+app.json = FastJSONProvider(app)
+
+def decode_sensor_data(readings):
+    """
+    Parse the sensor_data column (JSON text from MySQL or the archive) into
+    an object in place so API responses embed it instead of re-escaping it.
+    Returns the readings for chaining.
+    """
+    for reading in readings:
+        sensor_data = reading.get('sensor_data')
+        if isinstance(sensor_data, (str, bytes)):
+            reading['sensor_data'] = app.json.loads(sensor_data) if sensor_data else None
+    return readings
+
+def _choose_encoding(accept_encoding):
+    for encoding in ('gzip', 'deflate'):
+        if accept_encoding[encoding] > 0:
+            return encoding
+    return None
+
+@app.after_request
+def compress_response(response):
+    """gzip (or deflate) buffered responses above COMPRESS_CONFIG['min_size']"""
+    if not COMPRESS_CONFIG['enabled'] or response.direct_passthrough or response.is_streamed:
+        return response
+    if response.status_code != 200 or 'Content-Encoding' in response.headers:
+        return response
+    if response.mimetype not in COMPRESS_CONFIG['mimetypes']:
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = _choose_encoding(request.accept_encodings)
+    if encoding is None or response.content_length is None or response.content_length < COMPRESS_CONFIG['min_size']:
+        return response
+
+    body = response.get_data()
+    if encoding == 'gzip':
+        compressor = zlib.compressobj(COMPRESS_CONFIG['level'], zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    else:
+        compressor = zlib.compressobj(COMPRESS_CONFIG['level'])
+    response.set_data(compressor.compress(body) + compressor.flush())
+    response.headers['Content-Encoding'] = encoding
+    # The compressed bytes differ from the identity representation
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+# ========================
+# SCHEMA MIGRATIONS
+# ========================
+
+# Ordered list of (version, description, function(cursor)) schema steps
+MIGRATIONS = []
+
+def migration(version, description):
+    """Register a schema migration step; versions must be unique and increasing"""
+    def decorator(func):
+        if MIGRATIONS and version <= MIGRATIONS[-1][0]:
+            raise ValueError(f"Migration {version} must be greater than {MIGRATIONS[-1][0]}")
+        MIGRATIONS.append((version, description, func))
+        return func
+    return decorator
+
+def index_exists(cursor, table, index_name):
+    """Check whether an index already exists on a table in the current database"""
+    cursor.execute("""
+        SELECT COUNT(*) FROM information_schema.statistics
+        WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+    """, (table, index_name))
+    return cursor.fetchone()[0] > 0
+
+def create_index_online(cursor, table, index_name, columns):
+    """Add an index without blocking concurrent reads and writes (InnoDB online DDL)"""
+    if index_exists(cursor, table, index_name):
+        return
+    cursor.execute(
+        f"ALTER TABLE {table} ADD INDEX {index_name} ({columns}), ALGORITHM=INPLACE, LOCK=NONE"
+    )
+
+@migration(1, "Create iot_readings table")
+def _migration_create_readings(cursor):
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS iot_readings (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        device_id VARCHAR(100) NOT NULL,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+        sensor_data JSON,
+        temperature FLOAT,
+        humidity FLOAT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+
+@migration(2, "Index iot_readings by (device_id, timestamp)")
+def _migration_device_timestamp_index(cursor):
+    create_index_online(cursor, 'iot_readings', 'idx_device_timestamp', 'device_id, timestamp')
+
+@migration(3, "Index iot_readings by timestamp")
+def _migration_timestamp_index(cursor):
+    create_index_online(cursor, 'iot_readings', 'idx_timestamp', 'timestamp')
+
+def run_migrations(connection):
+    """Apply pending migrations in order and record them in schema_version"""
+    cursor = connection.cursor(buffered=True)
+    try:
+        # Serialise concurrent app instances starting up against the same database
+        cursor.execute("SELECT GET_LOCK('iot_schema_migrations', 60)")
+        if cursor.fetchone()[0] != 1:
+            raise Error(msg="Could not acquire schema migration lock")
+        
+        try:
+            cursor.execute("""
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INT PRIMARY KEY,
+                description VARCHAR(255) NOT NULL,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """)
+            cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+            current = cursor.fetchone()[0]
+            
+            applied = []
+            for version, description, step in MIGRATIONS:
+                if version <= current:
+                    continue
+                print(f"Applying migration {version}: {description}")
+                step(cursor)
+                cursor.execute(
+                    "INSERT INTO schema_version (version, description) VALUES (%s, %s)",
+                    (version, description)
+                )
+                connection.commit()
+                applied.append(version)
+            
+            # The promoted sensor fields come from configuration, so they are reconciled on every run
+            promoted = SensorFields.sync(cursor)
+            if promoted:
+                connection.commit()
+                applied.append(f"sensor fields {', '.join(promoted)}")
+            return applied
+        finally:
+            cursor.execute("SELECT RELEASE_LOCK('iot_schema_migrations')")
+            cursor.fetchone()
+    finally:
+        cursor.close()
+
+def init_mysql_database():
+    """Create the MySQL database if needed and apply any pending schema migrations"""
+    connection = get_db_connection()
+    if connection:
+        try:
+            cursor = connection.cursor()
+            
+            # Create database if it doesn't exist
+            cursor.execute(f"CREATE DATABASE IF NOT EXISTS `{DB_CONFIG['database']}`")
+            cursor.execute(f"USE `{DB_CONFIG['database']}`")
+            
+            applied = run_migrations(connection)
+            print(f"Database ready, applied migrations: {applied or 'none'}")
+            
+            if PARTITION_CONFIG['enabled']:
+                partition_cursor = connection.cursor(buffered=True)
+                if Partitions.partition_table(
+                    partition_cursor,
+                    PARTITION_CONFIG['granularity'],
+                    PARTITION_CONFIG['precreate'],
+                    PARTITION_CONFIG['retention_days']
+                ):
+                    print("iot_readings converted to a partitioned table")
+                partition_cursor.close()
+            
+        except Error as e:
+            print(f"Error initializing database: {e}")
+        finally:
+            cursor.close()
+            connection.close()
+
+def init_database():
+    """Initialize the configured storage backend's schema"""
+    try:
+        storage.init()
+    except StorageError as e:
+        print(f"Error initializing database: {e}")
+
+@app.cli.command('migrate')
+def migrate_command():
+    """Apply pending schema migrations"""
+    init_database()
+
+# ========================
+# DEVICE SUMMARY STATISTICS
+# ========================
+
+@migration(4, "Create device_stats summary table")
+def _migration_device_stats(cursor):
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS device_stats (
+        device_id VARCHAR(100) PRIMARY KEY,
+        last_seen DATETIME NULL,
+        total_readings BIGINT NOT NULL DEFAULT 0,
+        temperature_sum DOUBLE NOT NULL DEFAULT 0,
+        temperature_count BIGINT NOT NULL DEFAULT 0,
+        humidity_sum DOUBLE NOT NULL DEFAULT 0,
+        humidity_count BIGINT NOT NULL DEFAULT 0,
+        last_temperature FLOAT NULL,
+        last_humidity FLOAT NULL,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+        INDEX idx_last_seen (last_seen)
+    )
+    """)
+    DeviceStats.rebuild(cursor)
+
+class DeviceStats:
+    """
+    Incrementally maintained per-device summary (device_stats table).
+    Every write path calls these helpers inside its own transaction with a
+    plain buffered cursor, so /devices and per-device totals read O(devices)
+    rows instead of aggregating iot_readings.
+    """
+    
+    @staticmethod
+    def record_inserts(cursor, rows):
+        """Add newly inserted (device_id, timestamp, temperature, humidity, ...) rows"""
+        latest = {}
+        for row in rows:
+            device_id, timestamp, temperature, humidity = row[:4]
+            if device_id not in latest or timestamp >= latest[device_id][0]:
+                latest[device_id] = (timestamp, temperature, humidity)
+        deltas = stats_deltas((row[0], row[2], row[3]) for row in rows)
+        
+        # Sorted so concurrent multi-device batches lock rows in the same order
+        params = [
+            (device_id, *latest[device_id], *deltas[device_id])
+            for device_id in sorted(deltas)
+        ]
+        cursor.executemany("""
+        INSERT INTO device_stats
+            (device_id, last_seen, last_temperature, last_humidity, total_readings,
+             temperature_sum, temperature_count, humidity_sum, humidity_count)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            last_temperature = IF(last_seen IS NULL OR VALUES(last_seen) >= last_seen,
+                                  VALUES(last_temperature), last_temperature),
+            last_humidity = IF(last_seen IS NULL OR VALUES(last_seen) >= last_seen,
+                               VALUES(last_humidity), last_humidity),
+            last_seen = GREATEST(COALESCE(last_seen, VALUES(last_seen)), VALUES(last_seen)),
+            total_readings = total_readings + VALUES(total_readings),
+            temperature_sum = temperature_sum + VALUES(temperature_sum),
+            temperature_count = temperature_count + VALUES(temperature_count),
+            humidity_sum = humidity_sum + VALUES(humidity_sum),
+            humidity_count = humidity_count + VALUES(humidity_count),
+            version = version + 1
+        """, params)
+    
+    @staticmethod
+    def record_changes(cursor, removed=(), added=()):
+        """
+        Apply updated or deleted readings given as (device_id, temperature, humidity)
+        triples: `removed` are subtracted and `added` are added back. The latest
+        reading of each affected device is then re-read with one index seek.
+        """
+        deltas = stats_deltas(removed, sign=-1)
+        for device_id, delta in stats_deltas(added).items():
+            current = deltas.setdefault(device_id, [0, 0.0, 0, 0.0, 0])
+            for i, value in enumerate(delta):
+                current[i] += value
+        if not deltas:
+            return
+        
+        device_ids = sorted(deltas)
+        cursor.executemany("""
+        INSERT INTO device_stats
+            (device_id, total_readings, temperature_sum, temperature_count, humidity_sum, humidity_count)
+        VALUES (%s, %s, %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            total_readings = total_readings + VALUES(total_readings),
+            temperature_sum = temperature_sum + VALUES(temperature_sum),
+            temperature_count = temperature_count + VALUES(temperature_count),
+            humidity_sum = humidity_sum + VALUES(humidity_sum),
+            humidity_count = humidity_count + VALUES(humidity_count),
+            version = version + 1
+        """, [(device_id, *deltas[device_id]) for device_id in device_ids])
+        DeviceStats.refresh_latest(cursor, device_ids)
+    
+    @staticmethod
+    def refresh_latest(cursor, device_ids):
+        """Re-read last_seen and last values for devices; drop rows left with no readings"""
+        for device_id in device_ids:
+            cursor.execute("""
+            SELECT timestamp, temperature, humidity FROM iot_readings
+            WHERE device_id = %s
+            ORDER BY timestamp DESC, id DESC
+            LIMIT 1
+            """, (device_id,))
+            latest = cursor.fetchone()
+            if latest is None:
+                archived = reading_archive.read(device_id, limit=1)
+                if not archived:
+                    cursor.execute("DELETE FROM device_stats WHERE device_id = %s", (device_id,))
+                    continue
+                latest = (archived[0]['timestamp'], archived[0]['temperature'], archived[0]['humidity'])
+            cursor.execute("""
+            UPDATE device_stats
+            SET last_seen = %s, last_temperature = %s, last_humidity = %s
+            WHERE device_id = %s
+            """, (*latest, device_id))
+    
+    @staticmethod
+    def remove_device(cursor, device_id):
+        """Forget a device whose readings were all deleted"""
+        cursor.execute("DELETE FROM device_stats WHERE device_id = %s", (device_id,))
+    
+    @staticmethod
+    def rebuild(cursor):
+        """Recompute device_stats from iot_readings (full scan; for repair and first install)"""
+        cursor.execute("DELETE FROM device_stats")
+        cursor.execute("""
+        INSERT INTO device_stats
+            (device_id, last_seen, total_readings, temperature_sum, temperature_count,
+             humidity_sum, humidity_count)
+        SELECT device_id, MAX(timestamp), COUNT(*),
+               COALESCE(SUM(temperature), 0), COUNT(temperature),
+               COALESCE(SUM(humidity), 0), COUNT(humidity)
+        FROM iot_readings
+        GROUP BY device_id
+        """)
+        cursor.execute("SELECT device_id FROM device_stats")
+        device_ids = [row[0] for row in cursor.fetchall()]
+        DeviceStats.refresh_latest(cursor, device_ids)
+        return len(device_ids)
+    
+    @staticmethod
+    def device_total(cursor, device_id):
+        """Number of readings stored for a device"""
+        cursor.execute("SELECT total_readings FROM device_stats WHERE device_id = %s", (device_id,))
+        row = cursor.fetchone()
+        return row[0] if row else 0
+
+def rebuild_device_stats():
+    """Recompute the device_stats summary table from iot_readings (one full-table aggregation)"""
+    error = unsupported_feature('device_stats_rebuild')
+    if error:
+        return {"success": False, "error": error}
+    connection = get_db_connection()
+    if not connection:
+        return {"success": False, "error": "Database connection failed"}
+    try:
+        cursor = connection.cursor(buffered=True)
+        devices = DeviceStats.rebuild(cursor)
+        connection.commit()
+        return {"success": True, "devices": devices}
+    except Error as e:
+        connection.rollback()
+        return {"success": False, "error": f"Error rebuilding device_stats: {e}"}
+    finally:
+        cursor.close()
+        connection.close()
+
+@app.cli.command('rebuild-device-stats')
+def rebuild_device_stats_command():
+    """Recompute the device_stats summary table from iot_readings"""
+    result = rebuild_device_stats()
+    print(f"Rebuilt device_stats for {result['devices']} devices" if result['success'] else result['error'])
+
+# ========================
+# LATEST READINGS CACHE
+# ========================
+
+# In-process cache of each device's most recent readings
+CACHE_CONFIG = {
+    'enabled': os.environ.get('READING_CACHE_ENABLED', '1') == '1',
+    'per_device': int(os.environ.get('READING_CACHE_PER_DEVICE', 100)),      # readings kept per device
+    'max_devices': int(os.environ.get('READING_CACHE_MAX_DEVICES', 1000)),   # LRU eviction beyond this
+    'ttl': float(os.environ.get('READING_CACHE_TTL', 60)),                   # seconds before a device reloads
+    'max_bytes': int(os.environ.get('READING_CACHE_MAX_BYTES', 64 * 1024 * 1024))  # approximate memory cap
+}
+
+# Number of readings returned by GET /api/data/<device_id>
+DEVICE_DATA_LIMIT = 100
+
+class _CacheEntry:
+    __slots__ = ('readings', 'complete', 'loaded_at', 'size', 'version')
+    
+    def __init__(self, readings, complete, maxlen, version=None):
+        self.readings = collections.deque(readings, maxlen=maxlen)  # newest first
+        self.complete = complete  # True when the deque holds every reading of the device
+        self.loaded_at = time.monotonic()
+        self.version = version  # device_stats.version the readings correspond to
+        self.size = sum(ReadingCache.estimate_size(reading) for reading in self.readings)
+
+class ReadingCache:
+    """
+    Per-device ring buffers of the newest readings with LRU eviction across
+    devices, a TTL and an approximate memory cap. Ingest paths append to warm
+    entries; update and delete paths invalidate them.
+    """
+    
+    def __init__(self, per_device=100, max_devices=1000, ttl=60, max_bytes=64 * 1024 * 1024, enabled=True):
+        self.per_device = per_device
+        self.max_devices = max_devices
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self._entries = collections.OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "invalidations": 0,
+            "stale": 0,
+            "appends": 0
+        }
+    
+    @staticmethod
+    def estimate_size(reading):
+        """Rough memory footprint of a cached reading dict in bytes"""
+        return sys.getsizeof(reading) + sum(sys.getsizeof(value) for value in reading.values())
+    
+    def _drop(self, device_id):
+        entry = self._entries.pop(device_id, None)
+        if entry is not None:
+            self._bytes -= entry.size
+        return entry
+    
+    def _evict(self):
+        while self._entries and (len(self._entries) > self.max_devices or self._bytes > self.max_bytes):
+            device_id = next(iter(self._entries))
+            self._drop(device_id)
+            self._stats["evictions"] += 1
+    
+    def get(self, device_id, limit, version=None):
+        """
+        Return the newest `limit` readings of a device, or None on a miss.
+        With `version` (device_stats.version), an entry built from another
+        version, e.g. after a write by another process, counts as a miss.
+        """
+        if not self.enabled or limit > self.per_device:
+            return None
+        with self._lock:
+            entry = self._entries.get(device_id)
+            if entry is not None and time.monotonic() - entry.loaded_at > self.ttl:
+                self._drop(device_id)
+                self._stats["expirations"] += 1
+                entry = None
+            if entry is not None and version is not None and entry.version != version:
+                self._drop(device_id)
+                self._stats["stale"] += 1
+                entry = None
+            if entry is None or (len(entry.readings) < limit and not entry.complete):
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(device_id)
+            self._stats["hits"] += 1
+            return list(entry.readings)[:limit]
+    
+    def fill(self, device_id, readings, limit, version=None):
+        """Store readings loaded from the database (newest first)"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._drop(device_id)
+            entry = _CacheEntry(readings[:self.per_device], len(readings) < limit, self.per_device, version)
+            self._entries[device_id] = entry
+            self._bytes += entry.size
+            self._evict()
+    
+    def is_warm(self, device_id):
+        """True when the device has an entry that append() would extend"""
+        with self._lock:
+            return self.enabled and device_id in self._entries
+    
+    def append(self, reading, version=None):
+        """
+        Add a newly inserted reading, as stored, to its device's entry if the
+        entry is warm. `version` is device_stats.version after the insert; the
+        entry is dropped instead when another write came in between.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            entry = self._entries.get(reading['device_id'])
+            if entry is None:
+                return
+            readings = entry.readings
+            key = (reading['timestamp'], reading['id'])
+            late = readings and key < (readings[0]['timestamp'], readings[0]['id'])
+            if late or (entry.version is not None and version != entry.version + 1):
+                # Back-dated reading or a missed write: reload rather than splice it into the ring
+                self._drop(reading['device_id'])
+                self._stats["invalidations"] += 1
+                return
+            if len(readings) == readings.maxlen:
+                entry.size -= self.estimate_size(readings[-1])
+                self._bytes -= self.estimate_size(readings[-1])
+                entry.complete = False
+            readings.appendleft(reading)
+            entry.version = version
+            size = self.estimate_size(reading)
+            entry.size += size
+            self._bytes += size
+            self._stats["appends"] += 1
+            self._evict()
+    
+    def invalidate(self, *device_ids):
+        """Forget cached readings for devices whose rows changed"""
+        with self._lock:
+            for device_id in device_ids:
+                if self._drop(device_id) is not None:
+                    self._stats["invalidations"] += 1
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+    
+    def stats(self):
+        """Return hit/miss/eviction counters and current size"""
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                "enabled": self.enabled,
+                "devices": len(self._entries),
+                "readings": sum(len(entry.readings) for entry in self._entries.values()),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hit_ratio": round(self._stats["hits"] / lookups, 4) if lookups else 0.0,
+                **self._stats
+            }
+
+reading_cache = ReadingCache(**CACHE_CONFIG)
+
+# ========================
+# PROMOTED SENSOR FIELDS
+# ========================
+
+# sensor_data keys stored as indexed numbers (column sensor_<key>), so they can be
+# filtered (?battery_lt=20) and aggregated without parsing JSON row by row
+SENSOR_FIELDS = parse_sensor_fields(os.environ.get('PROMOTED_SENSOR_FIELDS', 'light,battery,pressure,motion'))
+
+# Values folded into the rollup tables as <metric>_min/_max/_sum/_count columns
+ROLLUP_METRICS = tuple(column for _, column in reading_metrics(SENSOR_FIELDS))
+BASE_ROLLUP_METRICS = ('temperature', 'humidity')
+
+class SensorFields:
+    """
+    MySQL side of the promoted sensor fields. Each key becomes a STORED
+    generated column, INVISIBLE so SELECT * and the reading dicts keep their
+    shape, indexed by (column, device_id), plus four columns in every rollup
+    table. The list is configuration rather than code, so run_migrations()
+    reconciles it after the numbered steps.
+    """
+    
+    JSON_NUMBER_TYPES = "'INTEGER', 'UNSIGNED INTEGER', 'DOUBLE', 'DECIMAL'"
+    
+    @staticmethod
+    def expression(key):
+        """Generated column expression: JSON numbers, booleans as 1/0, anything else NULL (see sensor_value)"""
+        return (
+            f"CASE WHEN JSON_TYPE(sensor_data->'$.{key}') = 'BOOLEAN' THEN sensor_data->>'$.{key}' = 'true' "
+            f"WHEN JSON_TYPE(sensor_data->'$.{key}') IN ({SensorFields.JSON_NUMBER_TYPES}) "
+            f"THEN CAST(sensor_data->>'$.{key}' AS DOUBLE) END"
+        )
+    
+    @staticmethod
+    def columns(cursor, table):
+        cursor.execute("""
+            SELECT column_name FROM information_schema.columns
+            WHERE table_schema = DATABASE() AND table_name = %s
+        """, (table,))
+        return {row[0] for row in cursor.fetchall()}
+    
+    @staticmethod
+    def sync(cursor, fields=SENSOR_FIELDS):
+        """
+        Add the columns and indexes of newly promoted fields. Adding a stored
+        generated column rebuilds iot_readings, and the rollups are then
+        rebuilt so history includes the new field. Returns the added keys.
+        """
+        added = []
+        reading_columns = SensorFields.columns(cursor, 'iot_readings')
+        rollup_columns = {table: SensorFields.columns(cursor, table) for table, _ in ROLLUP_RESOLUTIONS.values()}
+        for key in fields:
+            column = sensor_column(key)
+            if column not in reading_columns:
+                print(f"Promoting sensor_data.{key} to {column}")
+                cursor.execute(f"""
+                ALTER TABLE iot_readings
+                    ADD COLUMN {column} DOUBLE AS ({SensorFields.expression(key)}) STORED INVISIBLE
+                """)
+                added.append(key)
+            create_index_online(cursor, 'iot_readings', f"idx_{column}", f"{column}, device_id")
+            for table, existing in rollup_columns.items():
+                if f"{column}_min" not in existing:
+                    cursor.execute(f"""
+                    ALTER TABLE {table}
+                        ADD COLUMN {column}_min DOUBLE NULL,
+                        ADD COLUMN {column}_max DOUBLE NULL,
+                        ADD COLUMN {column}_sum DOUBLE NOT NULL DEFAULT 0,
+                        ADD COLUMN {column}_count INT NOT NULL DEFAULT 0
+                    """)
+                    if key not in added:
+                        added.append(key)
+        if added:
+            Rollups.rebuild(cursor)
+        return added
+
+# ========================
+# TIME-BUCKETED ROLLUPS
+# ========================
+
+# Rollup resolutions, finest first: name -> (table, bucket size in seconds)
+ROLLUP_RESOLUTIONS = {
+    '1m': ('reading_rollup_1m', 60),
+    '1h': ('reading_rollup_1h', 3600),
+    '1d': ('reading_rollup_1d', 86400)
+}
+
+# Upper bound on buckets returned by one aggregate query
+AGGREGATE_MAX_BUCKETS = int(os.environ.get('AGGREGATE_MAX_BUCKETS', 5000))
+
+EPOCH = datetime(1970, 1, 1)
+
+def bucket_start(timestamp, seconds):
+    """Truncate a timestamp to the start of its bucket"""
+    offset = int((timestamp - EPOCH).total_seconds()) // seconds * seconds
+    return EPOCH + timedelta(seconds=offset)
+
+def parse_bucket(value):
+    """Parse a bucket size such as '15m', '1h' or '7d' into seconds"""
+    units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+    if not value or value[-1] not in units or not value[:-1].isdigit() or int(value[:-1]) <= 0:
+        raise ValueError("bucket must look like 30s, 15m, 1h or 1d")
+    return int(value[:-1]) * units[value[-1]]
+
+@migration(5, "Create 1m/1h/1d reading rollup tables")
+def _migration_rollups(cursor):
+    for table, _ in ROLLUP_RESOLUTIONS.values():
+        cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {table} (
+            device_id VARCHAR(100) NOT NULL,
+            bucket_start DATETIME NOT NULL,
+            reading_count INT NOT NULL DEFAULT 0,
+            temperature_min FLOAT NULL,
+            temperature_max FLOAT NULL,
+            temperature_sum DOUBLE NOT NULL DEFAULT 0,
+            temperature_count INT NOT NULL DEFAULT 0,
+            humidity_min FLOAT NULL,
+            humidity_max FLOAT NULL,
+            humidity_sum DOUBLE NOT NULL DEFAULT 0,
+            humidity_count INT NOT NULL DEFAULT 0,
+            PRIMARY KEY (device_id, bucket_start)
+        )
+        """)
+    # Promoted sensor field columns are added later by SensorFields.sync()
+    Rollups.rebuild(cursor, BASE_ROLLUP_METRICS)
+
+def _rollup_columns(metrics):
+    return "reading_count, " + ", ".join(
+        f"{metric}_min, {metric}_max, {metric}_sum, {metric}_count" for metric in metrics
+    )
+
+def _rollup_aggregates(metrics):
+    # Aggregates that roll a finer rollup table up into a coarser one
+    return "SUM(reading_count), " + ", ".join(
+        f"MIN({metric}_min), MAX({metric}_max), COALESCE(SUM({metric}_sum), 0), COALESCE(SUM({metric}_count), 0)"
+        for metric in metrics
+    )
+
+def _raw_aggregates(metrics):
+    # Aggregates over raw iot_readings rows
+    return "COUNT(*), " + ", ".join(
+        f"MIN({metric}), MAX({metric}), COALESCE(SUM({metric}), 0), COUNT({metric})" for metric in metrics
+    )
+
+class Rollups:
+    """
+    Per-device min/max/sum/count rollups at 1-minute, 1-hour and 1-day
+    resolution, for temperature, humidity and the promoted sensor fields
+    (ROLLUP_METRICS). Inserts are folded in with upserts; updates and
+    deletes recompute only the affected buckets (1m from raw rows, 1h from
+    1m, 1d from 1h).
+    """
+    
+    COLUMNS = _rollup_columns(ROLLUP_METRICS)
+    ROLLUP_AGGREGATES = _rollup_aggregates(ROLLUP_METRICS)
+    RAW_AGGREGATES = _raw_aggregates(ROLLUP_METRICS)
+    
+    UPSERT = ",\n".join(
+        ["reading_count = reading_count + VALUES(reading_count)"] + [
+            f"{metric}_min = LEAST(COALESCE({metric}_min, VALUES({metric}_min)), "
+            f"COALESCE(VALUES({metric}_min), {metric}_min)), "
+            f"{metric}_max = GREATEST(COALESCE({metric}_max, VALUES({metric}_max)), "
+            f"COALESCE(VALUES({metric}_max), {metric}_max)), "
+            f"{metric}_sum = {metric}_sum + VALUES({metric}_sum), "
+            f"{metric}_count = {metric}_count + VALUES({metric}_count)"
+            for metric in ROLLUP_METRICS
+        ]
+    )
+    
+    @staticmethod
+    def metric_values(row):
+        """ROLLUP_METRICS values of an inserted (device_id, timestamp, temperature, humidity, sensor_json) row"""
+        values = [row[2], row[3]]
+        if SENSOR_FIELDS:
+            sensor_data = json.loads(row[4]) if row[4] else None
+            values += [sensor_value(sensor_data, key) for key in SENSOR_FIELDS]
+        return values
+    
+    @staticmethod
+    def record_inserts(cursor, rows):
+        """Fold newly inserted (device_id, timestamp, temperature, humidity, sensor_json) rows into every resolution"""
+        values = [Rollups.metric_values(row) for row in rows]
+        placeholders = ', '.join(['%s'] * (3 + 4 * len(ROLLUP_METRICS)))
+        for table, seconds in ROLLUP_RESOLUTIONS.values():
+            buckets = {}
+            for row, metrics in zip(rows, values):
+                key = (row[0], bucket_start(row[1], seconds))
+                bucket = buckets.setdefault(key, [0] + [None, None, 0.0, 0] * len(ROLLUP_METRICS))
+                bucket[0] += 1
+                for base, value in zip(range(1, len(bucket), 4), metrics):
+                    if value is None:
+                        continue
+                    bucket[base] = value if bucket[base] is None else min(bucket[base], value)
+                    bucket[base + 1] = value if bucket[base + 1] is None else max(bucket[base + 1], value)
+                    bucket[base + 2] += value
+                    bucket[base + 3] += 1
+            
+            cursor.executemany(f"""
+            INSERT INTO {table} (device_id, bucket_start, {Rollups.COLUMNS})
+            VALUES ({placeholders})
+            ON DUPLICATE KEY UPDATE
+            {Rollups.UPSERT}
+            """, [(*key, *buckets[key]) for key in sorted(buckets)])
+    
+    @staticmethod
+    def recompute(cursor, points):
+        """Recompute the buckets containing the given (device_id, timestamp) points"""
+        source, aggregates, previous_seconds = "iot_readings", Rollups.RAW_AGGREGATES, None
+        for table, seconds in ROLLUP_RESOLUTIONS.values():
+            time_column = "timestamp" if source == "iot_readings" else "bucket_start"
+            for device_id, start in sorted({(d, bucket_start(t, seconds)) for d, t in points if t}):
+                cursor.execute(f"""
+                SELECT {aggregates} FROM {source}
+                WHERE device_id = %s AND {time_column} >= %s AND {time_column} < %s
+                """, (device_id, start, start + timedelta(seconds=seconds)))
+                values = cursor.fetchone()
+                if not values[0]:
+                    cursor.execute(
+                        f"DELETE FROM {table} WHERE device_id = %s AND bucket_start = %s",
+                        (device_id, start)
+                    )
+                    continue
+                cursor.execute(f"""
+                REPLACE INTO {table} (device_id, bucket_start, {Rollups.COLUMNS})
+                VALUES ({', '.join(['%s'] * (2 + len(values)))})
+                """, (device_id, start, *values))
+            source, aggregates = table, Rollups.ROLLUP_AGGREGATES
+    
+    @staticmethod
+    def remove_device(cursor, device_id):
+        """Drop all rollups of a device whose readings were deleted"""
+        for table, _ in ROLLUP_RESOLUTIONS.values():
+            cursor.execute(f"DELETE FROM {table} WHERE device_id = %s", (device_id,))
+    
+    @staticmethod
+    def rebuild(cursor, metrics=ROLLUP_METRICS):
+        """Recompute every rollup table from iot_readings (full scan)"""
+        columns = _rollup_columns(metrics)
+        source, aggregates, time_column = "iot_readings", _raw_aggregates(metrics), "timestamp"
+        for table, seconds in ROLLUP_RESOLUTIONS.values():
+            bucket_sql = (
+                f"DATE_ADD('1970-01-01', INTERVAL "
+                f"FLOOR(TIMESTAMPDIFF(SECOND, '1970-01-01', {time_column}) / {seconds}) * {seconds} SECOND)"
+            )
+            cursor.execute(f"DELETE FROM {table}")
+            cursor.execute(f"""
+            INSERT INTO {table} (device_id, bucket_start, {columns})
+            SELECT device_id, {bucket_sql} AS bucket, {aggregates}
+            FROM {source}
+            WHERE {time_column} IS NOT NULL
+            GROUP BY device_id, bucket
+            """)
+            source, aggregates, time_column = table, _rollup_aggregates(metrics), "bucket_start"
+    
+    @staticmethod
+    def choose_resolution(bucket_seconds):
+        """Pick the coarsest rollup whose bucket size evenly divides the requested one"""
+        chosen = None
+        for name, (_, seconds) in ROLLUP_RESOLUTIONS.items():
+            if bucket_seconds % seconds == 0:
+                chosen = name
+        return chosen
+
+def record_reading_changes(cursor, removed=(), added=()):
+    """
+    Propagate updated or deleted readings to the summary tables.
+    Items are (device_id, timestamp, temperature, humidity) tuples; call after
+    the change has been applied to iot_readings, inside the same transaction.
+    """
+    DeviceStats.record_changes(
+        cursor,
+        removed=[(r[0], r[2], r[3]) for r in removed],
+        added=[(r[0], r[2], r[3]) for r in added]
+    )
+    Rollups.recompute(cursor, [(r[0], r[1]) for r in (*removed, *added)])
+
+def rebuild_rollups():
+    """Recompute the 1m/1h/1d rollup tables from iot_readings (full scan)"""
+    error = unsupported_feature('rollups')
+    if error:
+        return {"success": False, "error": error}
+    connection = get_db_connection()
+    if not connection:
+        return {"success": False, "error": "Database connection failed"}
+    try:
+        cursor = connection.cursor(buffered=True)
+        Rollups.rebuild(cursor)
+        connection.commit()
+        return {"success": True}
+    except Error as e:
+        connection.rollback()
+        return {"success": False, "error": f"Error rebuilding rollups: {e}"}
+    finally:
+        cursor.close()
+        connection.close()
+
+@app.cli.command('rebuild-rollups')
+def rebuild_rollups_command():
+    """Recompute the 1m/1h/1d rollup tables from iot_readings"""
+    result = rebuild_rollups()
+    print("Rebuilt reading rollups" if result['success'] else result['error'])
+
+# ========================
+# PARTITIONING AND RETENTION
+# ========================
+
+# Time partitioning of iot_readings and data retention (both disabled by default)
+PARTITION_CONFIG = {
+    'enabled': os.environ.get('READINGS_PARTITIONED', '0') == '1',
+    'granularity': os.environ.get('READINGS_PARTITION_GRANULARITY', 'day'),   # 'day' or 'month'
+    'precreate': int(os.environ.get('READINGS_PARTITION_PRECREATE', 7)),      # future partitions kept ready
+    'retention_days': int(os.environ.get('READINGS_RETENTION_DAYS', 0)),      # 0 keeps readings forever
+    'maintenance_interval': int(os.environ.get('READINGS_MAINTENANCE_INTERVAL', 3600)),
+    'purge_chunk_size': int(os.environ.get('READINGS_PURGE_CHUNK_SIZE', 1000))
+}
+
+@migration(6, "Create retention_policies table")
+def _migration_retention_policies(cursor):
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS retention_policies (
+        device_id VARCHAR(100) PRIMARY KEY,
+        retention_days INT NOT NULL,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+    )
+    """)
+
+class Partitions:
+    """RANGE partitioning of iot_readings on TO_DAYS(timestamp) by day or month"""
+    
+    # TO_DAYS(d) == d.toordinal() + TO_DAYS_OFFSET
+    TO_DAYS_OFFSET = 365
+    
+    @staticmethod
+    def period_start(day, granularity):
+        return day.replace(day=1) if granularity == 'month' else day
+    
+    @staticmethod
+    def next_period(start, granularity):
+        if granularity == 'month':
+            return (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+        return start + timedelta(days=1)
+    
+    @staticmethod
+    def name(start, granularity):
+        return f"p{start.strftime('%Y%m' if granularity == 'month' else '%Y%m%d')}"
+    
+    @staticmethod
+    def definition(start, granularity):
+        """Partition holding the period that begins at `start`"""
+        end = Partitions.next_period(start, granularity)
+        return f"PARTITION {Partitions.name(start, granularity)} VALUES LESS THAN (TO_DAYS('{end.isoformat()}'))"
+    
+    @staticmethod
+    def list(cursor):
+        """Return [(name, upper bound date or None for MAXVALUE)] in order"""
+        cursor.execute("""
+        SELECT partition_name, partition_description FROM information_schema.partitions
+        WHERE table_schema = DATABASE() AND table_name = 'iot_readings' AND partition_name IS NOT NULL
+        ORDER BY partition_ordinal_position
+        """)
+        partitions = []
+        for name, description in cursor.fetchall():
+            if description == 'MAXVALUE':
+                partitions.append((name, None))
+            else:
+                partitions.append((name, date.fromordinal(int(description) - Partitions.TO_DAYS_OFFSET)))
+        return partitions
+    
+    @staticmethod
+    def partition_table(cursor, granularity, precreate, retention_days=0):
+        """
+        Convert iot_readings to a partitioned table. Rebuilds the table, so run
+        it during a maintenance window. The primary key becomes (id, timestamp)
+        because MySQL requires the partitioning column in every unique key.
+        """
+        if granularity not in ('day', 'month'):
+            raise ValueError("Partition granularity must be 'day' or 'month'")
+        if Partitions.list(cursor):
+            return False
+        today = date.today()
+        first = Partitions.period_start(today - timedelta(days=retention_days), granularity)
+        
+        definitions = [f"PARTITION p_start VALUES LESS THAN (TO_DAYS('{first.isoformat()}'))"]
+        start = first
+        horizon = today + timedelta(days=precreate * (31 if granularity == 'month' else 1))
+        while start <= horizon:
+            definitions.append(Partitions.definition(start, granularity))
+            start = Partitions.next_period(start, granularity)
+        definitions.append("PARTITION p_future VALUES LESS THAN MAXVALUE")
+        
+        cursor.execute("UPDATE iot_readings SET timestamp = created_at WHERE timestamp IS NULL")
+        cursor.execute("""
+        ALTER TABLE iot_readings
+            MODIFY timestamp DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            DROP PRIMARY KEY,
+            ADD PRIMARY KEY (id, timestamp)
+        """)
+        cursor.execute(
+            f"ALTER TABLE iot_readings PARTITION BY RANGE (TO_DAYS(timestamp)) ({', '.join(definitions)})"
+        )
+        return True
+    
+    @staticmethod
+    def precreate(cursor, granularity, count):
+        """Split p_future so the next `count` periods have their own partitions"""
+        partitions = Partitions.list(cursor)
+        bounds = [bound for _, bound in partitions if bound is not None]
+        if not bounds:
+            return []
+        
+        start = bounds[-1]
+        horizon = date.today() + timedelta(days=count * (31 if granularity == 'month' else 1))
+        definitions, created = [], []
+        while start <= horizon:
+            definitions.append(Partitions.definition(start, granularity))
+            created.append(Partitions.name(start, granularity))
+            start = Partitions.next_period(start, granularity)
+        if definitions:
+            # p_future is empty while partitions are pre-created ahead, so this is a metadata change
+            definitions.append("PARTITION p_future VALUES LESS THAN MAXVALUE")
+            cursor.execute(
+                f"ALTER TABLE iot_readings REORGANIZE PARTITION p_future INTO ({', '.join(definitions)})"
+            )
+        return created
+    
+    @staticmethod
+    def drop_before(cursor, cutoff):
+        """
+        Drop every partition whose rows are all older than `cutoff`.
+        device_stats is adjusted from one aggregate pass over each partition;
+        rollups are kept so history stays queryable at coarse resolution.
+        """
+        expired = [name for name, bound in Partitions.list(cursor) if bound is not None and bound <= cutoff]
+        for name in expired:
+            cursor.execute(f"""
+            SELECT device_id, COUNT(*), COALESCE(SUM(temperature), 0), COUNT(temperature),
+                   COALESCE(SUM(humidity), 0), COUNT(humidity)
+            FROM iot_readings PARTITION ({name})
+            GROUP BY device_id
+            """)
+            deltas = cursor.fetchall()
+            cursor.execute(f"ALTER TABLE iot_readings DROP PARTITION {name}")
+            if deltas:
+                cursor.executemany("""
+                UPDATE device_stats
+                SET total_readings = total_readings - %s,
+                    temperature_sum = temperature_sum - %s, temperature_count = temperature_count - %s,
+                    humidity_sum = humidity_sum - %s, humidity_count = humidity_count - %s,
+                    version = version + 1
+                WHERE device_id = %s
+                """, [(*row[1:], row[0]) for row in deltas])
+                DeviceStats.refresh_latest(cursor, [row[0] for row in deltas])
+                reading_cache.invalidate(*[row[0] for row in deltas])
+        return expired
+
+class Retention:
+    """Global and per-device retention of raw readings"""
+    
+    @staticmethod
+    def policies(cursor):
+        cursor.execute("SELECT device_id, retention_days FROM retention_policies")
+        return dict(cursor.fetchall())
+    
+    @staticmethod
+    def purge_device(connection, device_id, cutoff, chunk_size=1000, pause=0.05):
+        """Delete a device's readings older than `cutoff` in short primary-key chunks"""
+        purged = 0
+        cursor = connection.cursor(buffered=True)
+        try:
+            while True:
+                cursor.execute("""
+                SELECT id, temperature, humidity FROM iot_readings
+                WHERE device_id = %s AND timestamp < %s
+                ORDER BY timestamp
+                LIMIT %s
+                FOR UPDATE
+                """, (device_id, cutoff, chunk_size))
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+                placeholders = ', '.join(['%s'] * len(rows))
+                cursor.execute(f"DELETE FROM iot_readings WHERE id IN ({placeholders})", [row[0] for row in rows])
+                DeviceStats.record_changes(cursor, removed=[(device_id, row[1], row[2]) for row in rows])
+                connection.commit()
+                purged += len(rows)
+                if len(rows) < chunk_size:
+                    break
+                time.sleep(pause)
+        finally:
+            cursor.close()
+        if purged:
+            reading_cache.invalidate(device_id)
+        return purged
+    
+    @staticmethod
+    def apply(connection):
+        """
+        Enforce retention. Partitions older than the longest retention in force
+        are dropped whole; devices with a shorter effective retention are
+        purged in chunks. Returns a summary of what was removed.
+        """
+        cursor = connection.cursor(buffered=True)
+        try:
+            overrides = Retention.policies(cursor)
+            global_days = PARTITION_CONFIG['retention_days']
+            cursor.execute("SELECT device_id FROM device_stats")
+            devices = [row[0] for row in cursor.fetchall()]
+            
+            effective = {device_id: overrides.get(device_id, global_days) for device_id in devices}
+            summary = {"dropped_partitions": [], "purged_readings": {}}
+            
+            # Whole partitions can only go once every device's retention has passed
+            if global_days and all(days for days in effective.values()):
+                horizon_days = max([global_days, *effective.values()])
+                if PARTITION_CONFIG['enabled']:
+                    summary["dropped_partitions"] = Partitions.drop_before(
+                        cursor, date.today() - timedelta(days=horizon_days)
+                    )
+                    connection.commit()
+            else:
+                horizon_days = None
+            
+            for device_id, days in sorted(effective.items()):
+                if not days or (horizon_days is not None and days >= horizon_days and PARTITION_CONFIG['enabled']):
+                    continue
+                purged = Retention.purge_device(
+                    connection, device_id, datetime.now() - timedelta(days=days),
+                    chunk_size=PARTITION_CONFIG['purge_chunk_size']
+                )
+                if purged:
+                    summary["purged_readings"][device_id] = purged
+            return summary
+        finally:
+            cursor.close()
+
+def run_partition_maintenance():
+    """Pre-create future partitions and enforce retention (one instance at a time)"""
+    error = unsupported_feature('retention')
+    if error:
+        return {"success": False, "error": error}
+    connection = get_db_connection()
+    if not connection:
+        return {"success": False, "error": "Database connection failed"}
+    try:
+        cursor = connection.cursor(buffered=True)
+        cursor.execute("SELECT GET_LOCK('iot_partition_maintenance', 0)")
+        if cursor.fetchone()[0] != 1:
+            return {"success": False, "error": "Maintenance already running elsewhere"}
+        try:
+            created = []
+            if PARTITION_CONFIG['enabled']:
+                created = Partitions.precreate(
+                    cursor, PARTITION_CONFIG['granularity'], PARTITION_CONFIG['precreate']
+                )
+            summary = Retention.apply(connection)
+            return {"success": True, "created_partitions": created, **summary}
+        finally:
+            cursor.execute("SELECT RELEASE_LOCK('iot_partition_maintenance')")
+            cursor.fetchone()
+    except Error as e:
+        return {"success": False, "error": f"Database error: {str(e)}"}
+    finally:
+        cursor.close()
+        connection.close()
+
+class MaintenanceScheduler:
+    """Background thread that runs partition maintenance periodically"""
+    
+    def __init__(self, interval):
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+    
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="partition-maintenance", daemon=True)
+            self._thread.start()
+    
+    def stop(self):
+        self._stop.set()
+    
+    def _run(self):
+        while not self._stop.is_set():
+            result = run_partition_maintenance()
+            if not result['success']:
+                print(f"Partition maintenance skipped: {result['error']}")
+            self._stop.wait(self.interval)
+
+maintenance_scheduler = MaintenanceScheduler(PARTITION_CONFIG['maintenance_interval'])
+
+@app.route('/api/retention', methods=['GET'])
+def list_retention_policies():
+    """Global retention and per-device overrides"""
+    error = unsupported_feature('retention')
+    if error:
+        return jsonify({"success": False, "error": error}), 501
+    connection = get_db_connection()
+    if not connection:
+        return jsonify({"success": False, "error": "Database connection failed"}), 500
+    try:
+        cursor = connection.cursor(buffered=True)
+        return jsonify({
+            "success": True,
+            "retention_days": PARTITION_CONFIG['retention_days'],
+            "partitioned": PARTITION_CONFIG['enabled'],
+            "overrides": Retention.policies(cursor)
+        })
+    except Error as e:
+        return jsonify({"success": False, "error": f"Database error: {str(e)}"}), 500
+    finally:
+        cursor.close()
+        connection.close()
+
+@app.route('/api/retention/<device_id>', methods=['PUT', 'DELETE'])
+def set_retention_policy(device_id):
+    """Set (PUT {"retention_days": 30}) or remove (DELETE) a device's retention override"""
+    error = unsupported_feature('retention')
+    if error:
+        return jsonify({"success": False, "error": error}), 501
+    if request.method == 'PUT':
+        data = request.get_json(silent=True) or {}
+        retention_days = data.get('retention_days')
+        if not isinstance(retention_days, int) or retention_days < 0:
+            return jsonify({"success": False, "error": "retention_days must be a non-negative integer"}), 400
+    
+    connection = get_db_connection()
+    if not connection:
+        return jsonify({"success": False, "error": "Database connection failed"}), 500
+    try:
+        cursor = connection.cursor()
+        if request.method == 'PUT':
+            cursor.execute("""
+            INSERT INTO retention_policies (device_id, retention_days) VALUES (%s, %s)
+            ON DUPLICATE KEY UPDATE retention_days = VALUES(retention_days)
+            """, (device_id, retention_days))
+        else:
+            cursor.execute("DELETE FROM retention_policies WHERE device_id = %s", (device_id,))
+        connection.commit()
+        return jsonify({"success": True, "device_id": device_id})
+    except Error as e:
+        return jsonify({"success": False, "error": f"Database error: {str(e)}"}), 500
+    finally:
+        cursor.close()
+        connection.close()
+
+@app.cli.command('maintain-partitions')
+def maintain_partitions_command():
+    """Pre-create future partitions and enforce retention once (for cron)"""
+    print(run_partition_maintenance())
+
+# ========================
+# COLD READING ARCHIVE
+# ========================
+
+# Readings older than a cutoff can be moved out of iot_readings into per-device
+# columnar segment files that are memory-mapped at query time
+ARCHIVE_CONFIG = {
+    'root': os.environ.get('ARCHIVE_DIR', 'archive'),
+    'segment_rows': int(os.environ.get('ARCHIVE_SEGMENT_ROWS', 100000)),  # readings per segment file
+    'delete_chunk_size': int(os.environ.get('ARCHIVE_DELETE_CHUNK', 1000))
+}
+
+reading_archive = ArchiveStore(ARCHIVE_CONFIG['root'])
+atexit.register(reading_archive.close)
+
+def _reading_order_key(reading):
+    # MySQL order: NULL timestamps sort before every other value
+    timestamp = reading['timestamp']
+    return (timestamp is not None, timestamp or datetime.min, reading['id'])
+
+def merge_archived_readings(device_id, readings, limit, lower=None, upper=None, descending=True):
+    """
+    Merge hot readings (already ordered and bounded by lower/upper) with the
+    archived readings of the same range and keep the first `limit` in order.
+    Readings present in both places (an interrupted archive run) appear once.
+    """
+    archived = reading_archive.read(device_id, lower=lower, upper=upper, descending=descending, limit=limit)
+    if not archived:
+        return readings
+    merged = {reading['id']: reading for reading in archived}
+    merged.update((reading['id'], reading) for reading in readings)
+    return sorted(merged.values(), key=_reading_order_key, reverse=descending)[:limit]
+
+def archive_readings(cutoff, device_id=None):
+    """
+    Move readings older than `cutoff` from iot_readings into archive segments,
+    oldest first, one segment per ARCHIVE_CONFIG['segment_rows'] readings.
+    A segment is written before its rows are deleted, so an interrupted run
+    leaves readings in both places (reads return them once) and a rerun
+    rewrites the same segment. device_stats and rollups are untouched since
+    archived readings still belong to the device.
+    """
+    error = unsupported_feature('archive')
+    if error:
+        return {"success": False, "error": error}
+    connection = get_db_connection()
+    if not connection:
+        return {"success": False, "error": "Database connection failed"}
+    try:
+        cursor = connection.cursor(buffered=True)
+        cursor.execute("SELECT GET_LOCK('iot_reading_archive', 0)")
+        if cursor.fetchone()[0] != 1:
+            return {"success": False, "error": "Archiving already running elsewhere"}
+        try:
+            if device_id is None:
+                cursor.execute("SELECT device_id FROM device_stats ORDER BY device_id")
+                device_ids = [row[0] for row in cursor.fetchall()]
+            else:
+                device_ids = [device_id]
+            
+            segment_rows = ARCHIVE_CONFIG['segment_rows']
+            chunk_size = ARCHIVE_CONFIG['delete_chunk_size']
+            archived = {}
+            for device in device_ids:
+                while True:
+                    cursor.execute(f"""
+                    SELECT {', '.join(ARCHIVE_COLUMNS)} FROM iot_readings
+                    WHERE device_id = %s AND timestamp < %s
+                    ORDER BY timestamp, id
+                    LIMIT %s
+                    """, (device, cutoff, segment_rows))
+                    rows = cursor.fetchall()
+                    if not rows:
+                        break
+                    reading_archive.write_segment(device, rows)
+                    
+                    ids = [row[0] for row in rows]
+                    for start in range(0, len(ids), chunk_size):
+                        chunk = ids[start:start + chunk_size]
+                        placeholders = ', '.join(['%s'] * len(chunk))
+                        cursor.execute(f"DELETE FROM iot_readings WHERE id IN ({placeholders})", chunk)
+                        connection.commit()
+                    archived[device] = archived.get(device, 0) + len(rows)
+                    if len(rows) < segment_rows:
+                        break
+                if device in archived:
+                    reading_cache.invalidate(device)
+            return {"success": True, "archived": archived}
+        finally:
+            cursor.execute("SELECT RELEASE_LOCK('iot_reading_archive')")
+            cursor.fetchone()
+    except Error as e:
+        return {"success": False, "error": f"Database error: {str(e)}"}
+    finally:
+        cursor.close()
+        connection.close()
+
+@app.cli.command('archive-readings')
+@click.option('--days', type=int, required=True, help='Archive readings older than this many days')
+@click.option('--device', 'device_id', default=None, help='Only archive this device')
+def archive_readings_command(days, device_id):
+    """Move old readings from iot_readings into the columnar archive"""
+    print(archive_readings(datetime.now() - timedelta(days=days), device_id))
+
+# ========================
+# STORAGE BACKENDS
+# ========================
+
+# Which ReadingRepository (see storage.py) serves the routes and IoTDataCRUD
+STORAGE_CONFIG = {
+    'backend': os.environ.get('STORAGE_BACKEND', 'mysql'),                 # 'mysql' or 'sqlite'
+    'sqlite_path': os.environ.get('SQLITE_PATH', 'iot_data.db'),
+    'sqlite_batch_jobs': int(os.environ.get('SQLITE_BATCH_JOBS', 256)),    # most writes merged into one commit
+    'sqlite_cache_kb': int(os.environ.get('SQLITE_CACHE_KB', 65536)),      # page cache per connection
+    'sqlite_synchronous': os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL'),  # FULL also fsyncs every commit
+    'sqlite_write_timeout': float(os.environ.get('SQLITE_WRITE_TIMEOUT', 30))  # seconds a write waits for its commit
+}
+
+class MySQLRepository(ReadingRepository):
+    """
+    Readings in MySQL through the connection pool. Writes keep device_stats
+    and the rollup tables current in the same transaction, and reads of a
+    single device merge in its archived readings.
+    """
+    
+    name = 'mysql'
+    features = frozenset({'rollups', 'retention', 'archive', 'device_stats_rebuild'})
+    
+    @contextlib.contextmanager
+    def _cursor(self, **kwargs):
+        """Yield (connection, cursor); MySQL errors are rolled back and raised as StorageError"""
+        connection = get_db_connection()
+        if not connection:
+            raise StorageError("Database connection failed")
+        cursor = None
+        try:
+            cursor = connection.cursor(**kwargs)
+            yield connection, cursor
+        except Error as e:
+            try:
+                connection.rollback()
+            except Error:
+                pass
+            raise StorageError(f"Database error: {str(e)}") from e
+        finally:
+            if cursor is not None:
+                cursor.close()
+            connection.close()
+    
+    def init(self):
+        init_mysql_database()
+    
+    placeholder = '%s'
+    
+    def _index_hint(self, index):
+        # FORCE INDEX rules out a table scan even when the optimizer's estimates favour one
+        return f"FORCE INDEX ({index})"
+    
+    def _sensor_sql(self, key):
+        # Promoted fields are generated columns (see SensorFields)
+        return sensor_column(key)
+    
+    def _prefix_sql(self, prefix):
+        # Codepoint bounds break under the case-insensitive UCA collation; a LIKE
+        # with a constant prefix is still an index range scan
+        escaped = re.sub(r'([\\%_])', r'\\\1', prefix)
+        return "device_id LIKE %s", [escaped + '%']
+    
+    def ping(self):
+        connection = get_db_connection()
+        if not connection:
+            return False
+        connection.close()
+        return True
+    
+    def insert_rows(self, rows):
+        with self._cursor(buffered=True) as (connection, cursor):
+            query = """
+            INSERT INTO iot_readings (device_id, timestamp, temperature, humidity, sensor_data)
+            VALUES (%s, %s, %s, %s, %s)
+            """
+            if len(rows) == 1:
+                cursor.execute(query, rows[0])
+            else:
+                # executemany() rewrites simple INSERTs into one multi-row statement
+                cursor.executemany(query, rows)
+            reading_id = cursor.lastrowid
+            DeviceStats.record_inserts(cursor, rows)
+            Rollups.record_inserts(cursor, rows)
+            connection.commit()
+            return reading_id
+    
+    def get_reading(self, reading_id):
+        with self._cursor(dictionary=True, buffered=True) as (_, cursor):
+            cursor.execute("SELECT * FROM iot_readings WHERE id = %s", (reading_id,))
+            return cursor.fetchone()
+    
+    def latest_readings(self, device_id, limit):
+        with self._cursor(dictionary=True) as (_, cursor):
+            cursor.execute("""
+            SELECT * FROM iot_readings 
+            WHERE device_id = %s 
+            ORDER BY timestamp DESC, id DESC 
+            LIMIT %s
+            """, (device_id, limit))
+            readings = cursor.fetchall()
+        if len(readings) < limit:
+            readings = merge_archived_readings(device_id, readings, limit)
+        return readings
+    
+    def _seek(self, device_id, key, ascending, count, skip, filters=None):
+        query, params = self._seek_sql(device_id, key, ascending, filters)
+        
+        # Archive segments are only searched by device and key, so filtered reads only cover iot_readings
+        archived = device_id is not None and not filters and reading_archive.has_segments(device_id)
+        window = count + (skip if archived else 0)
+        query += " LIMIT %s"
+        params.append(window)
+        if skip and not archived:
+            query += " OFFSET %s"
+            params.append(skip)
+        
+        with self._cursor(dictionary=True) as (_, cursor):
+            cursor.execute(query, params)
+            readings = cursor.fetchall()
+        if archived:
+            # Archived readings can fall anywhere in the window, so the offset is applied after merging
+            readings = merge_archived_readings(
+                device_id, readings, window,
+                lower=key if ascending else None, upper=None if ascending else key, descending=not ascending
+            )[skip:]
+        return readings
+    
+    def device_total(self, device_id):
+        with self._cursor(buffered=True) as (_, cursor):
+            return DeviceStats.device_total(cursor, device_id)
+    
+    def total_readings(self):
+        with self._cursor(buffered=True) as (_, cursor):
+            cursor.execute("SELECT COALESCE(SUM(total_readings), 0) FROM device_stats")
+            return int(cursor.fetchone()[0])
+    
+    def count_readings(self, device_id, filters):
+        query, params = self._count_sql(device_id, filters)
+        with self._cursor(buffered=True) as (_, cursor):
+            cursor.execute(query, params)
+            return int(cursor.fetchone()[0])
+    
+    def update_reading(self, reading_id, fields):
+        with self._cursor(buffered=True) as (connection, cursor):
+            # Previous values are needed to adjust device_stats and rollups
+            cursor.execute(
+                "SELECT device_id, timestamp, temperature, humidity FROM iot_readings WHERE id = %s",
+                (reading_id,)
+            )
+            previous = cursor.fetchone()
+            if not previous:
+                return None
+            
+            columns = sorted(fields)
+            cursor.execute(
+                f"UPDATE iot_readings SET {', '.join(f'{column} = %s' for column in columns)} WHERE id = %s",
+                [fields[column] for column in columns] + [reading_id]
+            )
+            rows_affected = cursor.rowcount
+            device_id = fields.get('device_id', previous[0])
+            record_reading_changes(
+                cursor,
+                removed=[previous],
+                added=[(
+                    device_id,
+                    previous[1],
+                    fields.get('temperature', previous[2]),
+                    fields.get('humidity', previous[3])
+                )]
+            )
+            connection.commit()
+            return previous[0], device_id, rows_affected
+    
+    def delete_reading(self, reading_id):
+        with self._cursor(buffered=True) as (connection, cursor):
+            cursor.execute(
+                "SELECT device_id, timestamp, temperature, humidity FROM iot_readings WHERE id = %s",
+                (reading_id,)
+            )
+            previous = cursor.fetchone()
+            if not previous:
+                return None
+            cursor.execute("DELETE FROM iot_readings WHERE id = %s", (reading_id,))
+            rows_affected = cursor.rowcount
+            record_reading_changes(cursor, removed=[previous])
+            connection.commit()
+            return previous[0], rows_affected
+    
+    def last_reading_id(self):
+        with self._cursor(buffered=True) as (_, cursor):
+            cursor.execute("SELECT COALESCE(MAX(id), 0) FROM iot_readings")
+            return cursor.fetchone()[0]
+    
+    def delete_readings_chunk(self, device_id, limit, start=None, end=None, max_id=None):
+        sql, params = self._purge_sql(device_id, start, end, max_id)
+        with self._cursor(buffered=True) as (connection, cursor):
+            # Lock the chunk first so the summaries are adjusted for exactly the rows deleted
+            cursor.execute(f"{sql} LIMIT %s FOR UPDATE", params + [limit])
+            rows = cursor.fetchall()
+            if not rows:
+                connection.commit()
+                return 0
+            placeholders = ', '.join(['%s'] * len(rows))
+            cursor.execute(f"DELETE FROM iot_readings WHERE id IN ({placeholders})", [row[0] for row in rows])
+            record_reading_changes(cursor, removed=[row[1:] for row in rows])
+            connection.commit()
+            return len(rows)
+    
+    def forget_device(self, device_id):
+        """
+        Archived readings are counted in device_stats and the rollups, so
+        once they are gone both are rebuilt from the readings left in
+        iot_readings (those that arrived while the device was being purged)
+        """
+        with reading_archive.segments(device_id) as segments:
+            archived = sum(segment.count for segment in segments)
+        if not archived:
+            return 0
+        with self._cursor(buffered=True) as (connection, cursor):
+            DeviceStats.remove_device(cursor, device_id)
+            Rollups.remove_device(cursor, device_id)
+            cursor.execute("""
+            SELECT device_id, timestamp, temperature, humidity, sensor_data FROM iot_readings
+            WHERE device_id = %s
+            """, (device_id,))
+            rows = cursor.fetchall()
+            if rows:
+                DeviceStats.record_inserts(cursor, rows)
+                Rollups.record_inserts(cursor, rows)
+            connection.commit()
+        reading_archive.remove_device(device_id)
+        return archived
+    
+    def device_summaries(self):
+        with self._cursor(dictionary=True) as (_, cursor):
+            cursor.execute("""
+            SELECT 
+                device_id,
+                last_seen,
+                total_readings,
+                temperature_sum / NULLIF(temperature_count, 0) as avg_temperature,
+                humidity_sum / NULLIF(humidity_count, 0) as avg_humidity,
+                last_temperature,
+                last_humidity,
+                temperature_sum,
+                temperature_count,
+                humidity_sum,
+                humidity_count
+            FROM device_stats 
+            ORDER BY last_seen DESC
+            """)
+            return cursor.fetchall()
+    
+    def device_validator(self, device_id):
+        """
+        Every write path bumps device_stats.version, so this is a primary-key
+        lookup instead of the query.
+        """
+        with self._cursor(buffered=True) as (_, cursor):
+            cursor.execute(
+                "SELECT version, UNIX_TIMESTAMP(updated_at) FROM device_stats WHERE device_id = %s",
+                (device_id,)
+            )
+            row = cursor.fetchone()
+        if row is None:
+            return Validator("none", None, None)
+        version, updated_at = row
+        # updated_at tells apart a device that was deleted and re-created at the same version
+        return Validator(f"{version}-{int(updated_at * 1000000)}", float(updated_at), version)
+    
+    def readings_validator(self):
+        with self._cursor(buffered=True) as (_, cursor):
+            cursor.execute("""
+            SELECT COUNT(*), COALESCE(SUM(version), 0), UNIX_TIMESTAMP(MAX(updated_at))
+            FROM device_stats
+            """)
+            devices, versions, updated_at = cursor.fetchone()
+        if not devices:
+            return Validator("none", None, None)
+        return Validator(f"{devices}-{versions}-{int(updated_at * 1000000)}", float(updated_at), None)
+    
+    def aggregate(self, device_id, bucket_seconds, start, end):
+        """Served from the coarsest rollup table whose resolution divides the bucket size"""
+        resolution = Rollups.choose_resolution(bucket_seconds)
+        table, _ = ROLLUP_RESOLUTIONS[resolution]
+        aggregates = ",\n                ".join(
+            f"MIN({metric}_min) AS {metric}_min, MAX({metric}_max) AS {metric}_max, "
+            f"SUM({metric}_sum) / NULLIF(SUM({metric}_count), 0) AS {metric}_avg"
+            for metric in ROLLUP_METRICS
+        )
+        with self._cursor(dictionary=True) as (_, cursor):
+            cursor.execute(f"""
+            SELECT
+                DATE_ADD('1970-01-01', INTERVAL
+                    FLOOR(TIMESTAMPDIFF(SECOND, '1970-01-01', bucket_start) / %s) * %s SECOND) AS bucket,
+                SUM(reading_count) AS count,
+                {aggregates}
+            FROM {table}
+            WHERE device_id = %s AND bucket_start >= %s AND bucket_start < %s
+            GROUP BY bucket
+            ORDER BY bucket
+            """, (bucket_seconds, bucket_seconds, device_id, start, end))
+            return resolution, cursor.fetchall()
+    
+    def iter_readings(self, device_id, start=None, end=None, after=None, chunk_size=1000):
+        conditions = ["device_id = %s"]
+        params = [device_id]
+        if start is not None:
+            conditions.append("timestamp >= %s")
+            params.append(start)
+        if end is not None:
+            conditions.append("timestamp < %s")
+            params.append(end)
+        if after is not None:
+            conditions.append("(timestamp > %s OR (timestamp = %s AND id > %s))")
+            params += [after[0], after[0], after[1]]
+        
+        connection = get_db_connection()
+        if not connection:
+            raise StorageError("Database connection failed")
+        finished = False
+        try:
+            # Unbuffered cursor: rows are read from the server as they are fetched
+            cursor = connection.cursor(buffered=False)
+            cursor.execute(f"""
+            SELECT {', '.join(EXPORT_COLUMNS)} FROM iot_readings
+            WHERE {' AND '.join(conditions)}
+            ORDER BY timestamp, id
+            """, params)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield rows
+            cursor.close()
+            finished = True
+        except Error as e:
+            raise StorageError(f"Database error: {str(e)}") from e
+        finally:
+            if finished:
+                connection.close()
+            else:
+                # Closed early (client disconnect) or failed: unread rows are still pending
+                discard_db_connection(connection)
+    
+    def explain(self, operation, params):
+        try:
+            pooled = db_pool.acquire()
+        except Error as e:
+            return None, str(e)
+        try:
+            # The raw cursor keeps EXPLAIN itself out of the metrics and the slow-query log
+            cursor = pooled._connection.cursor(dictionary=True)
+            try:
+                cursor.execute(f"EXPLAIN {operation}", params)
+                return cursor.fetchall(), None
+            finally:
+                cursor.close()
+        except Error as e:
+            return None, str(e)
+        finally:
+            db_pool.release(pooled)
+    
+    def stats(self):
+        return {"backend": self.name, "database": DB_CONFIG['database']}
+
+def create_storage(backend):
+    """Build the ReadingRepository named by STORAGE_BACKEND"""
+    if backend == 'mysql':
+        return MySQLRepository(SENSOR_FIELDS)
+    if backend == 'sqlite':
+        return SQLiteRepository(
+            STORAGE_CONFIG['sqlite_path'],
+            batch_jobs=STORAGE_CONFIG['sqlite_batch_jobs'],
+            cache_kb=STORAGE_CONFIG['sqlite_cache_kb'],
+            synchronous=STORAGE_CONFIG['sqlite_synchronous'],
+            write_timeout=STORAGE_CONFIG['sqlite_write_timeout'],
+            cursor_wrapper=InstrumentedCursor if METRICS_CONFIG['enabled'] or SLOW_QUERY_CONFIG['enabled'] else None,
+            sensor_fields=SENSOR_FIELDS
+        )
+    raise ValueError(f"Unknown STORAGE_BACKEND {backend!r}; expected 'mysql' or 'sqlite'")
+
+storage = create_storage(STORAGE_CONFIG['backend'])
+atexit.register(storage.close)
+
+def unsupported_feature(feature):
+    """Error message when the configured backend lacks a MySQL-only feature, else None"""
+    if feature in storage.features:
+        return None
+    return f"{feature} is not supported by the {storage.name} storage backend"
+
+# ========================
+# CONDITIONAL REQUESTS
+# ========================
+
+@migration(7, "Add change version to device_stats")
+def _migration_device_stats_version(cursor):
+    cursor.execute("""
+    ALTER TABLE device_stats
+        ADD COLUMN version BIGINT NOT NULL DEFAULT 0,
+        MODIFY updated_at TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6)
+    """)
+
+def _settled(last_modified):
+    """
+    Last-Modified has one-second granularity, so it only identifies a version
+    once its second has passed; a later write in the same second would share it
+    """
+    return last_modified is not None and int(last_modified) < int(time.time())
+
+def not_modified(validator, page=False):
+    """
+    A 304 response when the client's copy is current, otherwise None. The ETag
+    (If-None-Match) is the primary validator; If-Modified-Since is only used
+    without one. HTML pages (`page`) with pending flash messages always render
+    in full; API routes never touch the session, so they don't vary on Cookie.
+    """
+    etag, last_modified, _ = validator
+    if page and session.get('_flashes'):
+        return None
+    if request.if_none_match:
+        matched = request.if_none_match.contains_weak(etag)
+    elif request.if_modified_since and _settled(last_modified):
+        matched = int(last_modified) <= request.if_modified_since.timestamp()
+    else:
+        matched = False
+    if not matched:
+        return None
+    return with_validators(Response(status=304), validator)
+
+def with_validators(response, validator):
+    """Attach ETag and Last-Modified; clients must revalidate before reusing the copy"""
+    response = make_response(response)
+    etag, last_modified, _ = validator
+    response.set_etag(etag)
+    if _settled(last_modified):
+        response.last_modified = last_modified
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+# Maximum number of readings accepted in one batch request
+BATCH_MAX_SIZE = int(os.environ.get('BATCH_MAX_SIZE', 1000))
+
+def parse_time(value):
+    """
+    Parse an ISO 8601 time as timestamps are stored: naive server-local time,
+    like datetime.now(). A UTC offset ("Z", "+07:00") is converted.
+    Raises ValueError for malformed values.
+    """
+    timestamp = datetime.fromisoformat(value)
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone().replace(tzinfo=None)
+    return timestamp
+
+def validate_reading(data, partial=False):
+    """
+    Validate and normalise one reading payload. With `partial` (updates),
+    device_id may be omitted and absent fields come back as None.
+    Returns (reading, None) on success or (None, error_message) on failure.
+    """
+    if not isinstance(data, dict):
+        return None, "Reading must be a JSON object"
+    
+    device_id = data.get('device_id')
+    if device_id is None and partial:
+        pass
+    elif not device_id or not isinstance(device_id, str):
+        return None, "device_id is required"
+    elif len(device_id) > 100:
+        return None, "device_id must be at most 100 characters"
+    
+    reading = {"device_id": device_id}
+    for field in ('temperature', 'humidity'):
+        value = data.get(field)
+        if value is not None:
+            try:
+                value = float(value)
+            except (TypeError, ValueError):
+                return None, f"{field} must be a number"
+            if not math.isfinite(value):
+                return None, f"{field} must be a finite number"
+        reading[field] = value
+    
+    sensor_data = data.get('sensor_data')
+    if sensor_data is not None and not isinstance(sensor_data, dict):
+        return None, "sensor_data must be a JSON object"
+    reading['sensor_data'] = sensor_data
+    
+    # Optional original measurement time (ISO 8601 string or Unix epoch seconds)
+    timestamp = data.get('timestamp')
+    if timestamp is not None:
+        try:
+            if isinstance(timestamp, (int, float)):
+                timestamp = datetime.fromtimestamp(timestamp)
+            else:
+                timestamp = parse_time(str(timestamp))
+        except (TypeError, ValueError, OverflowError, OSError):
+            return None, "timestamp must be ISO 8601 or Unix epoch seconds"
+    reading['timestamp'] = timestamp
+    
+    return reading, None
+
+# Largest ingest request body accepted, before and after decompression
+INGEST_MAX_BODY = int(os.environ.get('INGEST_MAX_BODY', 1024 * 1024))
+
+# Content type of the compact binary reading layout
+BINARY_CONTENT_TYPE = 'application/x-iot-reading'
+
+# Binary layouts by schema id: (struct format of one record, fields). Each field
+# is (target, scale, null sentinel); "sensor_data.<key>" targets go into sensor_data.
+BINARY_SCHEMAS = {
+    1: ('<IhHHH', (
+        ('timestamp', 1, 0),                      # Unix epoch seconds, 0 = server time
+        ('temperature', 100, -0x8000),            # hundredths of a degree
+        ('humidity', 100, 0xFFFF),                # hundredths of a percent
+        ('sensor_data.light', 100, 0xFFFF),       # hundredths of a percent
+        ('sensor_data.light_raw', 1, 0xFFFF)      # raw ADC value
+    ))
+}
+
+def decode_binary_readings(body):
+    """
+    Decode a binary payload into reading dicts shaped like the JSON form.
+    Layout: schema id (uint8), device_id length (uint8), device_id (UTF-8),
+    then one or more records in the schema's struct format.
+    Raises ValueError for malformed payloads.
+    """
+    if len(body) < 2:
+        raise ValueError("Binary payload is truncated")
+    schema_id, id_length = body[0], body[1]
+    if schema_id not in BINARY_SCHEMAS:
+        raise ValueError(f"Unknown binary schema {schema_id}")
+    record_format, fields = BINARY_SCHEMAS[schema_id]
+    record = struct.Struct(record_format)
+    
+    start = 2 + id_length
+    records = body[start:]
+    if not records or len(records) % record.size:
+        raise ValueError(f"Binary payload does not match schema {schema_id}")
+    device_id = body[2:start].decode()
+    
+    readings = []
+    for values in record.iter_unpack(records):
+        reading = {"device_id": device_id}
+        for (target, scale, null), value in zip(fields, values):
+            if value == null:
+                value = None
+            elif scale != 1:
+                value = value / scale
+            if target.startswith('sensor_data.'):
+                reading.setdefault('sensor_data', {})[target[len('sensor_data.'):]] = value
+            else:
+                reading[target] = value
+        readings.append(reading)
+    return readings
+
+def read_ingest_payload():
+    """
+    Read an ingest request body: JSON, or the binary layout when sent as
+    BINARY_CONTENT_TYPE, optionally compressed with Content-Encoding gzip or
+    deflate. Binary bodies decode to a list of readings.
+    Returns (data, None, None) or (None, error_message, status_code).
+    """
+    body = request.get_data()
+    if len(body) > INGEST_MAX_BODY:
+        return None, "Request body too large", 413
+    
+    encoding = request.headers.get('Content-Encoding', 'identity').lower()
+    if encoding in ('gzip', 'deflate'):
+        # wbits 47 detects gzip and zlib headers; some clients send raw deflate
+        for wbits in (47, -15):
+            try:
+                decompressor = zlib.decompressobj(wbits)
+                inflated = decompressor.decompress(body, INGEST_MAX_BODY)
+                break
+            except zlib.error:
+                continue
+        else:
+            return None, f"Body is not valid {encoding} data", 400
+        if decompressor.unconsumed_tail:
+            return None, "Request body too large", 413
+        if not decompressor.eof:
+            return None, f"Body is not valid {encoding} data", 400
+        body = inflated
+    elif encoding != 'identity':
+        return None, f"Unsupported Content-Encoding: {encoding}", 415
+    
+    try:
+        if request.mimetype == BINARY_CONTENT_TYPE:
+            return decode_binary_readings(body), None, None
+        return json.loads(body), None, None
+    except (UnicodeDecodeError, json.JSONDecodeError):
+        return None, f"Body must be JSON or {BINARY_CONTENT_TYPE}", 400
+    except ValueError as e:
+        return None, str(e), 400
 
-def get_db_connection():
-    """Create and return a database connection"""
+def encode_cursor(reading):
+    """Build an opaque pagination cursor from a reading's (timestamp, id)"""
+    raw = f"{reading['timestamp'].isoformat()},{reading['id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_cursor(token):
+    """
+    Decode a pagination cursor into (timestamp, id).
+    Accepts the opaque form returned by the API or a plain "timestamp,id" string.
+    Raises ValueError for malformed cursors.
+    """
     try:
-        connection = mysql.connector.connect(**DB_CONFIG)
-        if connection.is_connected():
-            return connection
-    except Error as e:
-        print(f"Error connecting to MySQL: {e}")
-        return None
+        if ',' in token:
+            raw = token
+        else:
+            raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode()
+        timestamp, reading_id = raw.rsplit(',', 1)
+        return parse_time(timestamp), int(reading_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError) as e:
+        raise ValueError("Invalid pagination cursor") from e
 
-def init_database():
-    """Initialize the database and create tables if they don't exist"""
-    connection = get_db_connection()
-    if connection:
+# Most device_ids accepted by one search
+SEARCH_MAX_DEVICES = int(os.environ.get('SEARCH_MAX_DEVICES', 100))
+
+def parse_reading_filter(args, device_id=None):
+    """
+    ReadingFilter from query arguments, or None when there are none:
+    device_id (repeated or comma-separated), device_prefix, from / to
+    (ISO 8601, to is exclusive) and <field>_<lt|lte|gt|gte|eq> comparisons on
+    temperature, humidity and the promoted sensor fields, e.g.
+    ?device_prefix=esp32_&from=2025-08-01&temperature_gte=30&battery_lt=20.
+    Raises ValueError for bad values and for filters no index can serve.
+    """
+    device_ids = []
+    for value in args.getlist('device_id'):
+        device_ids += [part.strip() for part in value.split(',') if part.strip()]
+    if len(device_ids) > SEARCH_MAX_DEVICES:
+        raise ValueError(f"At most {SEARCH_MAX_DEVICES} device_id values per search")
+    device_prefix = args.get('device_prefix') or None
+    start = parse_time(args['from']) if args.get('from') else None
+    end = parse_time(args['to']) if args.get('to') else None
+    if start and end and start >= end:
+        raise ValueError("from must be earlier than to")
+    
+    comparisons = []
+    fields = ('temperature', 'humidity', *SENSOR_FIELDS)
+    for name, value in args.items(multi=True):
+        field, _, operator = name.rpartition('_')
+        if not field or operator not in FILTER_OPERATORS:
+            continue
+        if field not in fields:
+            raise ValueError(f"{field} cannot be filtered on (filterable: {', '.join(fields)})")
         try:
-            cursor = connection.cursor()
-            
-            # Create database if it doesn't exist
-            cursor.execute("CREATE DATABASE IF NOT EXISTS std01_iot_data")
-            cursor.execute("USE std01_iot_data")
-            
-            # Create iot_readings table
-            create_table_query = """
-            CREATE TABLE IF NOT EXISTS iot_readings (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                device_id VARCHAR(100) NOT NULL,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                sensor_data JSON,
-                temperature FLOAT,
-                humidity FLOAT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-            """
-            cursor.execute(create_table_query)
-            connection.commit()
-            print("Database and table created successfully")
-            
-        except Error as e:
-            print(f"Error initializing database: {e}")
-        finally:
-            cursor.close()
-            connection.close()
+            number = float(value)
+        except ValueError:
+            number = math.nan
+        if not math.isfinite(number):
+            raise ValueError(f"{name} must be a number")
+        comparisons.append((field, operator, number))
+    
+    if not (device_ids or device_prefix or start or end or comparisons):
+        return None
+    filters = ReadingFilter(tuple(dict.fromkeys(device_ids)), device_prefix, start, end, tuple(comparisons))
+    search_index(device_id, filters, SENSOR_FIELDS)
+    return filters
+
+def arg_flag(name, default=False):
+    """Read a boolean query string flag such as ?count=1"""
+    value = request.args.get(name)
+    if value is None:
+        return default
+    return value.lower() in ('1', 'true', 'yes')
 
 @app.route('/')
 def home():
@@ -74,6 +2656,28 @@ def api_home():
         "version": "1.0.0"
     })
 
+def ingest_batch(readings):
+    """
+    Insert a list of readings and build the batch response: 201 when all were
+    created, 207 when some were rejected, 400 when none were created.
+    """
+    if not isinstance(readings, list) or not readings:
+        return jsonify({"error": "readings must be a non-empty array"}), 400
+    if len(readings) > BATCH_MAX_SIZE:
+        return jsonify({"error": f"Batch exceeds maximum of {BATCH_MAX_SIZE} readings"}), 413
+    
+    result = IoTDataCRUD.create_readings(readings)
+    if not result['success']:
+        return jsonify(result), 500
+    
+    if result['rejected'] == 0:
+        status_code = 201
+    elif result['created'] == 0:
+        status_code = 400
+    else:
+        status_code = 207
+    return jsonify(result), status_code
+
 @app.route('/api/data', methods=['POST'])
 def receive_std01_iot_data():
     """
@@ -85,95 +2689,149 @@ def receive_std01_iot_data():
         "humidity": 60.2,
         "sensor_data": {...}
     }
+    A JSON array of readings is stored like /api/data/batch. The body may
+    also use the binary layout (see BINARY_SCHEMAS) and may be gzip or
+    deflate compressed.
+    With INGEST_WRITE_BEHIND=1 the reading is queued and 202 is returned;
+    503 with Retry-After is returned when the queue is full.
     """
     try:
-        # Get JSON data from request
-        data = request.get_json()
+        data, error, status_code = read_ingest_payload()
+        if error:
+            return jsonify({"error": error}), status_code
         
         if not data:
             return jsonify({"error": "No data received"}), 400
         
-        # Extract required fields
-        device_id = data.get('device_id')
-        temperature = data.get('temperature')
-        humidity = data.get('humidity')
-        sensor_data = data.get('sensor_data', {})
+        # A list of readings (JSON array or binary records) is stored as a batch
+        if isinstance(data, list):
+            return ingest_batch(data)
         
-        if not device_id:
-            return jsonify({"error": "device_id is required"}), 400
-        
-        # Connect to database
-        connection = get_db_connection()
-        if not connection:
-            return jsonify({"error": "Database connection failed"}), 500
+        reading, error = validate_reading(data)
+        if error:
+            return jsonify({"error": error}), 400
+        device_id = reading['device_id']
         
-        try:
-            cursor = connection.cursor()
-            
-            # Insert data into database
-            insert_query = """
-            INSERT INTO iot_readings (device_id, temperature, humidity, sensor_data)
-            VALUES (%s, %s, %s, %s)
-            """
-            
-            cursor.execute(insert_query, (
-                device_id,
-                temperature,
-                humidity,
-                json.dumps(sensor_data)
-            ))
-            
-            connection.commit()
-            
+        # Write-behind mode: queue the reading and let the flusher bulk-insert it
+        if INGEST_CONFIG['write_behind']:
+            if reading['timestamp'] is None:
+                reading['timestamp'] = datetime.now()
+            if not ingest_buffer.submit(reading):
+                response = jsonify({"error": "Ingest queue is full, retry later"})
+                response.headers['Retry-After'] = str(INGEST_CONFIG['retry_after'])
+                return response, 503
             return jsonify({
-                "message": "Data received successfully",
+                "message": "Data accepted for processing",
                 "device_id": device_id,
-                "timestamp": datetime.now().isoformat()
-            }), 201
-            
-        except Error as e:
-            return jsonify({"error": f"Database error: {str(e)}"}), 500
+                "timestamp": reading['timestamp'].isoformat()
+            }), 202
         
-        finally:
-            cursor.close()
-            connection.close()
+        # Insert data into database (also updates device_stats and the cache)
+        IoTDataCRUD._insert_rows([(
+            device_id,
+            reading['timestamp'] or datetime.now(),
+            reading['temperature'],
+            reading['humidity'],
+            json.dumps(reading['sensor_data'] or {})
+        )])
+        
+        return jsonify({
+            "message": "Data received successfully",
+            "device_id": device_id,
+            "timestamp": datetime.now().isoformat()
+        }), 201
+    
+    except StorageError as e:
+        return jsonify({"error": str(e)}), 500
+    except Exception as e:
+        return jsonify({"error": f"Server error: {str(e)}"}), 500
+
+@app.route('/api/data/batch', methods=['POST'])
+def receive_iot_data_batch():
+    """
+    Endpoint to receive many readings in one request
+    Expected JSON format:
+    {
+        "readings": [
+            {"device_id": "device_001", "temperature": 25.5, "humidity": 60.2, "sensor_data": {...}},
+            ...
+        ]
+    }
+    A bare JSON array of readings, or a binary body (see BINARY_SCHEMAS),
+    is also accepted, optionally gzip or deflate compressed.
+    """
+    try:
+        data, error, status_code = read_ingest_payload()
+        if error:
+            return jsonify({"error": error}), status_code
+        
+        if not data:
+            return jsonify({"error": "No data received"}), 400
+        
+        readings = data.get('readings') if isinstance(data, dict) else data
+        return ingest_batch(readings)
     
     except Exception as e:
         return jsonify({"error": f"Server error: {str(e)}"}), 500
 
 @app.route('/api/data/<device_id>', methods=['GET'])
 def get_device_data(device_id):
-    """Get data for a specific device"""
+    """Get data for a specific device (conditional GET via ETag / Last-Modified)"""
     try:
-        connection = get_db_connection()
-        if not connection:
-            return jsonify({"error": "Database connection failed"}), 500
+        validator = storage.device_validator(device_id)
+        response = not_modified(validator)
+        if response:
+            return response
+        
+        # Serve hot devices from the latest-readings cache (devices without stats have no readings)
+        readings = None
+        if validator.version is not None:
+            readings = reading_cache.get(device_id, DEVICE_DATA_LIMIT, validator.version)
+        if readings is None:
+            readings = decode_sensor_data(storage.latest_readings(device_id, DEVICE_DATA_LIMIT))
+            if validator.version is not None:
+                reading_cache.fill(device_id, readings, DEVICE_DATA_LIMIT, validator.version)
         
+        return with_validators(jsonify({
+            "device_id": device_id,
+            "readings": readings,
+            "count": len(readings)
+        }), validator)
+    
+    except StorageError as e:
+        return jsonify({"error": str(e)}), 500
+    except Exception as e:
+        return jsonify({"error": f"Server error: {str(e)}"}), 500
+
+@app.route('/api/data/<device_id>/aggregate', methods=['GET'])
+def get_device_aggregate(device_id):
+    """
+    Time-bucketed aggregates for a device, served from the rollup tables
+    Query parameters: bucket (e.g. 15m, 1h, 1d; default 1h),
+    from / to (ISO 8601; default the last 100 buckets)
+    """
+    try:
         try:
-            cursor = connection.cursor(dictionary=True)
-            
-            query = """
-            SELECT * FROM iot_readings 
-            WHERE device_id = %s 
-            ORDER BY timestamp DESC 
-            LIMIT 100
-            """
-            
-            cursor.execute(query, (device_id,))
-            readings = cursor.fetchall()
-            
-            return jsonify({
-                "device_id": device_id,
-                "readings": readings,
-                "count": len(readings)
-            })
-            
-        except Error as e:
-            return jsonify({"error": f"Database error: {str(e)}"}), 500
+            bucket = request.args.get('bucket', '1h')
+            bucket_seconds = parse_bucket(bucket)
+            end = parse_time(request.args['to']) if request.args.get('to') else datetime.now()
+            start = (parse_time(request.args['from']) if request.args.get('from')
+                     else end - timedelta(seconds=bucket_seconds * 100))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
         
-        finally:
-            cursor.close()
-            connection.close()
+        if Rollups.choose_resolution(bucket_seconds) is None:
+            return jsonify({"error": "bucket must be a whole number of minutes"}), 400
+        if start >= end:
+            return jsonify({"error": "from must be earlier than to"}), 400
+        if (end - start).total_seconds() / bucket_seconds > AGGREGATE_MAX_BUCKETS:
+            return jsonify({"error": f"Range spans more than {AGGREGATE_MAX_BUCKETS} buckets"}), 400
+        
+        result = IoTDataCRUD.aggregate_readings(device_id, bucket_seconds, start, end)
+        if not result['success']:
+            return jsonify(result), 500
+        result['bucket'] = bucket
+        return jsonify(result)
     
     except Exception as e:
         return jsonify({"error": f"Server error: {str(e)}"}), 500
@@ -182,54 +2840,53 @@ def get_device_data(device_id):
 def health_check():
     """Health check endpoint"""
     try:
-        connection = get_db_connection()
-        if connection:
-            connection.close()
-            return jsonify({"status": "healthy", "database": "connected"})
+        if storage.ping():
+            return jsonify({"status": "healthy", "database": "connected", "storage": storage.stats(),
+                            "pool": db_pool.stats(), "stream": reading_broadcaster.stats()})
         else:
-            return jsonify({"status": "unhealthy", "database": "disconnected"}), 503
+            return jsonify({"status": "unhealthy", "database": "disconnected", "storage": storage.stats(),
+                            "pool": db_pool.stats(), "stream": reading_broadcaster.stats()}), 503
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    """Request, query, pool, cache, ingest and stream metrics for Prometheus"""
+    if not METRICS_CONFIG['enabled']:
+        return jsonify({"error": "Metrics are disabled (METRICS_ENABLED=0)"}), 404
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/admin/slow-queries', methods=['GET', 'DELETE'])
+def slow_queries():
+    """Slow statements (newest first) and per-shape totals with EXPLAIN output; DELETE clears them"""
+    if request.method == 'DELETE':
+        slow_query_log.clear()
+        return jsonify({"success": True})
+    try:
+        limit = int(request.args.get('limit', 50))
+    except ValueError:
+        return jsonify({"success": False, "error": "limit must be an integer"}), 400
+    return jsonify({"success": True, "enabled": SLOW_QUERY_CONFIG['enabled'], **slow_query_log.snapshot(max(limit, 0))})
+
 # Web CRUD Routes
 @app.route('/devices')
 def list_devices():
     """Display all devices and their latest readings"""
     try:
-        connection = get_db_connection()
-        if not connection:
-            flash("Database connection failed", "error")
-            return render_template('error.html', error="Database connection failed")
+        # Answer a revalidation before running the query or rendering
+        validator = storage.readings_validator()
+        response = not_modified(validator, page=True)
+        if response:
+            return response
         
-        try:
-            cursor = connection.cursor(dictionary=True)
-            
-            # Get all devices with their latest reading
-            query = """
-            SELECT 
-                device_id,
-                MAX(timestamp) as last_seen,
-                COUNT(*) as total_readings,
-                AVG(temperature) as avg_temperature,
-                AVG(humidity) as avg_humidity
-            FROM iot_readings 
-            GROUP BY device_id 
-            ORDER BY last_seen DESC
-            """
-            
-            cursor.execute(query)
-            devices = cursor.fetchall()
-            
-            return render_template('devices.html', devices=devices)
-            
-        except Error as e:
-            flash(f"Database error: {str(e)}", "error")
-            return render_template('error.html', error=str(e))
+        # Get all devices from the incrementally maintained summary
+        devices = storage.device_summaries()
         
-        finally:
-            cursor.close()
-            connection.close()
+        return with_validators(render_template('devices.html', devices=devices), validator)
     
+    except StorageError as e:
+        flash(str(e), "error")
+        return render_template('error.html', error=str(e))
     except Exception as e:
         flash(f"Server error: {str(e)}", "error")
         return render_template('error.html', error=str(e))
@@ -238,56 +2895,30 @@ def list_devices():
 def view_device(device_id):
     """View detailed readings for a specific device"""
     try:
-        connection = get_db_connection()
-        if not connection:
-            flash("Database connection failed", "error")
-            return render_template('error.html', error="Database connection failed")
+        # Get device readings with cursor pagination
+        per_page = 20
+        after = request.args.get('after')
+        before = request.args.get('before')
         
         try:
-            cursor = connection.cursor(dictionary=True)
-            
-            # Get device readings with pagination
-            page = request.args.get('page', 1, type=int)
-            per_page = 20
-            offset = (page - 1) * per_page
-            
-            # Get readings
-            query = """
-            SELECT * FROM iot_readings 
-            WHERE device_id = %s 
-            ORDER BY timestamp DESC 
-            LIMIT %s OFFSET %s
-            """
-            
-            cursor.execute(query, (device_id, per_page, offset))
-            readings = cursor.fetchall()
-            
-            # Get total count
-            count_query = "SELECT COUNT(*) as total FROM iot_readings WHERE device_id = %s"
-            cursor.execute(count_query, (device_id,))
-            total = cursor.fetchone()['total']
-            
-            # Calculate pagination info
-            total_pages = (total + per_page - 1) // per_page
-            has_prev = page > 1
-            has_next = page < total_pages
-            
-            return render_template('device_detail.html', 
-                                 device_id=device_id,
-                                 readings=readings,
-                                 page=page,
-                                 total_pages=total_pages,
-                                 has_prev=has_prev,
-                                 has_next=has_next,
-                                 total=total)
-            
-        except Error as e:
-            flash(f"Database error: {str(e)}", "error")
-            return render_template('error.html', error=str(e))
+            for token in (after, before):
+                if token:
+                    decode_cursor(token)
+        except ValueError as e:
+            flash(str(e), "error")
+            return redirect(url_for('view_device', device_id=device_id))
         
-        finally:
-            cursor.close()
-            connection.close()
+        result = IoTDataCRUD.read_device_readings(device_id, limit=per_page, after=after, before=before)
+        if not result['success']:
+            flash(result['error'], "error")
+            return render_template('error.html', error=result['error'])
+        
+        return render_template('device_detail.html', 
+                             device_id=device_id,
+                             readings=result['readings'],
+                             next_cursor=result['next_cursor'],
+                             prev_cursor=result['prev_cursor'],
+                             total=result['total'])
     
     except Exception as e:
         flash(f"Server error: {str(e)}", "error")
@@ -317,48 +2948,31 @@ def create_reading():
             flash("Invalid JSON format in sensor data", "error")
             return render_template('create.html')
         
-        # Convert temperature and humidity to float
-        try:
-            temperature = float(temperature) if temperature else None
-            humidity = float(humidity) if humidity else None
-        except ValueError:
-            flash("Temperature and humidity must be valid numbers", "error")
-            return render_template('create.html')
-        
-        # Connect to database
-        connection = get_db_connection()
-        if not connection:
-            flash("Database connection failed", "error")
-            return render_template('create.html')
-        
-        try:
-            cursor = connection.cursor()
-            
-            # Insert data
-            insert_query = """
-            INSERT INTO iot_readings (device_id, temperature, humidity, sensor_data)
-            VALUES (%s, %s, %s, %s)
-            """
-            
-            cursor.execute(insert_query, (
-                device_id,
-                temperature,
-                humidity,
-                json.dumps(sensor_data)
-            ))
-            
-            connection.commit()
-            flash(f"Reading created successfully for device {device_id}", "success")
-            return redirect(url_for('view_device', device_id=device_id))
-            
-        except Error as e:
-            flash(f"Database error: {str(e)}", "error")
+        # Convert temperature and humidity to finite floats
+        reading, error = validate_reading({
+            "device_id": device_id,
+            "temperature": temperature or None,
+            "humidity": humidity or None,
+            "sensor_data": sensor_data
+        })
+        if error:
+            flash(error, "error")
             return render_template('create.html')
         
-        finally:
-            cursor.close()
-            connection.close()
+        # Insert data (also updates device_stats)
+        IoTDataCRUD._insert_rows([(
+            device_id,
+            datetime.now(),
+            reading['temperature'],
+            reading['humidity'],
+            json.dumps(sensor_data)
+        )])
+        flash(f"Reading created successfully for device {device_id}", "success")
+        return redirect(url_for('view_device', device_id=device_id))
     
+    except StorageError as e:
+        flash(str(e), "error")
+        return render_template('create.html')
     except Exception as e:
         flash(f"Server error: {str(e)}", "error")
         return render_template('create.html')
@@ -366,19 +2980,10 @@ def create_reading():
 @app.route('/edit/<int:reading_id>', methods=['GET', 'POST'])
 def edit_reading(reading_id):
     """Edit an existing IoT reading"""
-    connection = get_db_connection()
-    if not connection:
-        flash("Database connection failed", "error")
-        return redirect(url_for('list_devices'))
-    
     try:
-        cursor = connection.cursor(dictionary=True)
-        
         if request.method == 'GET':
             # Get the reading to edit
-            query = "SELECT * FROM iot_readings WHERE id = %s"
-            cursor.execute(query, (reading_id,))
-            reading = cursor.fetchone()
+            reading = storage.get_reading(reading_id)
             
             if not reading:
                 flash("Reading not found", "error")
@@ -404,79 +3009,48 @@ def edit_reading(reading_id):
                 flash("Invalid JSON format in sensor data", "error")
                 return redirect(url_for('edit_reading', reading_id=reading_id))
             
-            # Convert temperature and humidity to float
-            try:
-                temperature = float(temperature) if temperature else None
-                humidity = float(humidity) if humidity else None
-            except ValueError:
-                flash("Temperature and humidity must be valid numbers", "error")
+            # Convert temperature and humidity to finite floats
+            reading, error = validate_reading({
+                "device_id": device_id,
+                "temperature": temperature or None,
+                "humidity": humidity or None,
+                "sensor_data": sensor_data
+            })
+            if error:
+                flash(error, "error")
                 return redirect(url_for('edit_reading', reading_id=reading_id))
             
-            # Update query
-            update_query = """
-            UPDATE iot_readings 
-            SET device_id = %s, temperature = %s, humidity = %s, sensor_data = %s
-            WHERE id = %s
-            """
-            
-            cursor.execute(update_query, (
-                device_id,
-                temperature,
-                humidity,
-                json.dumps(sensor_data),
-                reading_id
-            ))
-            
-            connection.commit()
+            # Every field is written, so emptied ones become NULL
+            result = IoTDataCRUD.update_fields(reading_id, {
+                "device_id": device_id,
+                "temperature": reading['temperature'],
+                "humidity": reading['humidity'],
+                "sensor_data": json.dumps(sensor_data)
+            })
+            if not result['success']:
+                flash(result['error'], "error")
+                return redirect(url_for('list_devices'))
             flash("Reading updated successfully", "success")
             return redirect(url_for('view_device', device_id=device_id))
-            
-    except Error as e:
-        flash(f"Database error: {str(e)}", "error")
-        return redirect(url_for('list_devices'))
     
-    finally:
-        cursor.close()
-        connection.close()
+    except StorageError as e:
+        flash(str(e), "error")
+        return redirect(url_for('list_devices'))
+    except Exception as e:
+        flash(f"Server error: {str(e)}", "error")
+        return redirect(url_for('list_devices'))
 
 @app.route('/delete/<int:reading_id>', methods=['POST'])
 def delete_reading(reading_id):
     """Delete an IoT reading"""
     try:
-        connection = get_db_connection()
-        if not connection:
-            flash("Database connection failed", "error")
-            return redirect(url_for('list_devices'))
-        
-        try:
-            cursor = connection.cursor(dictionary=True)
-            
-            # Get the reading to check device_id before deletion
-            query = "SELECT device_id FROM iot_readings WHERE id = %s"
-            cursor.execute(query, (reading_id,))
-            reading = cursor.fetchone()
-            
-            if not reading:
-                flash("Reading not found", "error")
-                return redirect(url_for('list_devices'))
-            
-            device_id = reading['device_id']
-            
-            # Delete the reading
-            delete_query = "DELETE FROM iot_readings WHERE id = %s"
-            cursor.execute(delete_query, (reading_id,))
-            connection.commit()
-            
-            flash("Reading deleted successfully", "success")
-            return redirect(url_for('view_device', device_id=device_id))
-            
-        except Error as e:
-            flash(f"Database error: {str(e)}", "error")
+        result = IoTDataCRUD.delete_reading(reading_id)
+        if not result['success']:
+            flash(result['error'], "error")
             return redirect(url_for('list_devices'))
         
-        finally:
-            cursor.close()
-            connection.close()
+        flash("Reading deleted successfully", "success")
+        return redirect(url_for('view_device', device_id=result['device_id']))
     
     except Exception as e:
         flash(f"Server error: {str(e)}", "error")
@@ -487,262 +3061,968 @@ def delete_reading(reading_id):
 # ========================
 
 class IoTDataCRUD:
-    """Basic CRUD operations for std01_iot_data database"""
+    """
+    Basic CRUD operations for std01_iot_data database, on the configured
+    storage backend. Results are {"success": ...} dicts; writes also keep
+    the latest-readings cache and stream viewers current.
+    """
     
     @staticmethod
     def create_reading(device_id, temperature=None, humidity=None, sensor_data=None):
         """Create a new reading in the database"""
-        connection = get_db_connection()
-        if not connection:
-            return {"success": False, "error": "Database connection failed"}
+        reading, error = validate_reading({
+            "device_id": device_id,
+            "temperature": temperature,
+            "humidity": humidity,
+            "sensor_data": sensor_data
+        })
+        if error:
+            return {"success": False, "error": error}
         
         try:
-            cursor = connection.cursor()
-            query = """
-            INSERT INTO iot_readings (device_id, temperature, humidity, sensor_data)
-            VALUES (%s, %s, %s, %s)
-            """
-            cursor.execute(query, (
-                device_id,
-                temperature,
-                humidity,
-                json.dumps(sensor_data) if sensor_data else None
-            ))
-            connection.commit()
-            reading_id = cursor.lastrowid
-            
-            return {
-                "success": True, 
-                "reading_id": reading_id,
-                "message": f"Reading created with ID {reading_id}"
-            }
-            
-        except Error as e:
-            return {"success": False, "error": f"Database error: {str(e)}"}
-        finally:
-            cursor.close()
-            connection.close()
+            reading_id = IoTDataCRUD._insert_rows([IoTDataCRUD._reading_row(reading, datetime.now())])
+        except StorageError as e:
+            return {"success": False, "error": str(e)}
+        
+        return {
+            "success": True, 
+            "reading_id": reading_id,
+            "message": f"Reading created with ID {reading_id}"
+        }
     
     @staticmethod
-    def read_reading(reading_id):
-        """Read a specific reading from the database"""
-        connection = get_db_connection()
-        if not connection:
-            return {"success": False, "error": "Database connection failed"}
+    def _reading_row(reading, default_timestamp):
+        """Convert a validated reading into an INSERT parameter tuple"""
+        return (
+            reading['device_id'],
+            reading['timestamp'] or default_timestamp,
+            reading['temperature'],
+            reading['humidity'],
+            json.dumps(reading['sensor_data']) if reading['sensor_data'] else None
+        )
+    
+    @staticmethod
+    def _insert_rows(rows):
+        """
+        Insert reading rows (the backend also updates device_stats), then
+        refresh the latest-readings cache and notify stream viewers.
+        Returns the id of the (first) inserted reading; raises StorageError.
+        """
+        reading_id = storage.insert_rows(rows)
         
-        try:
-            cursor = connection.cursor(dictionary=True)
-            query = "SELECT * FROM iot_readings WHERE id = %s"
-            cursor.execute(query, (reading_id,))
-            reading = cursor.fetchone()
-            
-            if reading:
-                return {"success": True, "reading": reading}
+        device_id = rows[0][0]
+        if len(rows) == 1 and reading_cache.is_warm(device_id):
+            # Cache the row as stored (DATETIME and FLOAT precision, server created_at)
+            # together with the device_stats version the insert produced
+            try:
+                reading = storage.get_reading(reading_id)
+                version = storage.device_validator(device_id).version
+            except StorageError:
+                reading = None
+            if reading is None or version is None:
+                reading_cache.invalidate(device_id)
             else:
-                return {"success": False, "error": "Reading not found"}
-                
-        except Error as e:
-            return {"success": False, "error": f"Database error: {str(e)}"}
-        finally:
-            cursor.close()
-            connection.close()
+                reading_cache.append(decode_sensor_data([reading])[0], version)
+        elif len(rows) > 1:
+            # Multi-row INSERT ids are not guaranteed to be consecutive; reload on next read
+            reading_cache.invalidate(*{row[0] for row in rows})
+        reading_broadcaster.publish(rows, reading_id)
+        return reading_id
+    
+    @staticmethod
+    def _bulk_insert(rows):
+        """Insert many reading rows with one multi-row INSERT and a single commit"""
+        try:
+            IoTDataCRUD._insert_rows(rows)
+            return {"success": True, "rows_affected": len(rows)}
+        except StorageError as e:
+            return {"success": False, "error": str(e)}
     
     @staticmethod
-    def read_all_readings(limit=100, offset=0):
-        """Read all readings from the database with pagination"""
-        connection = get_db_connection()
-        if not connection:
-            return {"success": False, "error": "Database connection failed"}
+    def create_readings(readings):
+        """
+        Create many readings with one multi-row INSERT and a single commit.
+        Invalid items are rejected individually and reported in `results`.
+        """
+        results = []
+        rows = []
+        now = datetime.now()
+        for index, data in enumerate(readings):
+            reading, error = validate_reading(data)
+            if error:
+                results.append({"index": index, "status": "rejected", "error": error})
+                continue
+            rows.append(IoTDataCRUD._reading_row(reading, now))
+            results.append({"index": index, "status": "created"})
         
+        created = len(rows)
+        if created:
+            result = IoTDataCRUD._bulk_insert(rows)
+            if not result['success']:
+                return result
+        
+        return {
+            "success": True,
+            "created": created,
+            "rejected": len(results) - created,
+            "results": results
+        }
+    
+    @staticmethod
+    def read_reading(reading_id):
+        """Read a specific reading from the database"""
         try:
-            cursor = connection.cursor(dictionary=True)
-            
-            # Get readings with pagination
-            query = """
-            SELECT * FROM iot_readings 
-            ORDER BY timestamp DESC 
-            LIMIT %s OFFSET %s
-            """
-            cursor.execute(query, (limit, offset))
-            readings = cursor.fetchall()
-            
-            # Get total count
-            count_query = "SELECT COUNT(*) as total FROM iot_readings"
-            cursor.execute(count_query)
-            total = cursor.fetchone()['total']
-            
-            return {
+            reading = storage.get_reading(reading_id)
+        except StorageError as e:
+            return {"success": False, "error": str(e)}
+        
+        if reading:
+            decode_sensor_data([reading])
+            return {"success": True, "reading": reading}
+        else:
+            return {"success": False, "error": "Reading not found"}
+    
+    @staticmethod
+    def _readings_page(device_id, limit, offset, after, before, include_total, filters=None):
+        """One page of readings with cursors for the neighbouring pages (and optionally the total)"""
+        try:
+            readings, has_older, has_newer = storage.readings_page(
+                device_id, limit,
+                after=decode_cursor(after) if after else None,
+                before=decode_cursor(before) if before else None,
+                offset=offset,
+                filters=filters
+            )
+            result = {
                 "success": True,
-                "readings": readings,
-                "total": total,
+                "readings": decode_sensor_data(readings),
                 "limit": limit,
-                "offset": offset
+                "offset": offset,
+                "next_cursor": encode_cursor(readings[-1]) if readings and has_older else None,
+                "prev_cursor": encode_cursor(readings[0]) if readings and has_newer else None
             }
-            
-        except Error as e:
-            return {"success": False, "error": f"Database error: {str(e)}"}
-        finally:
-            cursor.close()
-            connection.close()
+            if include_total and filters:
+                result["total"] = storage.count_readings(device_id, filters)
+            elif include_total:
+                result["total"] = storage.total_readings() if device_id is None else storage.device_total(device_id)
+            return result
+        except (ValueError, StorageError) as e:
+            return {"success": False, "error": str(e)}
     
     @staticmethod
-    def read_device_readings(device_id, limit=100, offset=0):
-        """Read all readings for a specific device"""
-        connection = get_db_connection()
-        if not connection:
-            return {"success": False, "error": "Database connection failed"}
+    def read_all_readings(limit=100, offset=0, after=None, before=None, include_total=True, filters=None):
+        """
+        Read all readings from the database with pagination.
+        Pass the returned `next_cursor` as `after` (or `prev_cursor` as `before`)
+        to page by keyset instead of offset. The exact total is optional.
+        `filters` is a ReadingFilter, e.g. ReadingFilter(device_prefix="esp32_",
+        start=datetime(2025, 8, 1), comparisons=(("battery", "lt", 20),)),
+        served from the index chosen by search_index().
+        """
+        return IoTDataCRUD._readings_page(None, limit, offset, after, before, include_total, filters)
+    
+    @staticmethod
+    def read_device_readings(device_id, limit=100, offset=0, after=None, before=None, include_total=True,
+                             filters=None):
+        """Read all readings for a specific device (offset or keyset pagination, optional ReadingFilter)"""
+        result = IoTDataCRUD._readings_page(device_id, limit, offset, after, before, include_total, filters)
+        if result['success']:
+            result["device_id"] = device_id
+        return result
+    
+    @staticmethod
+    def aggregate_readings(device_id, bucket_seconds, start, end):
+        """
+        Min/max/avg/count per bucket for a device between start and end.
+        The range is widened to whole buckets; `source` names the rollup
+        resolution (MySQL) or "raw" when buckets are computed from readings.
+        """
+        if Rollups.choose_resolution(bucket_seconds) is None:
+            return {"success": False, "error": "bucket must be a whole number of minutes"}
+        start = bucket_start(start, bucket_seconds)
+        end = bucket_start(end - timedelta(microseconds=1), bucket_seconds) + timedelta(seconds=bucket_seconds)
         
         try:
-            cursor = connection.cursor(dictionary=True)
-            
-            # Get readings for specific device
-            query = """
-            SELECT * FROM iot_readings 
-            WHERE device_id = %s 
-            ORDER BY timestamp DESC 
-            LIMIT %s OFFSET %s
-            """
-            cursor.execute(query, (device_id, limit, offset))
-            readings = cursor.fetchall()
-            
-            # Get total count for this device
-            count_query = "SELECT COUNT(*) as total FROM iot_readings WHERE device_id = %s"
-            cursor.execute(count_query, (device_id,))
-            total = cursor.fetchone()['total']
-            
-            return {
-                "success": True,
-                "device_id": device_id,
-                "readings": readings,
-                "total": total,
-                "limit": limit,
-                "offset": offset
+            source, rows = storage.aggregate(device_id, bucket_seconds, start, end)
+        except StorageError as e:
+            return {"success": False, "error": str(e)}
+        
+        # temperature, humidity and then each promoted sensor field under its own key
+        metrics = reading_metrics(SENSOR_FIELDS)
+        buckets = [
+            {
+                "bucket_start": row['bucket'],
+                "count": int(row['count']),
+                **{
+                    name: {
+                        "min": row[f"{column}_min"],
+                        "max": row[f"{column}_max"],
+                        "avg": row[f"{column}_avg"]
+                    }
+                    for name, column in metrics
+                }
             }
-            
-        except Error as e:
-            return {"success": False, "error": f"Database error: {str(e)}"}
-        finally:
-            cursor.close()
-            connection.close()
+            for row in rows
+        ]
+        
+        return {
+            "success": True,
+            "device_id": device_id,
+            "source": source,
+            "from": start.isoformat(),
+            "to": end.isoformat(),
+            "buckets": buckets
+        }
     
     @staticmethod
     def update_reading(reading_id, device_id=None, temperature=None, humidity=None, sensor_data=None):
-        """Update an existing reading in the database"""
-        connection = get_db_connection()
-        if not connection:
-            return {"success": False, "error": "Database connection failed"}
+        """Update an existing reading in the database (fields left as None are unchanged)"""
+        reading, error = validate_reading({
+            "device_id": device_id,
+            "temperature": temperature,
+            "humidity": humidity,
+            "sensor_data": sensor_data
+        }, partial=True)
+        if error:
+            return {"success": False, "error": error}
+        
+        fields = {}
+        for column in ("device_id", "temperature", "humidity"):
+            if reading[column] is not None:
+                fields[column] = reading[column]
+        if reading["sensor_data"] is not None:
+            fields["sensor_data"] = json.dumps(reading["sensor_data"])
         
+        if not fields:
+            return {"success": False, "error": "No fields to update"}
+        return IoTDataCRUD.update_fields(reading_id, fields)
+    
+    @staticmethod
+    def update_fields(reading_id, fields):
+        """Set the given columns of a reading ({column: value}, sensor_data as JSON text)"""
         try:
-            cursor = connection.cursor()
-            
-            # Check if reading exists
-            cursor.execute("SELECT id FROM iot_readings WHERE id = %s", (reading_id,))
-            if not cursor.fetchone():
-                return {"success": False, "error": "Reading not found"}
-            
-            # Build dynamic update query
-            update_parts = []
-            params = []
-            
-            if device_id is not None:
-                update_parts.append("device_id = %s")
-                params.append(device_id)
-            if temperature is not None:
-                update_parts.append("temperature = %s")
-                params.append(temperature)
-            if humidity is not None:
-                update_parts.append("humidity = %s")
-                params.append(humidity)
-            if sensor_data is not None:
-                update_parts.append("sensor_data = %s")
-                params.append(json.dumps(sensor_data))
-            
-            if not update_parts:
-                return {"success": False, "error": "No fields to update"}
-            
-            query = f"UPDATE iot_readings SET {', '.join(update_parts)} WHERE id = %s"
-            params.append(reading_id)
-            
-            cursor.execute(query, params)
-            connection.commit()
-            
-            return {
-                "success": True,
-                "message": f"Reading {reading_id} updated successfully",
-                "rows_affected": cursor.rowcount
-            }
-            
-        except Error as e:
-            return {"success": False, "error": f"Database error: {str(e)}"}
-        finally:
-            cursor.close()
-            connection.close()
+            changed = storage.update_reading(reading_id, fields)
+        except StorageError as e:
+            return {"success": False, "error": str(e)}
+        if changed is None:
+            return {"success": False, "error": "Reading not found"}
+        
+        previous_device_id, device_id, rows_affected = changed
+        reading_cache.invalidate(previous_device_id, device_id)
+        return {
+            "success": True,
+            "message": f"Reading {reading_id} updated successfully",
+            "rows_affected": rows_affected
+        }
     
     @staticmethod
     def delete_reading(reading_id):
         """Delete a reading from the database"""
-        connection = get_db_connection()
-        if not connection:
-            return {"success": False, "error": "Database connection failed"}
+        try:
+            deleted = storage.delete_reading(reading_id)
+        except StorageError as e:
+            return {"success": False, "error": str(e)}
+        if deleted is None:
+            return {"success": False, "error": "Reading not found"}
         
+        device_id, rows_affected = deleted
+        reading_cache.invalidate(device_id)
+        return {
+            "success": True,
+            "message": f"Reading {reading_id} deleted successfully",
+            "device_id": device_id,
+            "rows_affected": rows_affected
+        }
+    
+    @staticmethod
+    def delete_device_readings(device_id, start=None, end=None):
+        """
+        Queue a purge job for a device's readings (all of them, or those in
+        [start, end)); returns the job as a dict. Raises JobQueueFull.
+        """
         try:
-            cursor = connection.cursor()
-            
-            # Check if reading exists first
-            cursor.execute("SELECT id FROM iot_readings WHERE id = %s", (reading_id,))
-            if not cursor.fetchone():
-                return {"success": False, "error": "Reading not found"}
+            if storage.device_total(device_id) == 0:
+                return {"success": False, "error": f"No readings found for device {device_id}"}
+        except StorageError as e:
+            return {"success": False, "error": str(e)}
+        
+        job = job_executor.submit('purge', {"device_id": device_id, "from": start, "to": end})
+        return {
+            "success": True,
+            "message": f"Deleting readings for device {device_id}",
+            "job": job.to_dict()
+        }
+
+# ========================
+# BACKGROUND JOBS
+# ========================
+
+# Long-running data operations run on a small pool of worker threads instead
+# of the request thread; clients poll /api/jobs/<id> for progress
+JOB_CONFIG = {
+    'workers': int(os.environ.get('JOB_WORKERS', 4)),
+    'queue_size': int(os.environ.get('JOB_QUEUE_SIZE', 100)),     # jobs waiting for a worker
+    'history': int(os.environ.get('JOB_HISTORY', 100)),           # finished jobs kept for polling
+    # Per-type concurrency overrides, e.g. JOB_LIMITS="purge=4,rebuild_rollups=1"
+    'limits': {
+        name.strip(): int(limit)
+        for name, _, limit in (item.partition('=') for item in os.environ.get('JOB_LIMITS', '').split(','))
+        if name.strip()
+    }
+}
+
+# Registered job types by name; see job_type()
+JOB_TYPES = {}
+
+JobType = collections.namedtuple('JobType', 'run parse limit cancellable feature')
+
+def _no_params(params):
+    if params:
+        raise ValueError(f"Unexpected params: {', '.join(sorted(params))}")
+    return {}
+
+def job_type(name, limit=1, cancellable=False, parse=_no_params, feature=None):
+    """
+    Register `run(job, params)` as a job type. `parse` turns request params
+    into the dict passed to `run` (raising ValueError), `limit` caps how many
+    run at once (JOB_LIMITS overrides it) and `feature` names the storage
+    feature the type needs.
+    """
+    def register(func):
+        JOB_TYPES[name] = JobType(func, parse, JOB_CONFIG['limits'].get(name, limit), cancellable, feature)
+        return func
+    return register
+
+class JobQueueFull(Exception):
+    """Every queue slot is taken; the client should retry later"""
+
+class Job:
+    """
+    One submitted job. The type's `run(job, params)` reports progress with
+    report() and returns a {"success": ..., "error": ...} dict like the rest
+    of the app; the other keys become the job's result. Cancellable types
+    check `cancelled` between steps.
+    """
+    
+    def __init__(self, name, params):
+        self.id = uuid.uuid4().hex
+        self.type = name
+        self.params = params
+        self.status = 'queued'
+        self.done = 0
+        self.total = None
+        self.result = None
+        self.error = None
+        self.created_at = datetime.now()
+        self.started_at = None
+        self.finished_at = None
+        self._cancel = threading.Event()
+    
+    @property
+    def finished(self):
+        return self.status in ('completed', 'cancelled', 'failed')
+    
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+    
+    def cancel(self):
+        self._cancel.set()
+    
+    def report(self, done, total=None):
+        self.done = done
+        if total is not None:
+            self.total = total
+    
+    def wait(self, seconds):
+        """Pause between steps; returns early (True) when the job is cancelled"""
+        return self._cancel.wait(seconds)
+    
+    def run(self):
+        try:
+            result = dict(JOB_TYPES[self.type].run(self, self.params))
+        except Exception as e:
+            # A failing job must not take its worker thread down with it
+            result = {"success": False, "error": str(e)}
+        self.error = result.pop('error', None)
+        if not result.pop('success', False):
+            self.status = 'failed'
+        elif self.cancelled:
+            self.status = 'cancelled'
+        else:
+            self.status = 'completed'
+        self.result = result
+        self.finished_at = datetime.now()
+    
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "type": self.type,
+            "params": self.params,
+            "status": self.status,
+            "progress": {"done": self.done, "total": self.total},
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at
+        }
+
+class JobExecutor:
+    """
+    Fixed pool of worker threads over a bounded queue of jobs. A worker takes
+    the oldest queued job whose type is below its concurrency limit, so a
+    backlog of one type never holds up the others. Jobs live in this
+    process's memory.
+    """
+    
+    def __init__(self, workers, queue_size, history):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.history = history
+        self._jobs = collections.OrderedDict()
+        self._queued = collections.deque()
+        self._running = collections.Counter()
+        self._counters = collections.Counter()
+        self._lock = threading.Condition()
+        self._threads = []
+    
+    def submit(self, name, params):
+        """
+        Queue a job, or return the unfinished job with the same type and
+        params. Raises JobQueueFull when queue_size jobs are already waiting.
+        """
+        with self._lock:
+            for job in self._jobs.values():
+                if not job.finished and (job.type, job.params) == (name, params):
+                    return job
+            if len(self._queued) >= self.queue_size:
+                self._counters['rejected'] += 1
+                raise JobQueueFull(f"Job queue is full ({self.queue_size} jobs waiting)")
+            job = Job(name, params)
+            self._jobs[job.id] = job
+            self._queued.append(job)
+            self._counters['submitted'] += 1
             
-            # Delete the reading
-            query = "DELETE FROM iot_readings WHERE id = %s"
-            cursor.execute(query, (reading_id,))
-            connection.commit()
+            finished = [key for key, value in self._jobs.items() if value.finished]
+            for key in finished[:max(0, len(finished) - self.history)]:
+                del self._jobs[key]
             
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._work, name=f"job-worker-{len(self._threads)}", daemon=True)
+                self._threads.append(thread)
+                thread.start()
+            self._lock.notify_all()
+        return job
+    
+    def cancel(self, job):
+        """Cancel a queued job, or ask a running cancellable one to stop; False when it cannot be"""
+        with self._lock:
+            if job.status == 'queued':
+                self._queued.remove(job)
+                job.status, job.finished_at = 'cancelled', datetime.now()
+                self._counters['cancelled'] += 1
+                return True
+        if job.status == 'running' and JOB_TYPES[job.type].cancellable:
+            job.cancel()
+            return True
+        return False
+    
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+    
+    def all(self):
+        with self._lock:
+            return list(self._jobs.values())
+    
+    def stats(self):
+        with self._lock:
             return {
-                "success": True,
-                "message": f"Reading {reading_id} deleted successfully",
-                "rows_affected": cursor.rowcount
+                "workers": len(self._threads),
+                "queued": len(self._queued),
+                "running": sum(self._running.values()),
+                **{key: self._counters[key] for key in ('submitted', 'rejected', 'completed', 'failed', 'cancelled')}
             }
-            
-        except Error as e:
-            return {"success": False, "error": f"Database error: {str(e)}"}
-        finally:
-            cursor.close()
-            connection.close()
+    
+    def _next(self):
+        with self._lock:
+            while True:
+                for job in self._queued:
+                    if self._running[job.type] < JOB_TYPES[job.type].limit:
+                        self._queued.remove(job)
+                        self._running[job.type] += 1
+                        job.status, job.started_at = 'running', datetime.now()
+                        return job
+                self._lock.wait()
+    
+    def _work(self):
+        while True:
+            job = self._next()
+            try:
+                job.run()
+            finally:
+                with self._lock:
+                    self._running[job.type] -= 1
+                    self._counters[job.status] += 1
+                    self._lock.notify_all()
+
+job_executor = JobExecutor(JOB_CONFIG['workers'], JOB_CONFIG['queue_size'], JOB_CONFIG['history'])
+
+# Device and time-range purges delete in short primary-key chunks, so no
+# transaction holds locks or undo for long
+PURGE_CONFIG = {
+    'chunk_size': int(os.environ.get('PURGE_CHUNK_SIZE', 1000)),
+    'pause': float(os.environ.get('PURGE_CHUNK_PAUSE', 0.05))     # seconds between chunks
+}
+
+def _purge_params(params):
+    device_id = params.get('device_id')
+    if not isinstance(device_id, str) or not device_id:
+        raise ValueError("device_id must be a non-empty string")
+    times = {}
+    for name in ('from', 'to'):
+        value = params.get(name)
+        if value is not None and not isinstance(value, str):
+            raise ValueError(f"{name} must be an ISO 8601 string")
+        times[name] = parse_time(value) if value else None
+    if times['from'] and times['to'] and times['from'] >= times['to']:
+        raise ValueError("from must be earlier than to")
+    return {"device_id": device_id, **times}
+
+@job_type('purge', limit=2, cancellable=True, parse=_purge_params)
+def purge_job(job, params):
+    """
+    Delete a device's readings (all of them, or those in [from, to)) oldest
+    first, PURGE_CONFIG['chunk_size'] at a time. Readings that arrive after
+    the purge started are kept. Each chunk is its own transaction, so a
+    cancelled purge keeps what it deleted and the summaries match what is left.
+    """
+    device_id, start, end = params['device_id'], params['from'], params['to']
+    whole_device = start is None and end is None
+    chunk_size = PURGE_CONFIG['chunk_size']
+    deleted = 0
+    try:
+        if whole_device:
+            job.report(0, storage.device_total(device_id))
+        else:
+            job.report(0, storage.count_readings(device_id, ReadingFilter(start=start, end=end)))
+        max_id = storage.last_reading_id()
+        while not job.cancelled:
+            count = storage.delete_readings_chunk(device_id, chunk_size, start, end, max_id)
+            deleted += count
+            if count < chunk_size:
+                if whole_device:
+                    deleted += storage.forget_device(device_id)
+                break
+            job.report(deleted)
+            reading_cache.invalidate(device_id)
+            job.wait(PURGE_CONFIG['pause'])
+    except StorageError as e:
+        return {"success": False, "error": str(e), "deleted": deleted}
+    finally:
+        job.report(deleted)
+        reading_cache.invalidate(device_id)
+    return {"success": True, "deleted": deleted}
+
+@job_type('rebuild_device_stats', feature='device_stats_rebuild')
+def rebuild_device_stats_job(job, params):
+    """The full-table aggregation behind /devices, written to device_stats"""
+    return rebuild_device_stats()
+
+@job_type('rebuild_rollups', feature='rollups')
+def rebuild_rollups_job(job, params):
+    return rebuild_rollups()
+
+def job_accepted(body):
+    """202 response for a submitted job (body holds "job": Job.to_dict()), with its polling URL"""
+    response = jsonify({"success": True, **body})
+    response.status_code = 202
+    response.headers['Location'] = url_for('job_status', job_id=body['job']['id'])
+    return response
+
+def job_queue_full(error):
+    response = jsonify({"success": False, "error": str(error)})
+    response.headers['Retry-After'] = '5'
+    return response, 503
+
+@app.route('/api/jobs', methods=['GET', 'POST'])
+def api_jobs():
+    """List jobs, newest first (GET), or submit one (POST {"type": ..., "params": {...}})"""
+    if request.method == 'GET':
+        listed = [job.to_dict() for job in reversed(job_executor.all())]
+        return jsonify({"success": True, "jobs": listed, "types": sorted(JOB_TYPES), **job_executor.stats()})
+    
+    data = request.get_json(silent=True) or {}
+    name = data.get('type')
+    if name not in JOB_TYPES:
+        return jsonify({"success": False, "error": f"type must be one of: {', '.join(sorted(JOB_TYPES))}"}), 400
+    if JOB_TYPES[name].feature:
+        error = unsupported_feature(JOB_TYPES[name].feature)
+        if error:
+            return jsonify({"success": False, "error": error}), 501
+    params = data.get('params') or {}
+    if not isinstance(params, dict):
+        return jsonify({"success": False, "error": "params must be an object"}), 400
+    try:
+        params = JOB_TYPES[name].parse(params)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    try:
+        return job_accepted({"job": job_executor.submit(name, params).to_dict()})
+    except JobQueueFull as e:
+        return job_queue_full(e)
+
+@app.route('/api/jobs/<job_id>', methods=['GET', 'DELETE'])
+def job_status(job_id):
+    """Status and progress of a job (GET), or cancel it (DELETE)"""
+    job = job_executor.get(job_id)
+    if job is None:
+        return jsonify({"success": False, "error": "Job not found"}), 404
+    if request.method == 'DELETE' and not job.finished:
+        if not job_executor.cancel(job):
+            return jsonify({"success": False, "error": f"A running {job.type} job cannot be cancelled"}), 409
+        return jsonify({"success": True, "job": job.to_dict()}), 202
+    return jsonify({"success": True, "job": job.to_dict()})
+
+# ========================
+# WRITE-BEHIND INGEST BUFFER
+# ========================
+
+# Write-behind ingest configuration (disabled by default)
+INGEST_CONFIG = {
+    'write_behind': os.environ.get('INGEST_WRITE_BEHIND', '0') == '1',
+    'queue_size': int(os.environ.get('INGEST_QUEUE_SIZE', 10000)),        # readings held before backpressure
+    'flush_rows': int(os.environ.get('INGEST_FLUSH_ROWS', 500)),          # flush when this many rows are queued
+    'flush_interval': float(os.environ.get('INGEST_FLUSH_INTERVAL', 0.2)), # or after this many seconds
+    'max_backoff': float(os.environ.get('INGEST_MAX_BACKOFF', 5)),         # longest wait between retries of a failing batch
+    'retry_after': int(os.environ.get('INGEST_RETRY_AFTER', 1))           # Retry-After seconds sent on 503
+}
+
+class IngestBuffer:
+    """Bounded in-process queue drained by a background thread into bulk INSERTs"""
+    
+    RATE_WINDOW = 10  # seconds used for the rows/sec figure
+    
+    def __init__(self, queue_size=10000, flush_rows=500, flush_interval=0.2, max_backoff=5):
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.max_backoff = max_backoff
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._stats_lock = threading.Lock()
+        self._recent = collections.deque()  # (monotonic time, rows) per flush
+        self._stats = {
+            "accepted": 0,
+            "rejected_full": 0,
+            "flushes": 0,
+            "rows_flushed": 0,
+            "flush_errors": 0,
+            "rows_dropped": 0,
+            "last_flush_ms": 0.0,
+            "total_flush_ms": 0.0
+        }
+    
+    def start(self):
+        """Start the flusher thread if it is not already running"""
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name="ingest-flusher", daemon=True)
+                self._thread.start()
+    
+    def stop(self, timeout=5):
+        """Stop the flusher after draining queued readings"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+    
+    def submit(self, reading):
+        """Queue a validated reading; returns False when the queue is full"""
+        self.start()
+        try:
+            self._queue.put_nowait(reading)
+        except queue.Full:
+            with self._stats_lock:
+                self._stats["rejected_full"] += 1
+            return False
+        with self._stats_lock:
+            self._stats["accepted"] += 1
+        return True
+    
+    def _collect(self):
+        """Block until flush_rows readings are queued or flush_interval has passed"""
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.flush_rows:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
     
     @staticmethod
-    def delete_device_readings(device_id):
-        """Delete all readings for a specific device"""
-        connection = get_db_connection()
-        if not connection:
-            return {"success": False, "error": "Database connection failed"}
-        
+    def _is_transient(error):
+        """Connection, pool and lock failures, which a later retry can get past"""
+        if not isinstance(error, StorageError):
+            return False
+        cause = error.__cause__
+        return cause is None or isinstance(cause, (
+            mysql.connector.errors.OperationalError,
+            mysql.connector.errors.InterfaceError,
+            sqlite3.OperationalError
+        ))
+    
+    def _flush(self, batch):
+        """Insert one batch; returns None on success or the exception it failed with"""
+        started = time.monotonic()
         try:
-            cursor = connection.cursor()
-            
-            # Count readings before deletion
-            cursor.execute("SELECT COUNT(*) as count FROM iot_readings WHERE device_id = %s", (device_id,))
-            count = cursor.fetchone()[0]
-            
-            if count == 0:
-                return {"success": False, "error": f"No readings found for device {device_id}"}
-            
-            # Delete all readings for the device
-            query = "DELETE FROM iot_readings WHERE device_id = %s"
-            cursor.execute(query, (device_id,))
-            connection.commit()
-            
+            now = datetime.now()
+            IoTDataCRUD._insert_rows([IoTDataCRUD._reading_row(reading, now) for reading in batch])
+        except Exception as e:
+            with self._stats_lock:
+                self._stats["flush_errors"] += 1
+            print(f"Ingest flush of {len(batch)} rows failed: {e}")
+            return e
+        elapsed_ms = (time.monotonic() - started) * 1000
+        
+        with self._stats_lock:
+            self._stats["flushes"] += 1
+            self._stats["rows_flushed"] += len(batch)
+            self._stats["last_flush_ms"] = round(elapsed_ms, 3)
+            self._stats["total_flush_ms"] += elapsed_ms
+            self._recent.append((time.monotonic(), len(batch)))
+        return None
+    
+    def _isolate(self, batch):
+        """Bisect a failing batch so good rows are written and the rows that fail alone are dropped"""
+        if len(batch) == 1:
+            with self._stats_lock:
+                self._stats["rows_dropped"] += 1
+            print(f"Ingest dropped reading: {json.dumps(batch[0], default=str)}")
+            return
+        middle = len(batch) // 2
+        for half in (batch[:middle], batch[middle:]):
+            if self._flush(half) is not None:
+                self._isolate(half)
+    
+    def _write(self, batch):
+        """
+        Write a batch. Transient failures (database or pool down, lock timeouts)
+        are retried with capped backoff for as long as they last, while the
+        bounded queue applies backpressure; any other failure is bisected to
+        drop only the rows that fail alone. On shutdown one last attempt is
+        made and a batch that still cannot be written is counted as dropped.
+        """
+        backoff = self.flush_interval
+        while True:
+            error = self._flush(batch)
+            if error is None:
+                return
+            if not self._is_transient(error):
+                self._isolate(batch)
+                return
+            if self._stop.wait(backoff):
+                break
+            backoff = min(backoff * 2, self.max_backoff)
+        
+        error = self._flush(batch)
+        if error is None:
+            return
+        if not self._is_transient(error):
+            self._isolate(batch)
+            return
+        with self._stats_lock:
+            self._stats["rows_dropped"] += len(batch)
+        print(f"Ingest dropped {len(batch)} queued readings at shutdown: {error}")
+    
+    def _run(self):
+        while not (self._stop.is_set() and self._queue.empty()):
+            try:
+                batch = self._collect()
+                if batch:
+                    self._write(batch)
+            except Exception as e:
+                print(f"Ingest flusher error: {e}")
+    
+    def stats(self):
+        """Return queue depth, flush latency and throughput counters"""
+        with self._stats_lock:
+            cutoff = time.monotonic() - self.RATE_WINDOW
+            while self._recent and self._recent[0][0] < cutoff:
+                self._recent.popleft()
+            flushes = self._stats["flushes"]
             return {
-                "success": True,
-                "message": f"Deleted {count} readings for device {device_id}",
-                "rows_affected": cursor.rowcount
+                "enabled": INGEST_CONFIG['write_behind'],
+                "running": self._thread is not None and self._thread.is_alive(),
+                "queue_depth": self._queue.qsize(),
+                "queue_capacity": self._queue.maxsize,
+                "avg_flush_ms": round(self._stats["total_flush_ms"] / flushes, 3) if flushes else 0.0,
+                "rows_per_sec": round(sum(rows for _, rows in self._recent) / self.RATE_WINDOW, 2),
+                **{key: value for key, value in self._stats.items() if key != "total_flush_ms"}
             }
-            
-        except Error as e:
-            return {"success": False, "error": f"Database error: {str(e)}"}
+
+ingest_buffer = IngestBuffer(
+    queue_size=INGEST_CONFIG['queue_size'],
+    flush_rows=INGEST_CONFIG['flush_rows'],
+    flush_interval=INGEST_CONFIG['flush_interval'],
+    max_backoff=INGEST_CONFIG['max_backoff']
+)
+atexit.register(ingest_buffer.stop)
+
+@app.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    """Latest-readings cache statistics"""
+    return jsonify(reading_cache.stats())
+
+@app.route('/api/ingest/stats', methods=['GET'])
+def ingest_stats():
+    """Write-behind ingest queue and flusher statistics"""
+    return jsonify(ingest_buffer.stats())
+
+# ========================
+# LIVE READING STREAM
+# ========================
+
+# Server-Sent Events fan-out of newly ingested readings
+STREAM_CONFIG = {
+    'max_subscribers': int(os.environ.get('STREAM_MAX_SUBSCRIBERS', 100)),  # open /api/stream connections
+    'queue_size': int(os.environ.get('STREAM_QUEUE_SIZE', 1000)),           # events buffered per viewer
+    'keepalive': float(os.environ.get('STREAM_KEEPALIVE', 15))              # seconds between keep-alive comments
+}
+
+def format_sse(event, data):
+    """Encode one Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+class _Subscriber:
+    __slots__ = ('device_id', 'queue', 'lagged')
+    
+    def __init__(self, device_id, queue_size):
+        self.device_id = device_id
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.lagged = False
+
+class ReadingBroadcaster:
+    """
+    In-process fan-out of ingest events to /api/stream viewers. Each insert
+    is serialised once and copied to every subscriber's bounded queue, so N
+    viewers cost no database queries. A viewer that falls behind is told to
+    reload rather than slowing down ingest.
+    """
+    
+    def __init__(self, max_subscribers=100, queue_size=1000):
+        self.max_subscribers = max_subscribers
+        self.queue_size = queue_size
+        self._subscribers = set()
+        self._lock = threading.Lock()
+    
+    def subscribe(self, device_id=None):
+        """Register a viewer (optionally for one device); None when the limit is reached"""
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                return None
+            subscriber = _Subscriber(device_id, self.queue_size)
+            self._subscribers.add(subscriber)
+            return subscriber
+    
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+    
+    def publish(self, rows, reading_id=None):
+        """
+        Publish inserted (device_id, timestamp, temperature, humidity, sensor_json)
+        rows as `reading` events plus one `device` summary delta per device.
+        `reading_id` is only known for single-row inserts.
+        """
+        if not self._subscribers:
+            return
+        
+        events = []
+        latest = {}
+        for device_id, timestamp, temperature, humidity, sensor_data in rows:
+            events.append((device_id, format_sse('reading', {
+                "id": reading_id if len(rows) == 1 else None,
+                "device_id": device_id,
+                "timestamp": timestamp.isoformat(),
+                "temperature": temperature,
+                "humidity": humidity,
+                "sensor_data": json.loads(sensor_data) if sensor_data else None
+            })))
+            if device_id not in latest or timestamp >= latest[device_id][0]:
+                latest[device_id] = (timestamp, temperature, humidity)
+        
+        deltas = stats_deltas((row[0], row[2], row[3]) for row in rows)
+        for device_id, (count, temperature_sum, temperature_count, humidity_sum, humidity_count) in deltas.items():
+            timestamp, temperature, humidity = latest[device_id]
+            events.append((device_id, format_sse('device', {
+                "device_id": device_id,
+                "last_seen": timestamp.isoformat(),
+                "last_temperature": temperature,
+                "last_humidity": humidity,
+                "added_readings": count,
+                "temperature_sum": temperature_sum,
+                "temperature_count": temperature_count,
+                "humidity_sum": humidity_sum,
+                "humidity_count": humidity_count
+            })))
+        
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            for device_id, event in events:
+                if subscriber.device_id not in (None, device_id):
+                    continue
+                try:
+                    subscriber.queue.put_nowait(event)
+                except queue.Full:
+                    subscriber.lagged = True
+                    break
+    
+    def stats(self):
+        with self._lock:
+            return {"subscribers": len(self._subscribers), "max_subscribers": self.max_subscribers}
+
+reading_broadcaster = ReadingBroadcaster(STREAM_CONFIG['max_subscribers'], STREAM_CONFIG['queue_size'])
+
+@app.route('/api/stream', methods=['GET'])
+def stream_readings():
+    """
+    Server-Sent Events stream of newly ingested readings (`reading` events)
+    and device summary deltas (`device` events). Optional ?device_id= filter.
+    A `reset` event means events were missed and the client should reload.
+    """
+    device_id = request.args.get('device_id') or None
+    subscriber = reading_broadcaster.subscribe(device_id)
+    if subscriber is None:
+        response = jsonify({"error": "Too many stream subscribers, retry later"})
+        response.headers['Retry-After'] = '30'
+        return response, 503
+    
+    def generate():
+        try:
+            yield "retry: 5000\n\n"
+            while not subscriber.lagged:
+                try:
+                    yield subscriber.queue.get(timeout=STREAM_CONFIG['keepalive'])
+                except queue.Empty:
+                    # Comment line: keeps proxies from closing an idle connection
+                    yield ": keepalive\n\n"
+            yield format_sse('reset', {})
         finally:
-            cursor.close()
-            connection.close()
+            reading_broadcaster.unsubscribe(subscriber)
+    
+    # stream_with_context defers teardown, so the viewer counts as in flight until it disconnects
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
 
 # ========================
 # CRUD API ENDPOINTS
@@ -785,10 +4065,33 @@ def api_read_all_readings():
     try:
         limit = request.args.get('limit', 100, type=int)
         offset = request.args.get('offset', 0, type=int)
+        after = request.args.get('after')
+        before = request.args.get('before')
+        try:
+            for token in (after, before):
+                if token:
+                    decode_cursor(token)
+            filters = parse_reading_filter(request.args)
+        except ValueError as e:
+            return jsonify({"success": False, "error": str(e)}), 400
         
-        result = IoTDataCRUD.read_all_readings(limit=limit, offset=offset)
-        status_code = 200 if result['success'] else 500
-        return jsonify(result), status_code
+        # Exact totals cost a full count; they default off when paging by cursor
+        include_total = arg_flag('count', default=not (after or before))
+        
+        try:
+            validator = storage.readings_validator()
+        except StorageError as e:
+            return jsonify({"success": False, "error": str(e)}), 500
+        response = not_modified(validator)
+        if response:
+            return response
+        
+        result = IoTDataCRUD.read_all_readings(
+            limit=limit, offset=offset, after=after, before=before, include_total=include_total, filters=filters
+        )
+        if not result['success']:
+            return jsonify(result), 500
+        return with_validators(jsonify(result), validator)
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
@@ -798,10 +4101,33 @@ def api_read_device_readings(device_id):
     try:
         limit = request.args.get('limit', 100, type=int)
         offset = request.args.get('offset', 0, type=int)
+        after = request.args.get('after')
+        before = request.args.get('before')
+        try:
+            for token in (after, before):
+                if token:
+                    decode_cursor(token)
+            filters = parse_reading_filter(request.args, device_id)
+        except ValueError as e:
+            return jsonify({"success": False, "error": str(e)}), 400
         
-        result = IoTDataCRUD.read_device_readings(device_id, limit=limit, offset=offset)
-        status_code = 200 if result['success'] else 500
-        return jsonify(result), status_code
+        include_total = arg_flag('count', default=not (after or before))
+        
+        try:
+            validator = storage.device_validator(device_id)
+        except StorageError as e:
+            return jsonify({"success": False, "error": str(e)}), 500
+        response = not_modified(validator)
+        if response:
+            return response
+        
+        result = IoTDataCRUD.read_device_readings(
+            device_id, limit=limit, offset=offset, after=after, before=before, include_total=include_total,
+            filters=filters
+        )
+        if not result['success']:
+            return jsonify(result), 500
+        return with_validators(jsonify(result), validator)
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
@@ -839,18 +4165,130 @@ def api_delete_reading(reading_id):
 
 @app.route('/api/crud/device/<device_id>', methods=['DELETE'])
 def api_delete_device_readings(device_id):
-    """API endpoint to delete all readings for a specific device"""
+    """
+    API endpoint to delete all readings for a specific device, or those in
+    ?from=...&to=...; the deletion runs as a purge job and the response
+    links to its progress
+    """
     try:
-        result = IoTDataCRUD.delete_device_readings(device_id)
-        status_code = 200 if result['success'] else 404
-        return jsonify(result), status_code
+        start = parse_time(request.args['from']) if request.args.get('from') else None
+        end = parse_time(request.args['to']) if request.args.get('to') else None
+    except ValueError as e:
+        return jsonify({"success": False, "error": f"Invalid time range: {e}"}), 400
+    if start and end and start >= end:
+        return jsonify({"success": False, "error": "from must be earlier than to"}), 400
+    try:
+        result = IoTDataCRUD.delete_device_readings(device_id, start, end)
+        if not result['success']:
+            return jsonify(result), 404
+        return job_accepted(result)
+    except JobQueueFull as e:
+        return job_queue_full(e)
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
+# ========================
+# STREAMING EXPORT
+# ========================
+
+# Rows pulled from the storage backend per chunk
+EXPORT_CHUNK_SIZE = int(os.environ.get('EXPORT_CHUNK_SIZE', 1000))
+
+def _export_ndjson(rows):
+    lines = []
+    for row in rows:
+        record = dict(zip(EXPORT_COLUMNS, row))
+        for key in ('timestamp', 'created_at'):
+            if record[key] is not None:
+                record[key] = record[key].isoformat()
+        if isinstance(record['sensor_data'], (str, bytes)):
+            record['sensor_data'] = json.loads(record['sensor_data'])
+        lines.append(json.dumps(record))
+    return '\n'.join(lines) + '\n'
+
+def _export_csv(rows, header=False):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(EXPORT_COLUMNS)
+    for row in rows:
+        writer.writerow([
+            value.isoformat() if isinstance(value, datetime) else value
+            for value in row
+        ])
+    return buffer.getvalue()
+
+@app.route('/api/export/<device_id>', methods=['GET'])
+def export_device_readings(device_id):
+    """
+    Stream a device's readings as NDJSON or CSV, oldest first.
+    Query parameters: from / to (ISO 8601), format (ndjson or csv),
+    after (cursor or "timestamp,id" of the last row received, to resume).
+    Rows come from the storage backend in EXPORT_CHUNK_SIZE chunks (an
+    unbuffered cursor on MySQL), so memory use does not depend on the size
+    of the range.
+    """
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in ('ndjson', 'csv'):
+        return jsonify({"error": "format must be ndjson or csv"}), 400
+    
+    try:
+        start = parse_time(request.args['from']) if request.args.get('from') else None
+        end = parse_time(request.args['to']) if request.args.get('to') else None
+        after = decode_cursor(request.args['after']) if request.args.get('after') else None
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    chunks = storage.iter_readings(device_id, start, end, after, EXPORT_CHUNK_SIZE)
+    try:
+        # Fetch the first chunk before any headers are sent, so a failing backend is still a 500
+        first = next(chunks, [])
+    except StorageError as e:
+        return jsonify({"error": str(e)}), 500
+    
+    # Honours q-values, so "gzip;q=0" gets an uncompressed export
+    gzip_response = request.accept_encodings['gzip'] > 0
+    
+    def generate():
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if gzip_response else None
+        
+        def encode(chunk):
+            data = chunk.encode()
+            if compressor:
+                # Sync flush so the client can decompress each chunk as it arrives
+                data = compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            return data
+        
+        try:
+            if export_format == 'csv':
+                yield encode(_export_csv([], header=True))
+            for rows in itertools.chain([first], chunks):
+                if rows:
+                    yield encode(_export_csv(rows) if export_format == 'csv' else _export_ndjson(rows))
+            if compressor:
+                yield compressor.flush()
+        except StorageError as e:
+            # Headers are already sent; the client resumes with ?after=<last timestamp,id>
+            print(f"Export of {device_id} aborted: {e}")
+        finally:
+            chunks.close()
+    
+    mimetype = 'text/csv' if export_format == 'csv' else 'application/x-ndjson'
+    response = Response(stream_with_context(generate()), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{device_id}.{export_format}"'
+    response.vary.add('Accept-Encoding')
+    if gzip_response:
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
 if __name__ == '__main__':
     # Initialize database on startup
     init_database()
     
+    # Keep future partitions ready and enforce retention in the background
+    if 'retention' in storage.features:
+        maintenance_scheduler.start()
+    
     # Run the Flask app
     app.run(
         host='0.0.0.0',
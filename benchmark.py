@@ -0,0 +1,468 @@
+"""
+HTTP load benchmark for the IoT API
+
+Starts app.py under `flask run` against a local MySQL database (never the
+production one), drives concurrent workloads for a fixed duration and writes
+req/s and latency percentiles per endpoint as JSON:
+
+    python benchmark.py run --devices 50 --pollers 5 --crud-workers 2 --duration 30 --output before.json
+    python benchmark.py compare before.json after.json
+
+A throwaway MySQL server is enough as the database stand-in, for example:
+
+    docker run -d --name iot-bench-db -e MYSQL_ROOT_PASSWORD=bench -p 3307:3306 mysql:8.0
+    BENCH_DB_PORT=3307 BENCH_DB_PASSWORD=bench python benchmark.py run --fresh
+
+Pass --url to load an already running server instead (nothing is started and
+the database is left alone). Workloads:
+
+- devices:  each simulated device POSTs a reading (or a batch) to /api/data
+- pollers:  dashboards loading /devices, then /api/data/<device_id> for random devices
+- crud:     create, read, update, list and delete cycles on /api/crud/*
+
+Workers are closed-loop: each waits for its response before pacing the next
+request, so an overloaded server shows up as lower req/s rather than queueing.
+"""
+
+import argparse
+import http.client
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+from urllib.parse import quote, urlsplit
+
+BENCH_CONFIG = {
+    'db_host': os.environ.get('BENCH_DB_HOST', '127.0.0.1'),
+    'db_port': int(os.environ.get('BENCH_DB_PORT', 3306)),
+    'db_user': os.environ.get('BENCH_DB_USER', 'root'),
+    'db_password': os.environ.get('BENCH_DB_PASSWORD', ''),
+    'db_name': os.environ.get('BENCH_DB_NAME', 'iot_bench'),
+    'app_port': int(os.environ.get('BENCH_APP_PORT', 5081)),
+    'startup_timeout': float(os.environ.get('BENCH_STARTUP_TIMEOUT', 30)),
+    'cleanup_timeout': float(os.environ.get('BENCH_CLEANUP_TIMEOUT', 120))
+}
+
+# Bump when the report layout changes so `compare` can refuse mismatched files
+REPORT_VERSION = 1
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+PRODUCTION_DB_NAME = 'std01_iot_data'
+
+class Recorder:
+    """Latency samples and status counts per endpoint, inside the measurement window only"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(Counter)
+        self.started = None
+        self.stopped = None
+
+    def start(self):
+        self.started = time.monotonic()
+
+    def stop(self):
+        self.stopped = time.monotonic()
+        return self.stopped - self.started
+
+    def record(self, endpoint, status, started, finished):
+        # Warm-up and drain requests are dropped
+        if self.started is None or started < self.started or (self.stopped is not None and finished > self.stopped):
+            return
+        with self._lock:
+            self.latencies[endpoint].append(finished - started)
+            self.statuses[endpoint][str(status)] += 1
+
+class Client:
+    """One keep-alive HTTP connection per worker thread"""
+
+    def __init__(self, base_url, recorder, timeout=10):
+        parts = urlsplit(base_url)
+        self.connection = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=timeout)
+        self.recorder = recorder
+
+    def request(self, endpoint, method, path, body=None, headers=None):
+        """Send one request and record it under `endpoint`. Returns (status, headers, body) or (None, None, None)."""
+        headers = dict(headers or {})
+        data = None
+        if body is not None:
+            data = json.dumps(body).encode()
+            headers['Content-Type'] = 'application/json'
+        started = time.monotonic()
+        try:
+            self.connection.request(method, path, body=data, headers=headers)
+            response = self.connection.getresponse()
+            payload = response.read()
+        except (OSError, http.client.HTTPException):
+            # Reconnects on the next request
+            self.connection.close()
+            self.recorder.record(endpoint, 'error', started, time.monotonic())
+            return None, None, None
+        self.recorder.record(endpoint, response.status, started, time.monotonic())
+        return response.status, response.headers, payload
+
+    def close(self):
+        self.connection.close()
+
+def paced(stop, interval, rng):
+    """Yield every `interval` seconds (0 = back to back) until `stop` is set, starting at a random phase"""
+    next_at = time.monotonic() + rng.uniform(0, interval)
+    while True:
+        delay = next_at - time.monotonic()
+        if stop.wait(max(delay, 0)):
+            return
+        yield
+        # A late iteration is not made up with a burst
+        next_at = max(next_at + interval, time.monotonic())
+
+def random_reading(rng, device_id=None):
+    reading = {
+        "temperature": round(rng.gauss(25, 2), 2),
+        "humidity": round(rng.uniform(40, 70), 2),
+        "sensor_data": {"light": round(rng.uniform(0, 100), 2), "light_raw": rng.randint(0, 4095), "battery": rng.randint(20, 100)}
+    }
+    if device_id is not None:
+        reading["device_id"] = device_id
+    return reading
+
+def device_worker(client, stop, rng, device_id, interval, batch_size):
+    for _ in paced(stop, interval, rng):
+        if batch_size > 1:
+            body = [random_reading(rng, device_id) for _ in range(batch_size)]
+            client.request("POST /api/data (batch)", 'POST', '/api/data', body=body)
+        else:
+            client.request("POST /api/data", 'POST', '/api/data', body=random_reading(rng, device_id))
+
+def poller_worker(client, stop, rng, device_ids, interval, reads_per_poll, revalidate):
+    etags = {}
+
+    def get(endpoint, path):
+        headers = {'Accept-Encoding': 'gzip'}
+        if revalidate and path in etags:
+            headers['If-None-Match'] = etags[path]
+        status, response_headers, _ = client.request(endpoint, 'GET', path, headers=headers)
+        if status == 200 and response_headers.get('ETag'):
+            etags[path] = response_headers['ETag']
+
+    for _ in paced(stop, interval, rng):
+        get("GET /devices", '/devices')
+        for _ in range(reads_per_poll if device_ids else 0):
+            get("GET /api/data/<device_id>", f"/api/data/{quote(rng.choice(device_ids))}")
+
+def crud_worker(client, stop, rng, device_id, interval):
+    for _ in paced(stop, interval, rng):
+        status, _, payload = client.request(
+            "POST /api/crud/reading", 'POST', '/api/crud/reading', body=random_reading(rng, device_id)
+        )
+        if status != 201:
+            continue
+        reading_id = json.loads(payload).get('reading_id')
+        client.request("GET /api/crud/reading/<id>", 'GET', f'/api/crud/reading/{reading_id}')
+        client.request(
+            "PUT /api/crud/reading/<id>", 'PUT', f'/api/crud/reading/{reading_id}',
+            body={"temperature": round(rng.gauss(25, 2), 2)}
+        )
+        client.request(
+            "GET /api/crud/device/<device_id>/readings", 'GET',
+            f'/api/crud/device/{quote(device_id)}/readings?limit=50&count=0'
+        )
+        client.request("DELETE /api/crud/reading/<id>", 'DELETE', f'/api/crud/reading/{reading_id}')
+
+class AppServer:
+    """app.py under `flask run` (threaded, no reloader or debugger) on the benchmark database"""
+
+    def __init__(self, port, db_config, log_path=None):
+        self.port = port
+        self.url = f"http://127.0.0.1:{port}"
+        self.env = dict(
+            os.environ,
+            DB_HOST=db_config['host'], DB_PORT=str(db_config['port']),
+            DB_USER=db_config['user'], DB_PASSWORD=db_config['password'], DB_NAME=db_config['database'],
+            FLASK_DEBUG='0'
+        )
+        self.log_path = log_path
+        self.process = None
+        self._log = None
+
+    def _flask(self, *args):
+        return [sys.executable, '-m', 'flask', '--app', 'app', *args]
+
+    def start(self):
+        subprocess.run(self._flask('migrate'), cwd=APP_DIR, env=self.env, check=True, stdout=subprocess.DEVNULL)
+        self._log = open(self.log_path, 'ab') if self.log_path else subprocess.DEVNULL
+        self.process = subprocess.Popen(
+            self._flask('run', '--host', '127.0.0.1', '--port', str(self.port), '--no-reload', '--no-debugger', '--with-threads'),
+            cwd=APP_DIR, env=self.env, stdout=self._log, stderr=self._log
+        )
+        deadline = time.monotonic() + BENCH_CONFIG['startup_timeout']
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"app exited with status {self.process.returncode} during startup")
+            try:
+                connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=2)
+                connection.request('GET', '/api/health')
+                if connection.getresponse().status == 200:
+                    return
+            except OSError:
+                pass
+            time.sleep(0.25)
+        raise RuntimeError(f"app did not become healthy within {BENCH_CONFIG['startup_timeout']:.0f}s")
+
+    def stop(self):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        if self._log not in (None, subprocess.DEVNULL):
+            self._log.close()
+
+def prepare_database(db_config, fresh):
+    """Create the benchmark database; --fresh drops it first so runs start from the same state"""
+    import mysql.connector
+
+    if db_config['database'] == PRODUCTION_DB_NAME:
+        raise SystemExit(f"Refusing to benchmark against {PRODUCTION_DB_NAME}; set BENCH_DB_NAME")
+    connection = mysql.connector.connect(
+        host=db_config['host'], port=db_config['port'], user=db_config['user'], password=db_config['password']
+    )
+    try:
+        cursor = connection.cursor()
+        if fresh:
+            cursor.execute(f"DROP DATABASE IF EXISTS `{db_config['database']}`")
+        cursor.execute(f"CREATE DATABASE IF NOT EXISTS `{db_config['database']}`")
+        cursor.close()
+    finally:
+        connection.close()
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an ascending list"""
+    rank = max(math.ceil(pct / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+def summarize(latencies, statuses, duration):
+    latencies = sorted(latencies)
+    errors = sum(count for status, count in statuses.items() if status == 'error' or int(status) >= 400)
+    summary = {
+        "requests": len(latencies),
+        "req_per_sec": round(len(latencies) / duration, 1),
+        "errors": errors,
+        "status": dict(sorted(statuses.items()))
+    }
+    if latencies:
+        summary["latency_ms"] = {
+            "mean": round(sum(latencies) / len(latencies) * 1000, 2),
+            "p50": round(percentile(latencies, 50) * 1000, 2),
+            "p95": round(percentile(latencies, 95) * 1000, 2),
+            "p99": round(percentile(latencies, 99) * 1000, 2),
+            "max": round(latencies[-1] * 1000, 2)
+        }
+    return summary
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'describe', '--always', '--dirty'], cwd=APP_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(args):
+    server = None
+    base_url = args.url
+    if base_url is None:
+        db_config = {
+            'host': BENCH_CONFIG['db_host'], 'port': BENCH_CONFIG['db_port'], 'user': BENCH_CONFIG['db_user'],
+            'password': BENCH_CONFIG['db_password'], 'database': BENCH_CONFIG['db_name']
+        }
+        prepare_database(db_config, args.fresh)
+        server = AppServer(args.port, db_config, args.server_log)
+        server.start()
+        base_url = server.url
+
+    recorder = Recorder()
+    stop = threading.Event()
+    device_ids = [f"{args.device_prefix}{n:04d}" for n in range(args.devices)]
+    crud_device_ids = [f"{args.device_prefix}crud_{n:03d}" for n in range(args.crud_workers)]
+    threads = []
+    clients = []
+
+    def spawn(target, seed, *worker_args):
+        client = Client(base_url, recorder)
+        clients.append(client)
+        thread = threading.Thread(target=target, args=(client, stop, random.Random(seed), *worker_args), daemon=True)
+        thread.start()
+        threads.append(thread)
+
+    try:
+        for n, device_id in enumerate(device_ids):
+            spawn(device_worker, args.seed + n, device_id, args.device_interval, args.batch_size)
+        for n in range(args.pollers):
+            spawn(poller_worker, args.seed + 10000 + n, device_ids, args.poll_interval, args.reads_per_poll, args.revalidate)
+        for n, device_id in enumerate(crud_device_ids):
+            spawn(crud_worker, args.seed + 20000 + n, device_id, args.crud_interval)
+
+        print(f"Warming up for {args.warmup:g}s against {base_url} ({len(threads)} workers)", file=sys.stderr)
+        time.sleep(args.warmup)
+        started_at = datetime.now().isoformat(timespec='seconds')
+        recorder.start()
+        time.sleep(args.duration)
+        duration = recorder.stop()
+        stop.set()
+        for thread in threads:
+            thread.join(10)
+    finally:
+        stop.set()
+        for client in clients:
+            client.close()
+        if not args.keep_data:
+            cleanup = Client(base_url, Recorder())
+            jobs = []
+            for device_id in device_ids + crud_device_ids:
+                status, _, payload = cleanup.request(None, 'DELETE', f'/api/crud/device/{quote(device_id)}')
+                if status == 202:
+                    jobs.append(json.loads(payload)['job']['id'])
+            # Purges run as background jobs; stopping the server early would cut them short
+            deadline = time.monotonic() + BENCH_CONFIG['cleanup_timeout']
+            while jobs and time.monotonic() < deadline:
+                status, _, payload = cleanup.request(None, 'GET', f'/api/jobs/{jobs[0]}')
+                if status != 200 or json.loads(payload)['job']['status'] not in ('queued', 'running'):
+                    jobs.pop(0)
+                else:
+                    time.sleep(0.25)
+            cleanup.close()
+        if server:
+            server.stop()
+
+    endpoints = {
+        endpoint: summarize(latencies, recorder.statuses[endpoint], duration)
+        for endpoint, latencies in sorted(recorder.latencies.items())
+    }
+    total_statuses = Counter()
+    for statuses in recorder.statuses.values():
+        total_statuses.update(statuses)
+    report = {
+        "report_version": REPORT_VERSION,
+        "started_at": started_at,
+        "target": base_url,
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "config": {
+            key: getattr(args, key) for key in (
+                'duration', 'warmup', 'devices', 'device_interval', 'batch_size', 'pollers', 'poll_interval',
+                'reads_per_poll', 'revalidate', 'crud_workers', 'crud_interval', 'seed'
+            )
+        },
+        "duration_s": round(duration, 3),
+        "endpoints": endpoints,
+        "total": summarize(
+            [latency for latencies in recorder.latencies.values() for latency in latencies], total_statuses, duration
+        )
+    }
+
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+        print(f"Report written to {args.output}", file=sys.stderr)
+    else:
+        print(text)
+    print_table(endpoints, report["total"])
+
+def print_table(endpoints, total):
+    rows = [("endpoint", "req/s", "p50 ms", "p95 ms", "p99 ms", "errors")]
+    for endpoint, summary in list(endpoints.items()) + [("total", total)]:
+        latency = summary.get("latency_ms", {})
+        rows.append((
+            endpoint, f"{summary['req_per_sec']:.1f}", str(latency.get("p50", "-")),
+            str(latency.get("p95", "-")), str(latency.get("p99", "-")), str(summary["errors"])
+        ))
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    for row in rows:
+        print("  ".join(cell.ljust(widths[0]) if i == 0 else cell.rjust(widths[i]) for i, cell in enumerate(row)), file=sys.stderr)
+
+def compare(args):
+    """Print per-endpoint changes between two reports; exit 1 when --max-regression is exceeded"""
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+    if before.get("report_version") != after.get("report_version"):
+        raise SystemExit("Reports have different report_version values")
+    if before["config"] != after["config"]:
+        differing = sorted(key for key in set(before["config"]) | set(after["config"])
+                           if before["config"].get(key) != after["config"].get(key))
+        print(f"Warning: workloads differ in {', '.join(differing)}")
+
+    def change(old, new):
+        if old is None or new is None:
+            return None
+        return (new - old) / old * 100 if old else None
+
+    regressions = []
+    print(f"{'endpoint':45s} {'req/s':>22s} {'p95 ms':>22s} {'p99 ms':>22s}")
+    names = sorted(set(before["endpoints"]) | set(after["endpoints"]))
+    for name in names + ["total"]:
+        old = before["total"] if name == "total" else before["endpoints"].get(name, {})
+        new = after["total"] if name == "total" else after["endpoints"].get(name, {})
+        cells = []
+        for key, higher_is_better in (("req_per_sec", True), ("p95", False), ("p99", False)):
+            source_old = old if key == "req_per_sec" else old.get("latency_ms", {})
+            source_new = new if key == "req_per_sec" else new.get("latency_ms", {})
+            old_value, new_value = source_old.get(key), source_new.get(key)
+            delta = change(old_value, new_value)
+            cells.append(f"{old_value if old_value is not None else '-'} -> {new_value if new_value is not None else '-'}"
+                         + (f" ({delta:+.0f}%)" if delta is not None else ""))
+            worse = delta is not None and (-delta if higher_is_better else delta)
+            if args.max_regression is not None and worse and worse > args.max_regression:
+                regressions.append(f"{name} {key} {delta:+.1f}%")
+        print(f"{name:45s} {cells[0]:>22s} {cells[1]:>22s} {cells[2]:>22s}")
+
+    if regressions:
+        print(f"Regressions beyond {args.max_regression:g}%: " + ", ".join(regressions))
+        sys.exit(1)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="HTTP load benchmark for the IoT API")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help="Run the workloads and write a JSON report")
+    run_parser.add_argument('--url', help="benchmark a running server instead of starting one")
+    run_parser.add_argument('--port', type=int, default=BENCH_CONFIG['app_port'], help="port for the started server")
+    run_parser.add_argument('--fresh', action='store_true', help="drop and recreate the benchmark database first")
+    run_parser.add_argument('--server-log', help="append the started server's output to this file")
+    run_parser.add_argument('--duration', type=float, default=30, help="measured seconds")
+    run_parser.add_argument('--warmup', type=float, default=5, help="seconds of load before measuring")
+    run_parser.add_argument('--devices', type=int, default=50, help="simulated devices posting to /api/data")
+    run_parser.add_argument('--device-interval', type=float, default=1.0, help="seconds between posts per device (0 = back to back)")
+    run_parser.add_argument('--batch-size', type=int, default=1, help="readings per post (>1 sends a JSON list)")
+    run_parser.add_argument('--pollers', type=int, default=5, help="dashboard pollers")
+    run_parser.add_argument('--poll-interval', type=float, default=2.0, help="seconds between dashboard refreshes")
+    run_parser.add_argument('--reads-per-poll', type=int, default=3, help="/api/data/<device_id> reads per refresh")
+    run_parser.add_argument('--revalidate', action='store_true', help="pollers send If-None-Match like a browser")
+    run_parser.add_argument('--crud-workers', type=int, default=2, help="workers running CRUD cycles")
+    run_parser.add_argument('--crud-interval', type=float, default=0.5, help="seconds between CRUD cycles per worker")
+    run_parser.add_argument('--device-prefix', default='bench_', help="prefix of the benchmark device ids")
+    run_parser.add_argument('--keep-data', action='store_true', help="do not delete the benchmark devices afterwards")
+    run_parser.add_argument('--seed', type=int, default=1)
+    run_parser.add_argument('--output', help="write the report here instead of stdout")
+
+    compare_parser = commands.add_parser('compare', help="Compare two reports")
+    compare_parser.add_argument('before')
+    compare_parser.add_argument('after')
+    compare_parser.add_argument('--max-regression', type=float, help="exit 1 if req/s drops or p95/p99 grows by more than this percent")
+
+    args = parser.parse_args()
+    if args.command == 'run':
+        run(args)
+    else:
+        compare(args)
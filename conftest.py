@@ -0,0 +1,18 @@
+"""
+pytest fixtures: test_crud.py runs in-process against app.py on a temporary
+SQLite database (the same setup as `python test_crud.py --offline`)
+"""
+
+import pytest
+
+from test_crud import OfflineClient, load_offline_app
+
+@pytest.fixture(scope='session')
+def offline_app(tmp_path_factory):
+    app = load_offline_app(str(tmp_path_factory.mktemp('iot_crud_test')))
+    yield app
+    app.storage.close()
+
+@pytest.fixture
+def http(offline_app):
+    return OfflineClient(offline_app.app)
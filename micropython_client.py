@@ -1,9 +1,14 @@
 # Example MicroPython script for ESP32/ESP8266
-# This script connects to WiFi and sends sensor data to the Flask API
+# This script connects to WiFi and sends sensor data to the Flask API.
+# Readings are queued in a ring buffer on flash and sent in batches, so
+# nothing is lost while the server or WiFi is down.
 
 import urequests
+import io
 import json
 import network
+import random
+import struct
 import time
 from machine import Pin, ADC
 import dht
@@ -16,6 +21,31 @@ WIFI_PASSWORD = "your_wifi_password"
 API_URL = "http://your_server_ip:5001/api/data"
 DEVICE_ID = "esp32_001"
 
+# Payload format: "json", or "binary" for the compact layout (schema 1: 14 bytes + device_id)
+PAYLOAD_FORMAT = "json"
+# Compress JSON payloads (needs the deflate module, MicroPython 1.21+)
+COMPRESS_JSON = False
+
+BINARY_CONTENT_TYPE = "application/x-iot-reading"
+BINARY_SCHEMA_ID = 1
+BINARY_RECORD_FORMAT = "<IhHHH"
+BINARY_RECORD_SIZE = struct.calcsize(BINARY_RECORD_FORMAT)
+BINARY_NULL_INT16 = -0x8000
+BINARY_NULL_UINT16 = 0xFFFF
+
+# Sampling and store-and-forward configuration
+READ_INTERVAL = 30           # seconds between sensor readings
+OUTBOX_PATH = "outbox.bin"   # ring buffer of unsent readings on flash
+OUTBOX_CAPACITY = 2880       # readings kept while offline (24 hours at 30 s)
+BATCH_SIZE = 50              # readings per request when draining the outbox
+BACKOFF_BASE = 5             # seconds before the first retry
+BACKOFF_CAP = 600            # longest wait between retries
+
+# Seconds between the Unix epoch and this port's time.time() epoch
+EPOCH_OFFSET = 946684800 if time.gmtime(0)[0] == 2000 else 0
+# Anything earlier means the clock was never set
+MIN_VALID_TIME = 1704067200
+
 # Sensor configuration (adjust pins as needed)
 # DHT22 sensor for temperature and humidity
 dht_sensor = dht.DHT22(Pin(4))
@@ -39,6 +69,29 @@ def connect_wifi():
     
     print("\nWiFi connected!")
     print("Network config:", wlan.ifconfig())
+    sync_clock()
+
+def wifi_connected():
+    """Check the connection without blocking; start reconnecting if it dropped"""
+    wlan = network.WLAN(network.STA_IF)
+    if wlan.isconnected():
+        return True
+    if wlan.status() != network.STAT_CONNECTING:
+        wlan.connect(WIFI_SSID, WIFI_PASSWORD)
+    return False
+
+def sync_clock():
+    """Set the RTC over NTP so queued readings keep their measurement time"""
+    try:
+        import ntptime
+        ntptime.settime()
+    except Exception as e:
+        print("Clock sync failed:", e)
+
+def unix_time():
+    """Current Unix time, or 0 (the server stamps the reading) if the clock is not set"""
+    now = int(time.time()) + EPOCH_OFFSET
+    return now if now >= MIN_VALID_TIME else 0
 
 def read_sensors():
     """Read data from connected sensors"""
@@ -73,41 +126,194 @@ def read_sensors():
             "error": str(e)
         }
 
-def send_sensor_data(sensor_data):
-    """Send sensor data to Flask API"""
-    data = {
+def scaled(value, scale, null):
+    """Fixed-point integer for the binary layout (null sentinel when missing)"""
+    return null if value is None else int(round(value * scale))
+
+def unscaled(value, scale, null):
+    return None if value == null else value / scale
+
+def pack_record(sensor_data, timestamp):
+    """Pack one reading as a schema 1 record (also the outbox slot format)"""
+    return struct.pack(
+        BINARY_RECORD_FORMAT,
+        timestamp,
+        scaled(sensor_data.get("temperature"), 100, BINARY_NULL_INT16),
+        scaled(sensor_data.get("humidity"), 100, BINARY_NULL_UINT16),
+        scaled(sensor_data.get("light"), 100, BINARY_NULL_UINT16),
+        scaled(sensor_data.get("light_raw"), 1, BINARY_NULL_UINT16)
+    )
+
+def record_to_json(record):
+    """Turn a packed record back into the JSON reading format"""
+    timestamp, temperature, humidity, light, light_raw = struct.unpack(BINARY_RECORD_FORMAT, record)
+    reading = {
         "device_id": DEVICE_ID,
-        "temperature": sensor_data.get("temperature"),
-        "humidity": sensor_data.get("humidity"),
+        "temperature": unscaled(temperature, 100, BINARY_NULL_INT16),
+        "humidity": unscaled(humidity, 100, BINARY_NULL_UINT16),
         "sensor_data": {
-            "light": sensor_data.get("light"),
-            "light_raw": sensor_data.get("light_raw"),
-            "timestamp": time.time()
+            "light": unscaled(light, 100, BINARY_NULL_UINT16),
+            "light_raw": None if light_raw == BINARY_NULL_UINT16 else light_raw
         }
     }
+    if timestamp:
+        reading["timestamp"] = timestamp
+    return reading
+
+def compress(body):
+    """zlib-compress a request body with the deflate module"""
+    import deflate
+    buffer = io.BytesIO()
+    with deflate.DeflateIO(buffer, deflate.ZLIB) as stream:
+        stream.write(body)
+    return buffer.getvalue()
+
+def encode_batch(records):
+    """Build the request body and headers for the configured PAYLOAD_FORMAT"""
+    if PAYLOAD_FORMAT == "binary":
+        device_id = DEVICE_ID.encode()
+        body = bytes([BINARY_SCHEMA_ID, len(device_id)]) + device_id + b"".join(records)
+        return body, {'Content-Type': BINARY_CONTENT_TYPE}
+    
+    body = json.dumps([record_to_json(record) for record in records]).encode()
+    headers = {'Content-Type': 'application/json'}
+    if COMPRESS_JSON:
+        body = compress(body)
+        headers['Content-Encoding'] = 'deflate'
+    return body, headers
+
+class Outbox:
+    """
+    Bounded ring buffer of unsent readings in a flash file. A 4-byte header
+    (first slot, count) is followed by OUTBOX_CAPACITY fixed-size record
+    slots; when the buffer is full the oldest reading is overwritten.
+    """
+    HEADER_FORMAT = "<HH"
+    HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+    
+    def __init__(self, path, capacity):
+        self.path = path
+        self.capacity = capacity
+        self.head = 0
+        self.count = 0
+        self.dropped = 0
+        try:
+            with open(path, "rb") as f:
+                head, count = struct.unpack(self.HEADER_FORMAT, f.read(self.HEADER_SIZE))
+            if head < capacity and count <= capacity:
+                self.head, self.count = head, count
+        except Exception:
+            with open(path, "wb") as f:
+                f.write(struct.pack(self.HEADER_FORMAT, 0, 0))
+    
+    def _slot_position(self, index):
+        return self.HEADER_SIZE + (index % self.capacity) * BINARY_RECORD_SIZE
+    
+    def _write_header(self, f):
+        f.seek(0)
+        f.write(struct.pack(self.HEADER_FORMAT, self.head, self.count))
+    
+    def append(self, record):
+        if self.count == self.capacity:
+            self.head = (self.head + 1) % self.capacity
+            self.count -= 1
+            self.dropped += 1
+        with open(self.path, "r+b") as f:
+            f.seek(self._slot_position(self.head + self.count))
+            f.write(record)
+            self.count += 1
+            self._write_header(f)
     
+    def peek(self, limit):
+        """Oldest `limit` records, left in the buffer until discard()"""
+        records = []
+        with open(self.path, "rb") as f:
+            for i in range(min(limit, self.count)):
+                f.seek(self._slot_position(self.head + i))
+                records.append(f.read(BINARY_RECORD_SIZE))
+        return records
+    
+    def discard(self, count):
+        self.head = (self.head + count) % self.capacity
+        self.count -= count
+        with open(self.path, "r+b") as f:
+            self._write_header(f)
+
+class Backoff:
+    """
+    Exponential backoff with full jitter, so devices that lost the server at
+    the same moment don't all retry at the same moment. A Retry-After hint
+    from the server is honoured as the minimum wait.
+    """
+    
+    def __init__(self, base, cap):
+        self.base = base
+        self.cap = cap
+        self.failures = 0
+        self.next_attempt = time.ticks_ms()
+    
+    def ready(self):
+        return self.wait_ms() == 0
+    
+    def wait_ms(self):
+        return max(0, time.ticks_diff(self.next_attempt, time.ticks_ms()))
+    
+    def success(self):
+        self.failures = 0
+    
+    def failure(self, retry_after=None):
+        self.failures += 1
+        delay = min(self.cap, self.base * 2 ** (self.failures - 1))
+        delay = delay * random.getrandbits(16) / 65535
+        if retry_after is not None:
+            delay += retry_after
+        self.next_attempt = time.ticks_add(time.ticks_ms(), int(delay * 1000))
+        print("Retrying in %d s" % delay)
+
+def post_batch(records):
+    """
+    POST records in one request. Returns (done, retry_after): `done` is True
+    once the server has taken the readings, or rejected them as invalid so
+    they must not be resent; `retry_after` is the server's hint in seconds.
+    """
+    body, headers = encode_batch(records)
+    print("Sending %d readings to API..." % len(records))
     try:
-        headers = {'Content-Type': 'application/json'}
-        print("Sending data to API...")
-        
-        response = urequests.post(
-            API_URL, 
-            data=json.dumps(data), 
-            headers=headers
-        )
-        
-        print("Response Status:", response.status_code)
-        if response.status_code == 201:
+        response = urequests.post(API_URL, data=body, headers=headers)
+    except Exception as e:
+        print("Error sending data:", e)
+        return False, None
+    
+    try:
+        status = response.status_code
+        print("Response Status:", status)
+        if status in (200, 201, 202, 207):
             print("Data sent successfully!")
-        else:
-            print("Server response:", response.text)
+            return True, None
+        if 400 <= status < 500 and status not in (408, 429):
+            # Resending would fail the same way and block the readings behind them
+            print("Readings rejected:", response.text)
+            return True, None
         
+        retry_after = (getattr(response, "headers", None) or {}).get("Retry-After")
+        try:
+            return False, int(retry_after)
+        except (TypeError, ValueError):
+            return False, None
+    finally:
         response.close()
-        return True
-        
-    except Exception as e:
-        print("Error sending data:", e)
-        return False
+
+def drain_outbox(outbox, backoff):
+    """Send queued readings in batches until the outbox is empty or a request fails"""
+    while outbox.count and backoff.ready():
+        records = outbox.peek(BATCH_SIZE)
+        done, retry_after = post_batch(records)
+        if not done:
+            backoff.failure(retry_after)
+            return False
+        outbox.discard(len(records))
+        backoff.success()
+    return True
 
 def main_loop():
     """Main execution loop"""
@@ -116,25 +322,36 @@ def main_loop():
     # Connect to WiFi
     connect_wifi()
     
-    # Main loop - send data every 30 seconds
+    outbox = Outbox(OUTBOX_PATH, OUTBOX_CAPACITY)
+    backoff = Backoff(BACKOFF_BASE, BACKOFF_CAP)
+    if outbox.count:
+        print("Outbox holds %d unsent readings" % outbox.count)
+    
+    # Start at a random point in the interval so devices powered on together spread out
+    next_reading = time.ticks_add(time.ticks_ms(), random.getrandbits(16) % (READ_INTERVAL * 1000))
+    
+    # Main loop - read sensors every READ_INTERVAL seconds and forward the outbox
     while True:
         try:
-            print("\n--- Reading sensors ---")
-            
-            # Read sensor data
-            sensor_data = read_sensors()
-            
-            # Send to API
-            success = send_sensor_data(sensor_data)
+            if time.ticks_diff(next_reading, time.ticks_ms()) <= 0:
+                print("\n--- Reading sensors ---")
+                sensor_data = read_sensors()
+                outbox.append(pack_record(sensor_data, unix_time()))
+                next_reading = time.ticks_add(next_reading, READ_INTERVAL * 1000)
+                if outbox.dropped:
+                    print("Outbox full, %d oldest readings dropped" % outbox.dropped)
             
-            if success:
-                print("Data transmission completed")
-            else:
-                print("Data transmission failed")
+            if outbox.count and backoff.ready() and wifi_connected():
+                if drain_outbox(outbox, backoff):
+                    print("Data transmission completed")
+                else:
+                    print("Data transmission failed, %d readings queued" % outbox.count)
             
-            # Wait before next reading
-            print("Waiting 30 seconds...")
-            time.sleep(30)
+            # Sleep until the next reading or retry, whichever comes first
+            wait = time.ticks_diff(next_reading, time.ticks_ms())
+            if outbox.count:
+                wait = min(wait, max(backoff.wait_ms(), 1000))
+            time.sleep_ms(max(wait, 0))
             
         except KeyboardInterrupt:
             print("\nProgram stopped by user")
@@ -0,0 +1,289 @@
+"""
+Columnar on-disk archive for cold IoT readings
+
+Each segment file holds the readings of one device for a closed time range,
+stored column by column so queries can memory-map the file and binary-search
+the timestamp column without parsing rows they don't return.
+
+Segment layout (little endian, every column 8-byte aligned):
+    magic        b'IOTSEG01'
+    id           int64[n]
+    timestamp    int64[n]   microseconds since 1970-01-01 (naive, as stored in MySQL)
+    created_at   int64[n]   same encoding, NULL_TIME for NULL
+    temperature  float32[n] NaN for NULL
+    humidity     float32[n] NaN for NULL
+    sensor_off   uint64[n + 1] offsets into sensor_data (empty slice for NULL)
+    sensor_data  bytes      concatenated JSON documents
+    footer       JSON index (device, count, key range, column offsets)
+    footer_len   uint32
+    magic        b'IOTSEGFT'
+"""
+
+import array
+import contextlib
+import heapq
+import itertools
+import json
+import math
+import mmap
+import os
+import shutil
+import struct
+import threading
+from datetime import datetime, timedelta
+
+# Row layout expected by ArchiveStore.write_segment
+COLUMNS = ('id', 'device_id', 'timestamp', 'temperature', 'humidity', 'sensor_data', 'created_at')
+
+MAGIC = b'IOTSEG01'
+FOOTER_MAGIC = b'IOTSEGFT'
+NULL_TIME = -(2 ** 63)
+EPOCH = datetime(1970, 1, 1)
+ONE_MICROSECOND = timedelta(microseconds=1)
+
+def _to_micros(value):
+    return NULL_TIME if value is None else (value - EPOCH) // ONE_MICROSECOND
+
+def _from_micros(value):
+    return None if value == NULL_TIME else EPOCH + timedelta(microseconds=value)
+
+def _from_float32(value):
+    """Shortest decimal that round-trips to the stored float32 (as MySQL prints FLOAT)"""
+    if math.isnan(value):
+        return None
+    for digits in range(6, 10):
+        candidate = float(f"{value:.{digits}g}")
+        if struct.unpack('<f', struct.pack('<f', candidate))[0] == value:
+            return candidate
+    return value
+
+def _row_key(row):
+    return (row['timestamp'], row['id'])
+
+def _safe_name(device_id):
+    """Directory name for a device that cannot escape the archive root"""
+    return device_id.encode().hex()
+
+class Segment:
+    """A memory-mapped, read-only view of one segment file"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as handle:
+            self._mmap = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._mmap)
+        if view[:8] != MAGIC or view[-8:] != FOOTER_MAGIC:
+            raise ValueError(f"{path} is not a reading archive segment")
+        footer_len = struct.unpack_from('<I', view, len(view) - 12)[0]
+        footer_start = len(view) - 12 - footer_len
+        self.index = json.loads(bytes(view[footer_start:footer_start + footer_len]))
+        self.device_id = self.index['device_id']
+        self.count = self.index['count']
+        self.min_key = tuple(self.index['min'])
+        self.max_key = tuple(self.index['max'])
+
+        columns = {}
+        for name, (offset, length, fmt) in self.index['columns'].items():
+            column = view[offset:offset + length]
+            columns[name] = column.cast(fmt) if fmt != 'B' else column
+        self._columns = columns
+
+    def key(self, i):
+        return (self._columns['timestamp'][i], self._columns['id'][i])
+
+    def lower_bound(self, key):
+        """First row index whose (timestamp, id) is >= key"""
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.key(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def row(self, i):
+        columns = self._columns
+        start, end = columns['sensor_off'][i], columns['sensor_off'][i + 1]
+        return {
+            "id": columns['id'][i],
+            "device_id": self.device_id,
+            "timestamp": _from_micros(columns['timestamp'][i]),
+            "sensor_data": bytes(columns['sensor_data'][start:end]).decode() if end > start else None,
+            "temperature": _from_float32(columns['temperature'][i]),
+            "humidity": _from_float32(columns['humidity'][i]),
+            "created_at": _from_micros(columns['created_at'][i])
+        }
+
+    def close(self):
+        self._columns = {}
+        self._mmap.close()
+
+class _SegmentSet:
+    """The open segments of one device directory version and how many readers use them"""
+
+    def __init__(self, version, segments):
+        self.version = version
+        self.segments = segments
+        self.readers = 0
+        self.replaced = False
+
+    def close(self):
+        for segment in self.segments:
+            segment.close()
+
+class ArchiveStore:
+    """Directory of per-device segment files with range queries over them"""
+
+    def __init__(self, root):
+        self.root = root
+        self._segments = {}  # device_id -> _SegmentSet of the latest directory mtime
+        self._lock = threading.Lock()
+
+    def _device_dir(self, device_id):
+        return os.path.join(self.root, _safe_name(device_id))
+
+    @contextlib.contextmanager
+    def segments(self, device_id):
+        """
+        Yield the segments of a device in key order; they stay mapped until the
+        block exits. Segments are opened once and reopened only when the device
+        directory changes (e.g. another process archived more readings); the
+        replaced ones are closed once their last reader is done.
+        """
+        directory = self._device_dir(device_id)
+        try:
+            version = os.stat(directory).st_mtime_ns
+        except FileNotFoundError:
+            version = None
+        with self._lock:
+            current = self._segments.get(device_id)
+            if current is None or current.version != version:
+                names = sorted(os.listdir(directory)) if version is not None else []
+                previous, current = current, _SegmentSet(version, [
+                    Segment(os.path.join(directory, name)) for name in names if name.endswith('.seg')
+                ])
+                self._segments[device_id] = current
+                if previous is not None:
+                    previous.replaced = True
+                    if not previous.readers:
+                        previous.close()
+            current.readers += 1
+        try:
+            yield current.segments
+        finally:
+            with self._lock:
+                current.readers -= 1
+                if current.replaced and not current.readers:
+                    current.close()
+
+    def has_segments(self, device_id):
+        with self.segments(device_id) as segments:
+            return bool(segments)
+
+    def write_segment(self, device_id, rows):
+        """
+        Write rows laid out as COLUMNS, sorted by (timestamp, id), to a new
+        segment. The file is fsynced and renamed into place so readers never
+        see partial segments; rewriting the same rows replaces the segment.
+        """
+        if not rows:
+            return None
+        n = len(rows)
+        ids = array.array('q', (row[0] for row in rows))
+        timestamps = array.array('q', (_to_micros(row[2]) for row in rows))
+        created = array.array('q', (_to_micros(row[6]) for row in rows))
+        temperatures = array.array('f', (math.nan if row[3] is None else row[3] for row in rows))
+        humidities = array.array('f', (math.nan if row[4] is None else row[4] for row in rows))
+
+        blobs = []
+        offsets = array.array('Q', [0])
+        for row in rows:
+            sensor_data = row[5]
+            if isinstance(sensor_data, str):
+                sensor_data = sensor_data.encode()
+            blobs.append(sensor_data or b'')
+            offsets.append(offsets[-1] + len(blobs[-1]))
+
+        columns = [
+            ('id', ids.tobytes(), 'q'),
+            ('timestamp', timestamps.tobytes(), 'q'),
+            ('created_at', created.tobytes(), 'q'),
+            ('temperature', temperatures.tobytes(), 'f'),
+            ('humidity', humidities.tobytes(), 'f'),
+            ('sensor_off', offsets.tobytes(), 'Q'),
+            ('sensor_data', b''.join(blobs), 'B')
+        ]
+
+        directory = self._device_dir(device_id)
+        os.makedirs(directory, exist_ok=True)
+        min_key = (timestamps[0], ids[0])
+        max_key = (timestamps[-1], ids[-1])
+        name = f"{min_key[0]:020d}-{min_key[1]:012d}.seg"
+        path = os.path.join(directory, name)
+        tmp_path = path + '.tmp'
+
+        with open(tmp_path, 'wb') as handle:
+            handle.write(MAGIC)
+            position = len(MAGIC)
+            index = {}
+            for column_name, data, fmt in columns:
+                index[column_name] = [position, len(data), fmt]
+                handle.write(data)
+                position += len(data)
+                padding = -position % 8
+                handle.write(b'\0' * padding)
+                position += padding
+            footer = json.dumps({
+                "version": 1,
+                "device_id": device_id,
+                "count": n,
+                "min": list(min_key),
+                "max": list(max_key),
+                "columns": index
+            }).encode()
+            handle.write(footer)
+            handle.write(struct.pack('<I', len(footer)))
+            handle.write(FOOTER_MAGIC)
+            handle.flush()
+            os.fsync(handle.fileno())
+        os.replace(tmp_path, path)
+        return path
+
+    def _scan(self, segment, lower_key, upper_key, descending):
+        start = 0 if lower_key is None else segment.lower_bound((lower_key[0], lower_key[1] + 1))
+        end = segment.count if upper_key is None else segment.lower_bound(upper_key)
+        indexes = range(end - 1, start - 1, -1) if descending else range(start, end)
+        for i in indexes:
+            yield segment.row(i)
+
+    def read(self, device_id, lower=None, upper=None, descending=True, limit=None):
+        """
+        Return archived readings of a device as row dicts. `lower` and `upper`
+        are exclusive (timestamp, id) bounds; rows come newest first unless
+        `descending` is False. Segments may overlap (late readings archived by
+        a later run), so they are merged lazily rather than concatenated.
+        """
+        lower_key = None if lower is None else (_to_micros(lower[0]), lower[1])
+        upper_key = None if upper is None else (_to_micros(upper[0]), upper[1])
+        with self.segments(device_id) as segments:
+            scans = [
+                self._scan(segment, lower_key, upper_key, descending)
+                for segment in segments
+                if (lower_key is None or segment.max_key > lower_key)
+                and (upper_key is None or segment.min_key < upper_key)
+            ]
+            rows = heapq.merge(*scans, key=_row_key, reverse=descending)
+            # A reading archived twice (interrupted run) shows up in adjacent positions
+            unique = (next(group) for _, group in itertools.groupby(rows, key=_row_key))
+            return list(itertools.islice(unique, limit))
+
+    def remove_device(self, device_id):
+        """Delete every segment of a device"""
+        shutil.rmtree(self._device_dir(device_id), ignore_errors=True)
+
+    def close(self):
+        with self._lock:
+            for segment_set in self._segments.values():
+                segment_set.close()
+            self._segments.clear()
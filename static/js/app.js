@@ -114,14 +114,13 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     });
 
-    // Auto-refresh device list every 30 seconds if on devices page
+    // Live updates from the server-sent event stream
     if (window.location.pathname === '/devices') {
-        setInterval(function() {
-            // Only refresh if the page is visible
-            if (!document.hidden) {
-                window.location.reload();
-            }
-        }, 30000);
+        LiveStream.watchDevices();
+    }
+    const deviceDetail = document.querySelector('#device-detail');
+    if (deviceDetail && deviceDetail.dataset.live === 'true') {
+        LiveStream.watchDevice(deviceDetail.dataset.deviceId);
     }
 
     // Collapse sensor data sections with better UX
@@ -169,6 +168,158 @@ function showToast(message, type = 'info') {
     });
 }
 
+// Format an ISO timestamp from the API like the server-rendered pages
+function formatTimestamp(iso) {
+    return iso ? iso.replace('T', ' ').slice(0, 19) : '';
+}
+
+// Build an element with a class and text content (never parses HTML)
+function createElement(tag, className, text) {
+    const element = document.createElement(tag);
+    if (className) {
+        element.className = className;
+    }
+    if (text !== undefined) {
+        element.textContent = text;
+    }
+    return element;
+}
+
+// In-place page updates from GET /api/stream
+const LiveStream = {
+    open: function(url, handlers) {
+        const source = new EventSource(url);
+        Object.keys(handlers).forEach(function(event) {
+            source.addEventListener(event, function(e) {
+                handlers[event](JSON.parse(e.data));
+            });
+        });
+        // Events were missed (this viewer fell behind); start from a fresh page
+        source.addEventListener('reset', function() {
+            source.close();
+            window.location.reload();
+        });
+        return source;
+    },
+
+    watchDevices: function() {
+        const container = document.querySelector('#device-cards');
+        if (!container) {
+            // No devices rendered yet; reload once the first one reports
+            LiveStream.open('/api/stream', { device: function() { window.location.reload(); } });
+            return;
+        }
+
+        LiveStream.open('/api/stream', {
+            device: function(delta) {
+                let card = container.querySelector(`[data-device-id="${CSS.escape(delta.device_id)}"]`);
+                if (!card) {
+                    card = LiveStream.newDeviceCard(delta.device_id);
+                }
+                const data = card.dataset;
+                data.total = Number(data.total) + delta.added_readings;
+                data.temperatureSum = Number(data.temperatureSum) + delta.temperature_sum;
+                data.temperatureCount = Number(data.temperatureCount) + delta.temperature_count;
+                data.humiditySum = Number(data.humiditySum) + delta.humidity_sum;
+                data.humidityCount = Number(data.humidityCount) + delta.humidity_count;
+                if (!data.lastSeen || delta.last_seen >= data.lastSeen) {
+                    data.lastSeen = delta.last_seen;
+                }
+
+                card.querySelector('.js-total').textContent = data.total;
+                card.querySelector('.js-last-seen').textContent = formatTimestamp(data.lastSeen);
+                LiveStream.showAverage(card, 'temperature', data.temperatureSum, data.temperatureCount);
+                LiveStream.showAverage(card, 'humidity', data.humiditySum, data.humidityCount);
+
+                // Cards are ordered by last contact, newest first
+                container.prepend(card);
+            }
+        });
+    },
+
+    showAverage: function(card, field, sum, count) {
+        const row = card.querySelector(`.js-avg-${field}-row`);
+        if (Number(count) > 0) {
+            row.querySelector(`.js-avg-${field}`).textContent = (Number(sum) / Number(count)).toFixed(1);
+            row.classList.remove('d-none');
+        }
+    },
+
+    newDeviceCard: function(deviceId) {
+        // Clone an existing card as a template and reset its figures
+        const template = document.querySelector('.device-card');
+        const card = template.cloneNode(true);
+        Object.assign(card.dataset, {
+            deviceId: deviceId, lastSeen: '', total: 0,
+            temperatureSum: 0, temperatureCount: 0, humiditySum: 0, humidityCount: 0
+        });
+        card.querySelector('h5').textContent = deviceId;
+        card.querySelector('.card-footer a').href = `/device/${encodeURIComponent(deviceId)}`;
+        card.querySelectorAll('.js-avg-temperature-row, .js-avg-humidity-row').forEach(function(row) {
+            row.classList.add('d-none');
+        });
+        return card;
+    },
+
+    watchDevice: function(deviceId) {
+        const tbody = document.querySelector('#readings-body');
+        const total = document.querySelector('#total-readings');
+        const url = `/api/stream?device_id=${encodeURIComponent(deviceId)}`;
+        if (!tbody) {
+            LiveStream.open(url, { reading: function() { window.location.reload(); } });
+            return;
+        }
+
+        LiveStream.open(url, {
+            reading: function(reading) {
+                tbody.prepend(LiveStream.readingRow(reading));
+            },
+            device: function(delta) {
+                total.textContent = Number(total.textContent) + delta.added_readings;
+            }
+        });
+    },
+
+    readingRow: function(reading) {
+        const row = document.createElement('tr');
+        row.className = 'table-success';
+        const missing = function() { return createElement('span', 'text-muted', 'ไม่มีข้อมูล'); };
+
+        row.appendChild(createElement('td', '', reading.id === null ? '' : reading.id));
+        row.appendChild(createElement('td', '', formatTimestamp(reading.timestamp)));
+
+        [['temperature', '°C'], ['humidity', '%']].forEach(function([field, unit]) {
+            const cell = createElement('td');
+            if (reading[field]) {
+                cell.textContent = `${reading[field].toFixed(1)}${unit}`;
+            } else {
+                cell.appendChild(missing());
+            }
+            row.appendChild(cell);
+        });
+
+        // sensor_data arrives as a decoded object
+        const sensorCell = createElement('td');
+        if (reading.sensor_data && Object.keys(reading.sensor_data).length) {
+            sensorCell.appendChild(createElement('pre', 'mb-0')).appendChild(createElement('code', '', JSON.stringify(reading.sensor_data)));
+        } else {
+            sensorCell.appendChild(missing());
+        }
+        row.appendChild(sensorCell);
+
+        // Readings from multi-row inserts arrive without an id; reload to edit them
+        const actions = createElement('td');
+        if (reading.id !== null) {
+            const edit = createElement('a', 'btn btn-sm btn-outline-primary', '✏️');
+            edit.href = `/edit/${reading.id}`;
+            edit.title = 'แก้ไข';
+            actions.appendChild(edit);
+        }
+        row.appendChild(actions);
+        return row;
+    }
+};
+
 // API helper functions for AJAX operations
 const API = {
     // Get device data
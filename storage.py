@@ -0,0 +1,1005 @@
+"""
+Storage backends for IoT readings
+
+app.py talks to readings through a ReadingRepository, so the routes and
+IoTDataCRUD do not depend on the database engine:
+
+    mysql   MySQLRepository in app.py (pooled connections, rollup tables,
+            partitioning, retention and the cold archive)
+    sqlite  SQLiteRepository below, an embedded single-file database for
+            gateway nodes and offline tests
+
+SQLiteRepository is tuned for ingest throughput:
+    - WAL journal with synchronous=NORMAL, so readers never block the writer
+      and a commit does not wait for an fsync of the database file
+    - one writer thread that merges queued writes into a single transaction
+      (group commit); each write runs in its own savepoint, so one failing
+      write does not undo the others
+    - a read connection per thread, reused across requests
+    - constant SQL strings, so every statement is prepared once per
+      connection and then served from the sqlite3 statement cache
+
+Rows and readings use the same shapes on every backend: timestamps are
+naive datetimes and sensor_data is JSON text.
+
+Promoted sensor fields are sensor_data keys (battery, light, ...) that
+the backends index as numbers: MySQL as invisible generated columns named
+sensor_<key>, SQLite as expression indexes. They can be filtered on and
+are aggregated alongside temperature and humidity.
+
+Filtered reads (ReadingFilter) compile to parameterized SQL that names
+its driving index (FORCE INDEX / INDEXED BY), chosen by search_index(),
+so a filter can never fall back to a full table scan.
+"""
+
+import collections
+import queue
+import re
+import sqlite3
+import threading
+import time
+import weakref
+from datetime import datetime, timedelta
+
+# Column order of reading tuples yielded by iter_readings()
+EXPORT_COLUMNS = ('id', 'device_id', 'timestamp', 'temperature', 'humidity', 'sensor_data', 'created_at')
+
+class StorageError(Exception):
+    """A storage backend failed; the message is safe to return to API clients"""
+
+# ETag, Last-Modified (Unix time) and, for one device, its device_stats.version
+Validator = collections.namedtuple('Validator', 'etag last_modified version')
+
+def stats_deltas(readings, sign=1):
+    """
+    Aggregate (device_id, temperature, humidity) triples into per-device
+    [count, temperature_sum, temperature_count, humidity_sum, humidity_count] deltas
+    """
+    deltas = {}
+    for device_id, temperature, humidity in readings:
+        delta = deltas.setdefault(device_id, [0, 0.0, 0, 0.0, 0])
+        delta[0] += sign
+        if temperature is not None:
+            delta[1] += sign * temperature
+            delta[2] += sign
+        if humidity is not None:
+            delta[3] += sign * humidity
+            delta[4] += sign
+    return deltas
+
+# Promoted sensor_data keys must be usable as column names and JSON paths as-is
+SENSOR_FIELD_NAME = re.compile(r'[a-z][a-z0-9_]{0,47}\Z')
+
+# Comparisons accepted in (field, operator, value) filters
+FILTER_OPERATORS = {'lt': '<', 'lte': '<=', 'gt': '>', 'gte': '>=', 'eq': '='}
+
+# Reading columns that can be compared but have no index of their own
+RESIDUAL_FIELDS = ('temperature', 'humidity')
+
+# Server-side search over readings: a set of devices and/or a device_id
+# prefix, a [start, end) time range, and (field, operator, value)
+# comparisons on temperature, humidity or promoted sensor fields
+ReadingFilter = collections.namedtuple(
+    'ReadingFilter', 'device_ids device_prefix start end comparisons', defaults=((), None, None, None, ())
+)
+
+def prefix_bounds(prefix):
+    """
+    [lower, upper) device_id range of a prefix, so it seeks on the index like
+    an equality. Only valid under a binary (codepoint order) collation.
+    """
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+def search_index(device_id, filters, sensor_fields):
+    """
+    Index that drives a filtered read: the (device_id, timestamp) index when
+    devices are constrained, else the first promoted field's index, else the
+    timestamp index; None for an unfiltered read. Temperature and humidity
+    have no index, so comparing them alone raises ValueError instead of
+    scanning every reading.
+    """
+    filters = filters or ReadingFilter()
+    if device_id is not None or filters.device_ids or filters.device_prefix:
+        return 'idx_device_timestamp'
+    for field, _, _ in filters.comparisons:
+        if field in sensor_fields:
+            return f"idx_{sensor_column(field)}"
+    if filters.start is not None or filters.end is not None:
+        return 'idx_timestamp'
+    if filters.comparisons:
+        raise ValueError(
+            "temperature and humidity filters need a device, device prefix, time range or promoted field filter"
+        )
+    return None
+
+def parse_sensor_fields(spec):
+    """Parse a comma-separated list of sensor_data keys to promote; raises ValueError for unusable names"""
+    fields = []
+    for key in (part.strip() for part in spec.split(',')):
+        if not key or key in fields:
+            continue
+        if not SENSOR_FIELD_NAME.match(key):
+            raise ValueError(f"Promoted sensor field {key!r} must be lower-case letters, digits and underscores")
+        if key in ('temperature', 'humidity'):
+            raise ValueError(f"{key} is already a reading column and cannot be promoted")
+        fields.append(key)
+    return tuple(fields)
+
+def sensor_column(key):
+    """Column (and rollup column prefix) of a promoted sensor field"""
+    return f"sensor_{key}"
+
+def sensor_value(sensor_data, key):
+    """Number indexed for a promoted key: JSON numbers, booleans as 1/0, anything else None"""
+    value = sensor_data.get(key) if isinstance(sensor_data, dict) else None
+    if isinstance(value, (bool, int, float)):
+        return float(value)
+    return None
+
+def reading_metrics(sensor_fields):
+    """(name, column) of every aggregated value: temperature, humidity and the promoted fields"""
+    return [('temperature', 'temperature'), ('humidity', 'humidity')] + [
+        (key, sensor_column(key)) for key in sensor_fields
+    ]
+
+class ReadingRepository:
+    """
+    Interface of a reading store. Inserted rows are
+    (device_id, timestamp, temperature, humidity, sensor_json) tuples; readings
+    are returned as dicts with the iot_readings columns. Methods raise
+    StorageError when the backend fails.
+    """
+
+    name = None
+    # Optional capabilities: 'rollups', 'retention', 'archive'
+    features = frozenset()
+
+    def __init__(self, sensor_fields=()):
+        self.sensor_fields = tuple(sensor_fields)
+
+    def init(self):
+        """Create or migrate the schema"""
+        raise NotImplementedError
+
+    def ping(self):
+        """True when the backend answers a trivial query"""
+        raise NotImplementedError
+
+    def insert_rows(self, rows):
+        """Insert rows and maintain device_stats in one commit; returns the first new id"""
+        raise NotImplementedError
+
+    def get_reading(self, reading_id):
+        """One reading, or None"""
+        raise NotImplementedError
+
+    def latest_readings(self, device_id, limit):
+        """A device's newest `limit` readings, newest first"""
+        raise NotImplementedError
+
+    def readings_page(self, device_id, limit, after=None, before=None, offset=0, filters=None):
+        """
+        One page of readings (of one device, or all when device_id is None),
+        newest first. `after` and `before` are (timestamp, id) keys: `after`
+        pages towards older readings and `before` towards newer ones, seeking
+        on the key so the cost does not grow with page depth. `offset` only
+        applies without a key. `filters` is an optional ReadingFilter.
+        Returns (readings, has_older, has_newer).
+        """
+        skip = offset if not (after or before) else 0
+        readings = self._seek(device_id, before or after, bool(before), limit + 1, skip, filters)
+        has_more = len(readings) > limit
+        readings = readings[:limit]
+        if before:
+            readings.reverse()
+            return readings, True, has_more
+        return readings, has_more, bool(after or offset)
+
+    def _seek(self, device_id, key, ascending, count, skip, filters=None):
+        """Up to `count` matching readings after `skip`, newer than `key` (ascending) or older (descending)"""
+        raise NotImplementedError
+
+    # SQL building shared by the backends
+
+    placeholder = '?'
+
+    def _time_param(self, value):
+        """A datetime as the backend compares it"""
+        return value
+
+    def _index_hint(self, index):
+        """Table suffix that makes the backend use `index`"""
+        raise NotImplementedError
+
+    def _sensor_sql(self, key):
+        """SQL expression of a promoted field, as covered by the backend's index"""
+        raise NotImplementedError
+
+    def _prefix_sql(self, prefix):
+        """(condition, parameters) matching device_ids that start with `prefix`, as an index range"""
+        raise NotImplementedError
+
+    def _search(self, device_id, filters):
+        """Compile a device and/or ReadingFilter into (index hint, WHERE conditions, parameters)"""
+        filters = filters or ReadingFilter()
+        p = self.placeholder
+        conditions, params = [], []
+        if device_id is not None:
+            conditions.append(f"device_id = {p}")
+            params.append(device_id)
+        if filters.device_ids:
+            conditions.append(f"device_id IN ({', '.join([p] * len(filters.device_ids))})")
+            params += list(filters.device_ids)
+        if filters.device_prefix:
+            sql, prefix_params = self._prefix_sql(filters.device_prefix)
+            conditions.append(sql)
+            params += prefix_params
+        if filters.start is not None:
+            conditions.append(f"timestamp >= {p}")
+            params.append(self._time_param(filters.start))
+        if filters.end is not None:
+            conditions.append(f"timestamp < {p}")
+            params.append(self._time_param(filters.end))
+        for field, operator, value in filters.comparisons:
+            if field in RESIDUAL_FIELDS:
+                sql = field
+            elif field in self.sensor_fields:
+                sql = self._sensor_sql(field)
+            else:
+                raise ValueError(f"{field} cannot be filtered on")
+            conditions.append(f"{sql} {FILTER_OPERATORS[operator]} {p}")
+            params.append(value)
+        index = search_index(device_id, filters, self.sensor_fields)
+        return self._index_hint(index) if index else "", conditions, params
+
+    def _seek_sql(self, device_id, key, ascending, filters):
+        """SELECT (without LIMIT) and parameters for _seek()"""
+        hint, conditions, params = self._search(device_id, filters)
+        if key is not None:
+            comparison = ">" if ascending else "<"
+            p = self.placeholder
+            conditions.append(f"(timestamp {comparison} {p} OR (timestamp = {p} AND id {comparison} {p}))")
+            params += [self._time_param(key[0]), self._time_param(key[0]), key[1]]
+        order = "ASC" if ascending else "DESC"
+        where_sql = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        return f"""
+        SELECT * FROM iot_readings {hint}
+        {where_sql}
+        ORDER BY timestamp {order}, id {order}
+        """, params
+
+    def _count_sql(self, device_id, filters):
+        hint, conditions, params = self._search(device_id, filters)
+        where_sql = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        return f"SELECT COUNT(*) FROM iot_readings {hint} {where_sql}", params
+
+    def _purge_sql(self, device_id, start, end, max_id):
+        """SELECT (without LIMIT) of the next readings delete_readings_chunk() removes"""
+        hint, conditions, params = self._search(device_id, ReadingFilter(start=start, end=end))
+        if max_id is not None:
+            conditions.append(f"id <= {self.placeholder}")
+            params.append(max_id)
+        return f"""
+        SELECT id, device_id, timestamp, temperature, humidity FROM iot_readings {hint}
+        WHERE {' AND '.join(conditions)}
+        ORDER BY timestamp, id
+        """, params
+
+    def search_plans(self, device_id=None, filters=None):
+        """
+        Query plans of the page and count statements for a filter, as
+        [(statement, rows)], for checking that every filter shape stays on an index
+        """
+        sql, params = self._seek_sql(device_id, None, False, filters)
+        p = self.placeholder
+        statements = [(f"{sql} LIMIT {p} OFFSET {p}", params + [100, 0]), self._count_sql(device_id, filters)]
+        plans = []
+        for statement, statement_params in statements:
+            rows, error = self.explain(statement, statement_params)
+            if error:
+                raise StorageError(f"Database error: {error}")
+            plans.append((statement, rows))
+        return plans
+
+    def device_total(self, device_id):
+        """Number of readings stored for a device"""
+        raise NotImplementedError
+
+    def total_readings(self):
+        """Number of readings stored for all devices"""
+        raise NotImplementedError
+
+    def count_readings(self, device_id, filters):
+        """Number of readings (of one device, or all when device_id is None) matching a ReadingFilter"""
+        raise NotImplementedError
+
+    def update_reading(self, reading_id, fields):
+        """
+        Set columns of a reading ({column: value}, sensor_data as JSON text)
+        and adjust device_stats. Returns (previous device_id, device_id,
+        rows affected), or None when the reading does not exist.
+        """
+        raise NotImplementedError
+
+    def delete_reading(self, reading_id):
+        """Delete a reading; returns (device_id, rows affected), or None when it does not exist"""
+        raise NotImplementedError
+
+    def last_reading_id(self):
+        """Highest reading id, or 0 when there are no readings"""
+        raise NotImplementedError
+
+    def delete_readings_chunk(self, device_id, limit, start=None, end=None, max_id=None):
+        """
+        Delete up to `limit` of a device's readings, oldest first, in one
+        short transaction that also adjusts the summaries. Only readings in
+        [start, end) and with id <= max_id are deleted when those are given.
+        Returns how many were deleted; 0 means nothing matching is left.
+        """
+        raise NotImplementedError
+
+    def forget_device(self, device_id):
+        """
+        Drop what a device keeps outside iot_readings once its readings have
+        been purged; returns how many readings that removed
+        """
+        return 0
+
+    def device_summaries(self):
+        """device_stats rows with avg_temperature and avg_humidity, most recently seen first"""
+        raise NotImplementedError
+
+    def device_validator(self, device_id):
+        """Validator for one device's readings"""
+        raise NotImplementedError
+
+    def readings_validator(self):
+        """Validator for all readings"""
+        raise NotImplementedError
+
+    def aggregate(self, device_id, bucket_seconds, start, end):
+        """
+        Per-bucket dicts (bucket, count, and <column>_min/max/avg for each
+        of reading_metrics()) for whole buckets in [start, end).
+        Returns (source, rows) where source names the table or resolution used.
+        """
+        raise NotImplementedError
+
+    def iter_readings(self, device_id, start=None, end=None, after=None, chunk_size=1000):
+        """Yield lists of EXPORT_COLUMNS tuples, oldest first, optionally resuming after a key"""
+        raise NotImplementedError
+
+    def explain(self, operation, params):
+        """Query plan of a statement as (rows, None) or (None, error message)"""
+        raise NotImplementedError
+
+    def stats(self):
+        """Flat dict describing the backend; numeric values are exported as metrics"""
+        return {"backend": self.name}
+
+    def close(self):
+        pass
+
+# ========================
+# SQLITE
+# ========================
+
+# Fixed-width text, so timestamps compare correctly as strings
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+TIME_COLUMNS = ('timestamp', 'created_at', 'last_seen')
+EPOCH = datetime(1970, 1, 1)
+
+SQLITE_SCHEMA_VERSION = 1
+
+SQLITE_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS iot_readings (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        device_id TEXT NOT NULL,
+        timestamp TEXT,
+        sensor_data TEXT,
+        temperature REAL,
+        humidity REAL,
+        created_at TEXT
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_device_timestamp ON iot_readings (device_id, timestamp, id)",
+    "CREATE INDEX IF NOT EXISTS idx_timestamp ON iot_readings (timestamp, id)",
+    """
+    CREATE TABLE IF NOT EXISTS device_stats (
+        device_id TEXT PRIMARY KEY,
+        last_seen TEXT,
+        total_readings INTEGER NOT NULL DEFAULT 0,
+        temperature_sum REAL NOT NULL DEFAULT 0,
+        temperature_count INTEGER NOT NULL DEFAULT 0,
+        humidity_sum REAL NOT NULL DEFAULT 0,
+        humidity_count INTEGER NOT NULL DEFAULT 0,
+        last_temperature REAL,
+        last_humidity REAL,
+        version INTEGER NOT NULL DEFAULT 0,
+        updated_at REAL NOT NULL DEFAULT 0
+    ) WITHOUT ROWID
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_last_seen ON device_stats (last_seen)"
+)
+
+def _time_text(value):
+    return value.strftime(TIME_FORMAT) if value is not None else None
+
+def _dicts(cursor):
+    """Fetched rows as dicts, with time columns parsed back into datetimes"""
+    columns = [column[0] for column in cursor.description]
+    rows = []
+    for values in cursor.fetchall():
+        row = dict(zip(columns, values))
+        for column in TIME_COLUMNS:
+            if row.get(column) is not None:
+                row[column] = datetime.fromisoformat(row[column])
+        rows.append(row)
+    return rows
+
+class _WriteJob:
+    __slots__ = ('func', 'args', 'done', 'result', 'error')
+
+    def __init__(self, func, args):
+        self.func = func
+        self.args = args
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SQLiteRepository(ReadingRepository):
+    """
+    Embedded SQLite store (see the module docstring). Writes are queued to a
+    single writer thread and callers wait for the commit that includes them,
+    so a write is durable to the WAL and visible to readers when it returns.
+    `cursor_wrapper` wraps every cursor (app.py passes its InstrumentedCursor).
+    Promoted sensor fields are expression indexes over sensor_data, since
+    SQLite cannot add stored generated columns to an existing table.
+    """
+
+    name = 'sqlite'
+
+    def __init__(self, path, batch_jobs=256, busy_timeout=5000, cache_kb=65536, synchronous='NORMAL',
+                 cursor_wrapper=None, sensor_fields=(), write_timeout=30):
+        super().__init__(sensor_fields)
+        self.path = path
+        self.batch_jobs = batch_jobs
+        self.write_timeout = write_timeout
+        self.busy_timeout = busy_timeout
+        self.cache_kb = cache_kb
+        self.synchronous = synchronous
+        self.cursor_wrapper = cursor_wrapper
+        self._local = threading.local()
+        self._connections = []  # (weakref to owning thread, connection)
+        self._connections_lock = threading.Lock()
+        self._jobs = queue.Queue()
+        self._writer = None
+        self._writer_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "connections_opened": 0,
+            "write_jobs": 0,
+            "write_errors": 0,
+            "commits": 0,
+            "max_batch_jobs": 0,
+            "total_commit_ms": 0.0
+        }
+
+    # Connections
+
+    def _connect(self):
+        # Statements are re-prepared only when they fall out of this per-connection cache
+        connection = sqlite3.connect(
+            self.path, isolation_level=None, check_same_thread=False, cached_statements=512
+        )
+        connection.execute("PRAGMA journal_mode = WAL")
+        connection.execute(f"PRAGMA synchronous = {self.synchronous}")
+        connection.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout)}")
+        connection.execute(f"PRAGMA cache_size = -{int(self.cache_kb)}")
+        connection.execute("PRAGMA temp_store = MEMORY")
+        with self._stats_lock:
+            self._stats["connections_opened"] += 1
+        return connection
+
+    def _reader(self):
+        """This thread's read connection (autocommit: each statement reads a fresh snapshot)"""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._local.connection = self._connect()
+            with self._connections_lock:
+                # Close connections left behind by finished threads
+                alive = []
+                for thread, other in self._connections:
+                    if thread() is None or not thread().is_alive():
+                        other.close()
+                    else:
+                        alive.append((thread, other))
+                alive.append((weakref.ref(threading.current_thread()), connection))
+                self._connections = alive
+        return connection
+
+    def _cursor(self, connection):
+        cursor = connection.cursor()
+        return self.cursor_wrapper(cursor) if self.cursor_wrapper else cursor
+
+    def _read(self, func, *args):
+        """Run func(cursor, *args) on this thread's read connection"""
+        cursor = self._cursor(self._reader())
+        try:
+            return func(cursor, *args)
+        except sqlite3.Error as e:
+            raise StorageError(f"Database error: {e}") from e
+        finally:
+            cursor.close()
+
+    # Group-committing writer
+
+    def _write(self, func, *args):
+        """
+        Queue func(cursor, *args) for the writer thread and wait for its commit.
+        SQLite errors are raised as StorageError, anything else func raised is
+        re-raised as is. Waiting longer than write_timeout raises StorageError
+        (the write may still be applied later).
+        """
+        self._start_writer()
+        job = _WriteJob(func, args)
+        self._jobs.put(job)
+        if not job.done.wait(self.write_timeout):
+            raise StorageError("Database error: timed out waiting for the SQLite writer")
+        if isinstance(job.error, sqlite3.Error):
+            raise StorageError(f"Database error: {job.error}") from job.error
+        if job.error is not None:
+            raise job.error
+        return job.result
+
+    def _start_writer(self):
+        # Also replaces a writer thread that died, so one failure cannot stall every later write
+        writer = self._writer
+        if writer is None or not writer.is_alive():
+            with self._writer_lock:
+                if self._writer is writer:
+                    self._writer = threading.Thread(target=self._write_loop, name="sqlite-writer", daemon=True)
+                    self._writer.start()
+
+    def _write_loop(self):
+        connection = self._connect()
+        while True:
+            jobs = [self._jobs.get()]
+            # Everything queued while the previous commit was running joins this one
+            while len(jobs) < self.batch_jobs:
+                try:
+                    jobs.append(self._jobs.get_nowait())
+                except queue.Empty:
+                    break
+            stopping = None in jobs
+            jobs = [job for job in jobs if job is not None]
+            if jobs:
+                try:
+                    self._commit_batch(connection, jobs)
+                except Exception:
+                    # _commit_batch hands errors to the callers; never let the loop end
+                    pass
+            if stopping:
+                connection.close()
+                return
+
+    def _commit_batch(self, connection, jobs):
+        started = time.perf_counter()
+        cursor = self._cursor(connection)
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            for job in jobs:
+                cursor.execute("SAVEPOINT job")
+                try:
+                    job.result = job.func(cursor, *job.args)
+                    cursor.execute("RELEASE job")
+                except Exception as e:
+                    # Any failure (bad values included) only undoes this job's savepoint
+                    job.error = e
+                    cursor.execute("ROLLBACK TO job")
+                    cursor.execute("RELEASE job")
+            cursor.execute("COMMIT")
+        except Exception as e:
+            if connection.in_transaction:
+                connection.rollback()
+            for job in jobs:
+                job.error = job.error or e
+        finally:
+            cursor.close()
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            with self._stats_lock:
+                self._stats["write_jobs"] += len(jobs)
+                self._stats["write_errors"] += sum(job.error is not None for job in jobs)
+                self._stats["commits"] += 1
+                self._stats["max_batch_jobs"] = max(self._stats["max_batch_jobs"], len(jobs))
+                self._stats["total_commit_ms"] += elapsed_ms
+            for job in jobs:
+                job.done.set()
+
+    # Schema
+
+    def init(self):
+        connection = self._connect()
+        try:
+            version = connection.execute("PRAGMA user_version").fetchone()[0]
+            if version < SQLITE_SCHEMA_VERSION:
+                with connection:
+                    for statement in SQLITE_SCHEMA:
+                        connection.execute(statement)
+                    connection.execute(f"PRAGMA user_version = {SQLITE_SCHEMA_VERSION}")
+            # The promoted fields are configuration, so their indexes are checked on every start
+            with connection:
+                for key in self.sensor_fields:
+                    connection.execute(
+                        f"CREATE INDEX IF NOT EXISTS idx_{sensor_column(key)} "
+                        f"ON iot_readings ({self._sensor_sql(key)}, device_id)"
+                    )
+            print(f"SQLite database ready at {self.path} (schema version {SQLITE_SCHEMA_VERSION})")
+        except sqlite3.Error as e:
+            raise StorageError(f"Database error: {e}") from e
+        finally:
+            connection.close()
+
+    def _time_param(self, value):
+        return _time_text(value)
+
+    def _index_hint(self, index):
+        # INDEXED BY fails the statement if the index cannot be used, so a plan can never silently degrade
+        return f"INDEXED BY {index}"
+
+    def _prefix_sql(self, prefix):
+        # device_id uses the BINARY collation, so codepoint bounds are exact
+        return "device_id >= ? AND device_id < ?", list(prefix_bounds(prefix))
+
+    def _sensor_sql(self, key):
+        # Must stay identical to the indexed expression for the planner to use the index
+        path = f"'$.{key}'"
+        return (
+            f"(CASE json_type(sensor_data, {path}) "
+            f"WHEN 'integer' THEN json_extract(sensor_data, {path}) "
+            f"WHEN 'real' THEN json_extract(sensor_data, {path}) "
+            f"WHEN 'true' THEN 1 WHEN 'false' THEN 0 END)"
+        )
+
+    def ping(self):
+        try:
+            return self._read(lambda cursor: cursor.execute("SELECT 1").fetchall()) == [(1,)]
+        except StorageError:
+            return False
+
+    # Writes (run on the writer thread inside a savepoint)
+
+    def insert_rows(self, rows):
+        return self._write(self._insert, rows)
+
+    @staticmethod
+    def _insert(cursor, rows):
+        created_at = _time_text(datetime.now())
+        cursor.executemany("""
+        INSERT INTO iot_readings (device_id, timestamp, temperature, humidity, sensor_data, created_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+        """, [(device_id, _time_text(timestamp), temperature, humidity, sensor_data, created_at)
+              for device_id, timestamp, temperature, humidity, sensor_data in rows])
+        # Only this thread writes, so the batch's AUTOINCREMENT ids are consecutive
+        cursor.execute("SELECT last_insert_rowid()")
+        first_id = cursor.fetchone()[0] - len(rows) + 1
+
+        latest = {}
+        for device_id, timestamp, temperature, humidity, _ in rows:
+            if device_id not in latest or timestamp >= latest[device_id][0]:
+                latest[device_id] = (timestamp, temperature, humidity)
+        deltas = stats_deltas((row[0], row[2], row[3]) for row in rows)
+        now = time.time()
+        cursor.executemany("""
+        INSERT INTO device_stats
+            (device_id, last_seen, last_temperature, last_humidity, total_readings,
+             temperature_sum, temperature_count, humidity_sum, humidity_count, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (device_id) DO UPDATE SET
+            last_temperature = CASE WHEN last_seen IS NULL OR excluded.last_seen >= last_seen
+                                    THEN excluded.last_temperature ELSE last_temperature END,
+            last_humidity = CASE WHEN last_seen IS NULL OR excluded.last_seen >= last_seen
+                                 THEN excluded.last_humidity ELSE last_humidity END,
+            last_seen = MAX(COALESCE(last_seen, excluded.last_seen), excluded.last_seen),
+            total_readings = total_readings + excluded.total_readings,
+            temperature_sum = temperature_sum + excluded.temperature_sum,
+            temperature_count = temperature_count + excluded.temperature_count,
+            humidity_sum = humidity_sum + excluded.humidity_sum,
+            humidity_count = humidity_count + excluded.humidity_count,
+            version = version + 1,
+            updated_at = excluded.updated_at
+        """, [
+            (device_id, _time_text(latest[device_id][0]), *latest[device_id][1:], *deltas[device_id], now)
+            for device_id in sorted(deltas)
+        ])
+        return first_id
+
+    @staticmethod
+    def _record_changes(cursor, removed=(), added=()):
+        """Apply (device_id, temperature, humidity) triples to device_stats and re-read the latest readings"""
+        deltas = stats_deltas(removed, sign=-1)
+        for device_id, delta in stats_deltas(added).items():
+            current = deltas.setdefault(device_id, [0, 0.0, 0, 0.0, 0])
+            for i, value in enumerate(delta):
+                current[i] += value
+        now = time.time()
+        cursor.executemany("""
+        INSERT INTO device_stats
+            (device_id, total_readings, temperature_sum, temperature_count, humidity_sum, humidity_count, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (device_id) DO UPDATE SET
+            total_readings = total_readings + excluded.total_readings,
+            temperature_sum = temperature_sum + excluded.temperature_sum,
+            temperature_count = temperature_count + excluded.temperature_count,
+            humidity_sum = humidity_sum + excluded.humidity_sum,
+            humidity_count = humidity_count + excluded.humidity_count,
+            version = version + 1,
+            updated_at = excluded.updated_at
+        """, [(device_id, *deltas[device_id], now) for device_id in sorted(deltas)])
+
+        for device_id in sorted(deltas):
+            cursor.execute("""
+            SELECT timestamp, temperature, humidity FROM iot_readings
+            WHERE device_id = ?
+            ORDER BY timestamp DESC, id DESC
+            LIMIT 1
+            """, (device_id,))
+            latest = cursor.fetchone()
+            if latest is None:
+                cursor.execute("DELETE FROM device_stats WHERE device_id = ?", (device_id,))
+            else:
+                cursor.execute("""
+                UPDATE device_stats
+                SET last_seen = ?, last_temperature = ?, last_humidity = ?
+                WHERE device_id = ?
+                """, (*latest, device_id))
+
+    def update_reading(self, reading_id, fields):
+        return self._write(self._update, reading_id, fields)
+
+    @staticmethod
+    def _update(cursor, reading_id, fields):
+        cursor.execute(
+            "SELECT device_id, temperature, humidity FROM iot_readings WHERE id = ?", (reading_id,)
+        )
+        previous = cursor.fetchone()
+        if previous is None:
+            return None
+        columns = sorted(fields)
+        cursor.execute(
+            f"UPDATE iot_readings SET {', '.join(f'{column} = ?' for column in columns)} WHERE id = ?",
+            [fields[column] for column in columns] + [reading_id]
+        )
+        rows_affected = cursor.rowcount
+        device_id = fields.get('device_id', previous[0])
+        SQLiteRepository._record_changes(
+            cursor,
+            removed=[previous],
+            added=[(device_id, fields.get('temperature', previous[1]), fields.get('humidity', previous[2]))]
+        )
+        return previous[0], device_id, rows_affected
+
+    def delete_reading(self, reading_id):
+        return self._write(self._delete, reading_id)
+
+    @staticmethod
+    def _delete(cursor, reading_id):
+        cursor.execute(
+            "SELECT device_id, temperature, humidity FROM iot_readings WHERE id = ?", (reading_id,)
+        )
+        previous = cursor.fetchone()
+        if previous is None:
+            return None
+        cursor.execute("DELETE FROM iot_readings WHERE id = ?", (reading_id,))
+        rows_affected = cursor.rowcount
+        SQLiteRepository._record_changes(cursor, removed=[previous])
+        return previous[0], rows_affected
+
+    def last_reading_id(self):
+        def query(cursor):
+            cursor.execute("SELECT COALESCE(MAX(id), 0) FROM iot_readings")
+            return cursor.fetchone()[0]
+        return self._read(query)
+
+    def delete_readings_chunk(self, device_id, limit, start=None, end=None, max_id=None):
+        sql, params = self._purge_sql(device_id, start, end, max_id)
+        return self._write(self._delete_chunk, f"{sql} LIMIT ?", params + [limit])
+
+    @staticmethod
+    def _delete_chunk(cursor, sql, params):
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+        cursor.executemany("DELETE FROM iot_readings WHERE id = ?", [(row[0],) for row in rows])
+        SQLiteRepository._record_changes(cursor, removed=[(row[1], row[3], row[4]) for row in rows])
+        return len(rows)
+
+    # Reads
+
+    def get_reading(self, reading_id):
+        def query(cursor):
+            cursor.execute("SELECT * FROM iot_readings WHERE id = ?", (reading_id,))
+            rows = _dicts(cursor)
+            return rows[0] if rows else None
+        return self._read(query)
+
+    def latest_readings(self, device_id, limit):
+        def query(cursor):
+            cursor.execute("""
+            SELECT * FROM iot_readings
+            WHERE device_id = ?
+            ORDER BY timestamp DESC, id DESC
+            LIMIT ?
+            """, (device_id, limit))
+            return _dicts(cursor)
+        return self._read(query)
+
+    def _seek(self, device_id, key, ascending, count, skip, filters=None):
+        sql, params = self._seek_sql(device_id, key, ascending, filters)
+
+        def query(cursor):
+            cursor.execute(f"{sql} LIMIT ? OFFSET ?", params + [count, skip])
+            return _dicts(cursor)
+        return self._read(query)
+
+    def device_total(self, device_id):
+        def query(cursor):
+            cursor.execute("SELECT total_readings FROM device_stats WHERE device_id = ?", (device_id,))
+            row = cursor.fetchone()
+            return row[0] if row else 0
+        return self._read(query)
+
+    def total_readings(self):
+        def query(cursor):
+            cursor.execute("SELECT COALESCE(SUM(total_readings), 0) FROM device_stats")
+            return int(cursor.fetchone()[0])
+        return self._read(query)
+
+    def count_readings(self, device_id, filters):
+        sql, params = self._count_sql(device_id, filters)
+
+        def query(cursor):
+            cursor.execute(sql, params)
+            return cursor.fetchone()[0]
+        return self._read(query)
+
+    def device_summaries(self):
+        def query(cursor):
+            cursor.execute("""
+            SELECT
+                device_id,
+                last_seen,
+                total_readings,
+                temperature_sum / NULLIF(temperature_count, 0) AS avg_temperature,
+                humidity_sum / NULLIF(humidity_count, 0) AS avg_humidity,
+                last_temperature,
+                last_humidity,
+                temperature_sum,
+                temperature_count,
+                humidity_sum,
+                humidity_count
+            FROM device_stats
+            ORDER BY last_seen DESC
+            """)
+            return _dicts(cursor)
+        return self._read(query)
+
+    def device_validator(self, device_id):
+        def query(cursor):
+            cursor.execute("SELECT version, updated_at FROM device_stats WHERE device_id = ?", (device_id,))
+            row = cursor.fetchone()
+            if row is None:
+                return Validator("none", None, None)
+            version, updated_at = row
+            return Validator(f"{version}-{int(updated_at * 1000000)}", updated_at, version)
+        return self._read(query)
+
+    def readings_validator(self):
+        def query(cursor):
+            cursor.execute("SELECT COUNT(*), COALESCE(SUM(version), 0), MAX(updated_at) FROM device_stats")
+            devices, versions, updated_at = cursor.fetchone()
+            if not devices:
+                return Validator("none", None, None)
+            return Validator(f"{devices}-{versions}-{int(updated_at * 1000000)}", updated_at, None)
+        return self._read(query)
+
+    def aggregate(self, device_id, bucket_seconds, start, end):
+        # No rollup tables: buckets are computed from raw readings over the (device_id, timestamp) index
+        selected = []
+        for name, column in reading_metrics(self.sensor_fields):
+            sql = column if name == column else self._sensor_sql(name)
+            selected.append(f"MIN({sql}) AS {column}_min, MAX({sql}) AS {column}_max, AVG({sql}) AS {column}_avg")
+        aggregates = ",\n                ".join(selected)
+
+        def query(cursor):
+            cursor.execute(f"""
+            SELECT
+                CAST(strftime('%s', timestamp) AS INTEGER) / ? * ? AS bucket,
+                COUNT(*) AS count,
+                {aggregates}
+            FROM iot_readings
+            WHERE device_id = ? AND timestamp >= ? AND timestamp < ?
+            GROUP BY bucket
+            ORDER BY bucket
+            """, (bucket_seconds, bucket_seconds, device_id, _time_text(start), _time_text(end)))
+            rows = _dicts(cursor)
+            for row in rows:
+                row['bucket'] = EPOCH + timedelta(seconds=row['bucket'])
+            return rows
+        return 'raw', self._read(query)
+
+    def iter_readings(self, device_id, start=None, end=None, after=None, chunk_size=1000):
+        # Each chunk is its own keyset query, so no read snapshot stays open while the client is slow
+        conditions, params = ["device_id = ?"], [device_id]
+        if start is not None:
+            conditions.append("timestamp >= ?")
+            params.append(_time_text(start))
+        if end is not None:
+            conditions.append("timestamp < ?")
+            params.append(_time_text(end))
+        sql = f"""
+        SELECT {', '.join(EXPORT_COLUMNS)} FROM iot_readings
+        WHERE {' AND '.join(conditions)} AND (timestamp > ? OR (timestamp = ? AND id > ?))
+        ORDER BY timestamp, id
+        LIMIT ?
+        """
+        timestamp, last_id = (_time_text(after[0]), after[1]) if after else ('', 0)
+
+        def query(cursor):
+            cursor.execute(sql, params + [timestamp, timestamp, last_id, chunk_size])
+            return cursor.fetchall()
+
+        while True:
+            rows = self._read(query)
+            if not rows:
+                return
+            timestamp, last_id = rows[-1][2], rows[-1][0]
+            yield [
+                (*row[:2], datetime.fromisoformat(row[2]), *row[3:6],
+                 datetime.fromisoformat(row[6]) if row[6] else None)
+                for row in rows
+            ]
+            if len(rows) < chunk_size:
+                return
+
+    def explain(self, operation, params):
+        # A raw cursor keeps EXPLAIN itself out of the metrics and the slow-query log
+        try:
+            cursor = self._reader().cursor()
+            try:
+                cursor.execute(f"EXPLAIN QUERY PLAN {operation}", params or ())
+                return [dict(zip(('id', 'parent', 'notused', 'detail'), row)) for row in cursor.fetchall()], None
+            finally:
+                cursor.close()
+        except sqlite3.Error as e:
+            return None, str(e)
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        commits = stats.pop("commits")
+        total_commit_ms = stats.pop("total_commit_ms")
+        with self._connections_lock:
+            open_connections = len(self._connections)
+        return {
+            "backend": self.name,
+            "path": self.path,
+            "read_connections": open_connections,
+            "write_queue_depth": self._jobs.qsize(),
+            "commits": commits,
+            "avg_batch_jobs": round(stats["write_jobs"] / commits, 2) if commits else 0.0,
+            "avg_commit_ms": round(total_commit_ms / commits, 3) if commits else 0.0,
+            **stats
+        }
+
+    def close(self):
+        """Stop the writer after the queued writes and close every connection"""
+        if self._writer is not None:
+            self._jobs.put(None)
+            self._writer.join(5)
+            self._writer = None
+        with self._connections_lock:
+            for _, connection in self._connections:
+                connection.close()
+            self._connections = []
+        self._local = threading.local()
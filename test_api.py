@@ -0,0 +1,500 @@
+"""
+Tests for the ingest and read API endpoints, in-process on a temporary
+SQLite database (fixtures in conftest.py)
+
+    python -m pytest -q test_api.py
+"""
+
+import csv
+import gzip
+import io
+import json
+import queue
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta
+
+import pytest
+
+from test_crud import API_URL, BASE_URL, wait_for_job
+
+DATA_URL = f"{BASE_URL}/api/data"
+
+def test_batch_with_rejected_items_is_a_multi_status(http):
+    response = http.post(f"{DATA_URL}/batch", json={"readings": [
+        {"device_id": "batch_device", "temperature": 20.5, "humidity": 40},
+        {"device_id": "", "temperature": 21},
+        {"device_id": "batch_device", "temperature": "hot"},
+        {"device_id": "batch_device", "humidity": 41, "sensor_data": {"battery": 80}}
+    ]})
+    assert response.status_code == 207
+    result = response.json()
+    assert (result['created'], result['rejected']) == (2, 2)
+    assert [item['status'] for item in result['results']] == ['created', 'rejected', 'rejected', 'created']
+    assert [item['index'] for item in result['results']] == [0, 1, 2, 3]
+    assert "device_id" in result['results'][1]['error']
+    assert "temperature" in result['results'][2]['error']
+
+    stored = http.get(f"{API_URL}/device/batch_device/readings").json()['readings']
+    assert {(reading['temperature'], reading['humidity']) for reading in stored} == {(20.5, 40.0), (None, 41.0)}
+
+def test_batch_status_codes(http):
+    readings = [{"device_id": "batch_status_device", "temperature": 20}]
+    assert http.post(f"{DATA_URL}/batch", json={"readings": readings * 2}).status_code == 201
+    # A bare array is accepted as well
+    assert http.post(f"{DATA_URL}/batch", json=readings).status_code == 201
+    assert http.post(f"{DATA_URL}/batch", json={"readings": [{"temperature": 1}]}).status_code == 400
+    assert http.post(f"{DATA_URL}/batch", json={"readings": []}).status_code == 400
+
+def page_through(http, url, param, cursor):
+    """
+    Page from `cursor` with ?after= (param 'after', towards older readings) or
+    ?before=; returns the pages of reading ids and the last response
+    """
+    cursor_key = 'next_cursor' if param == 'after' else 'prev_cursor'
+    pages = []
+    while cursor:
+        result = http.get(f"{url}&{param}={cursor}").json()
+        pages.append([reading['id'] for reading in result['readings']])
+        cursor = result[cursor_key]
+    return pages, result
+
+def test_cursor_pages_have_no_duplicates_or_gaps(http):
+    # Three readings share each timestamp, so the id tie-break matters
+    http.post(f"{DATA_URL}/batch", json=[
+        {"device_id": "paging_device", "temperature": i, "timestamp": f"2025-08-01T12:00:{i // 3:02d}"}
+        for i in range(23)
+    ])
+    url = f"{API_URL}/device/paging_device/readings?limit=5"
+    everything = http.get(f"{API_URL}/device/paging_device/readings?limit=50").json()['readings']
+    expected = [reading['id'] for reading in everything]
+    assert len(expected) == 23
+
+    first = http.get(url).json()
+    # A reading that arrives while paging lands before the first page, not inside a later one
+    http.post(DATA_URL, json={"device_id": "paging_device", "temperature": 99, "timestamp": "2025-08-01T13:00:00"})
+    older, oldest = page_through(http, url, 'after', first['next_cursor'])
+    ids = [reading['id'] for reading in first['readings']] + [i for page in older for i in page]
+    assert ids == expected
+    assert [len(page) for page in older] == [5, 5, 5, 3]
+
+    # Back from the oldest page towards the newest, which now starts with the new reading
+    newer, _ = page_through(http, url, 'before', oldest['prev_cursor'])
+    newest_id = http.get(f"{API_URL}/device/paging_device/readings?limit=1").json()['readings'][0]['id']
+    assert [i for page in reversed(newer) for i in page] == [newest_id] + expected[:20]
+    assert newest_id not in expected
+
+def test_conditional_get_until_the_next_write(http):
+    device_url = f"{DATA_URL}/conditional_device"
+    http.post(DATA_URL, json={"device_id": "conditional_device", "temperature": 20})
+    for url in (device_url, f"{API_URL}/readings?limit=5"):
+        response = http.get(url)
+        etag = response.headers['ETag']
+        assert 'Cookie' not in response.headers.get('Vary', '')
+        not_modified = http.get(url, headers={'If-None-Match': etag})
+        assert not_modified.status_code == 304 and not_modified.content == b''
+        assert not_modified.headers['ETag'] == etag
+
+    # Last-Modified is only sent once the second of the last write has passed
+    time.sleep(1.1)
+    response = http.get(device_url)
+    etag, last_modified = response.headers['ETag'], response.headers['Last-Modified']
+    assert http.get(device_url, headers={'If-Modified-Since': last_modified}).status_code == 304
+
+    http.post(DATA_URL, json={"device_id": "conditional_device", "temperature": 21})
+    assert http.get(device_url, headers={'If-None-Match': etag}).status_code == 200
+    assert http.get(device_url, headers={'If-Modified-Since': last_modified}).status_code == 200
+    response = http.get(device_url)
+    assert response.headers['ETag'] != etag and len(response.json()['readings']) == 2
+
+def test_aggregate_buckets_match_the_raw_readings(http):
+    http.post(f"{DATA_URL}/batch", json=[
+        {"device_id": "aggregate_device", "temperature": 20 + (i * 37) % 11, "humidity": 40 + i,
+         "sensor_data": {"battery": 100 - i}, "timestamp": f"2025-08-01T{11 + i * 7 // 60}:{i * 7 % 60:02d}:30"}
+        for i in range(20)
+    ])
+    raw = http.get(f"{API_URL}/device/aggregate_device/readings?limit=100").json()['readings']
+    result = http.get(f"{DATA_URL}/aggregate_device/aggregate?bucket=15m"
+                      f"&from=2025-08-01T11:10:00&to=2025-08-01T13:00:00").json()
+    # The range is widened to whole buckets: 11:00 up to 13:00
+    assert (result['from'], result['to']) == ("2025-08-01T11:00:00", "2025-08-01T13:00:00")
+
+    expected = {}
+    for reading in raw:
+        timestamp = datetime.fromisoformat(reading['timestamp'])
+        if timestamp.hour < 13:
+            bucket = timestamp.replace(minute=timestamp.minute // 15 * 15, second=0).isoformat()
+            expected.setdefault(bucket, []).append(reading)
+    assert [bucket['bucket_start'] for bucket in result['buckets']] == sorted(expected)
+    for bucket in result['buckets']:
+        readings = expected[bucket['bucket_start']]
+        assert bucket['count'] == len(readings)
+        for name, values in (("temperature", [reading['temperature'] for reading in readings]),
+                             ("humidity", [reading['humidity'] for reading in readings]),
+                             ("battery", [reading['sensor_data']['battery'] for reading in readings])):
+            assert bucket[name]['min'] == min(values) and bucket[name]['max'] == max(values)
+            assert bucket[name]['avg'] == pytest.approx(sum(values) / len(values))
+
+def test_export_streams_every_reading_and_gzips_only_when_accepted(offline_app, http):
+    for first in range(0, 2500, 500):
+        http.post(f"{DATA_URL}/batch", json=[
+            {"device_id": "export_device", "temperature": i, "sensor_data": {"n": i},
+             "timestamp": (datetime(2025, 8, 1) + timedelta(seconds=i)).isoformat()}
+            for i in range(first, first + 500)
+        ])
+    export_url = f"{BASE_URL}/api/export/export_device"
+
+    with offline_app.app.test_client().get(export_url[len(BASE_URL):], buffered=False) as response:
+        assert response.is_streamed and response.mimetype == 'application/x-ndjson'
+    lines = http.get(export_url).text.splitlines()
+    rows = [json.loads(line) for line in lines]
+    assert [row['temperature'] for row in rows] == list(range(2500))
+    assert rows[7]['sensor_data'] == {"n": 7}
+
+    csv_rows = list(csv.DictReader(io.StringIO(http.get(f"{export_url}?format=csv").text)))
+    assert len(csv_rows) == 2500 and csv_rows[0]['id'] == str(rows[0]['id'])
+    # Resuming after a row continues with the next one
+    resumed = http.get(f"{export_url}?after={rows[1999]['timestamp']},{rows[1999]['id']}").text.splitlines()
+    assert resumed == lines[2000:]
+
+    compressed = http.get(export_url, headers={'Accept-Encoding': 'br, gzip'})
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert compressed.text.splitlines() == lines
+    for accept in ('gzip;q=0', 'identity', 'deflate'):
+        response = http.get(export_url, headers={'Accept-Encoding': accept})
+        assert 'Content-Encoding' not in response.headers and response.text.splitlines() == lines
+        assert 'Accept-Encoding' in response.headers['Vary']
+
+def export_temperatures(http, device_id):
+    lines = http.get(f"{BASE_URL}/api/export/{device_id}").text.splitlines()
+    return [json.loads(line)['temperature'] for line in lines]
+
+def test_purge_job_reports_progress_and_deletes_in_chunks(offline_app, http, monkeypatch):
+    monkeypatch.setitem(offline_app.PURGE_CONFIG, 'chunk_size', 7)
+    monkeypatch.setitem(offline_app.PURGE_CONFIG, 'pause', 0.01)
+    start = datetime(2025, 9, 1)
+    http.post(f"{DATA_URL}/batch", json=[
+        {"device_id": "purge_device", "temperature": i, "timestamp": (start + timedelta(minutes=i)).isoformat()}
+        for i in range(60)
+    ])
+
+    window = {"from": (start + timedelta(minutes=10)).isoformat(), "to": (start + timedelta(minutes=40)).isoformat()}
+    response = http.delete(f"{API_URL}/device/purge_device?from={window['from']}&to={window['to']}")
+    assert response.status_code == 202
+    job = response.json()['job']
+    assert job['type'] == 'purge' and response.headers['Location'].endswith(f"/api/jobs/{job['id']}")
+
+    seen = []
+    while job['status'] in ('queued', 'running'):
+        seen.append(job['progress']['done'])
+        time.sleep(0.005)
+        job = http.get(f"{BASE_URL}/api/jobs/{job['id']}").json()['job']
+    assert seen == sorted(seen) and all(done <= 30 for done in seen)
+    assert job['status'] == 'completed' and job['error'] is None
+    assert job['progress'] == {"done": 30, "total": 30}
+    assert job['result']['deleted'] == 30
+    assert export_temperatures(http, "purge_device") == list(range(10)) + list(range(40, 60))
+
+    job = http.delete(f"{API_URL}/device/purge_device").json()['job']
+    job = wait_for_job(http, job['id'])
+    assert job['status'] == 'completed'
+    assert job['progress']['done'] == job['progress']['total'] == job['result']['deleted'] == 30
+    assert export_temperatures(http, "purge_device") == []
+    assert http.delete(f"{API_URL}/device/purge_device").status_code == 404
+
+def test_job_submission_dedupe_and_cancellation(offline_app, http, monkeypatch):
+    jobs_url = f"{BASE_URL}/api/jobs"
+    assert http.post(jobs_url, json={"type": "reindex"}).status_code == 400
+    assert http.post(jobs_url, json={"type": "purge", "params": {"device_id": ""}}).status_code == 400
+    assert http.post(jobs_url, json={"type": "purge", "params": {"device_id": "job_device", "from": "soon"}}).status_code == 400
+    assert http.get(f"{jobs_url}/no-such-job").status_code == 404
+
+    monkeypatch.setattr(offline_app.job_executor, 'queue_size', 0)
+    response = http.post(jobs_url, json={"type": "purge", "params": {"device_id": "job_device"}})
+    assert response.status_code == 503 and response.headers['Retry-After'] == '5'
+    monkeypatch.undo()
+
+    monkeypatch.setitem(offline_app.PURGE_CONFIG, 'chunk_size', 2)
+    monkeypatch.setitem(offline_app.PURGE_CONFIG, 'pause', 0.2)
+    http.post(f"{DATA_URL}/batch", json=[{"device_id": "job_device", "temperature": i} for i in range(20)])
+
+    response = http.post(jobs_url, json={"type": "purge", "params": {"device_id": "job_device"}})
+    assert response.status_code == 202
+    job = response.json()['job']
+    assert response.headers['Location'].endswith(f"/api/jobs/{job['id']}")
+    # The same request while the first is unfinished gets the same job back
+    again = http.post(jobs_url, json={"type": "purge", "params": {"device_id": "job_device"}}).json()['job']
+    assert again['id'] == job['id']
+    assert job['id'] in [listed['id'] for listed in http.get(jobs_url).json()['jobs']]
+
+    deadline = time.monotonic() + 5
+    while http.get(f"{jobs_url}/{job['id']}").json()['job']['status'] != 'running':
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    purge = offline_app.JOB_TYPES['purge']
+    monkeypatch.setitem(offline_app.JOB_TYPES, 'purge', purge._replace(cancellable=False))
+    assert http.delete(f"{jobs_url}/{job['id']}").status_code == 409
+    monkeypatch.setitem(offline_app.JOB_TYPES, 'purge', purge)
+
+    assert http.delete(f"{jobs_url}/{job['id']}").status_code == 202
+    job = wait_for_job(http, job['id'])
+    assert job['status'] == 'cancelled'
+    remaining = export_temperatures(http, "job_device")
+    assert 0 < job['result']['deleted'] < 20
+    assert len(remaining) == 20 - job['result']['deleted']
+    # Finished jobs are reported as they are, not cancelled again
+    assert http.delete(f"{jobs_url}/{job['id']}").json()['job']['status'] == 'cancelled'
+
+class StreamViewer(threading.Thread):
+    """
+    Reads /api/stream on its own thread, as a browser connection would be
+    served, and queues each block as (event, data), or (None, text) for
+    retry and keep-alive lines
+    """
+
+    def __init__(self, app, path):
+        super().__init__(daemon=True)
+        self.app, self.path = app, path
+        self.events = queue.Queue()
+        self.stopped = threading.Event()
+        self.headers = None
+
+    def run(self):
+        response = self.app.test_client().get(self.path, buffered=False)
+        self.headers = response.headers
+        try:
+            for chunk in response.response:
+                block = chunk.decode().strip()
+                fields = dict(line.split(': ', 1) for line in block.splitlines() if not line.startswith(':'))
+                self.events.put((fields['event'], json.loads(fields['data'])) if 'event' in fields else (None, block))
+                if self.stopped.is_set():
+                    break
+        finally:
+            response.close()
+
+    def next(self):
+        return self.events.get(timeout=5)
+
+    def __enter__(self):
+        self.start()
+        assert self.next()[1].startswith("retry:")
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.join(timeout=5)
+
+def test_stream_delivers_readings_inserted_after_connecting(offline_app, http, monkeypatch):
+    monkeypatch.setitem(offline_app.STREAM_CONFIG, 'keepalive', 0.05)
+    with StreamViewer(offline_app.app, '/api/stream') as viewer, \
+            StreamViewer(offline_app.app, '/api/stream?device_id=other_stream_device') as other:
+        assert viewer.headers['Content-Type'].startswith('text/event-stream')
+        assert viewer.headers['Cache-Control'] == 'no-cache'
+        response = http.post(DATA_URL, json={"device_id": "stream_device", "temperature": 22.5,
+                                             "humidity": 50, "sensor_data": {"battery": 90}})
+        assert response.status_code == 201
+        event, reading = viewer.next()
+        assert event == 'reading'
+        assert (reading['device_id'], reading['temperature'], reading['humidity']) == ("stream_device", 22.5, 50.0)
+        assert reading['sensor_data'] == {"battery": 90} and reading['id'] is not None
+        event, device = viewer.next()
+        assert event == 'device' and device['device_id'] == "stream_device" and device['added_readings'] == 1
+        # A viewer of another device only sees keep-alives
+        assert other.next() == (None, ": keepalive")
+    assert not viewer.is_alive() and not other.is_alive()
+    assert offline_app.reading_broadcaster.stats()['subscribers'] == 0
+
+def test_stream_viewer_that_falls_behind_is_reset(offline_app, http, monkeypatch):
+    monkeypatch.setattr(offline_app.reading_broadcaster, 'queue_size', 2)
+    with StreamViewer(offline_app.app, '/api/stream?device_id=lagging_device') as viewer:
+        http.post(f"{DATA_URL}/batch", json=[{"device_id": "lagging_device", "temperature": i} for i in range(200)])
+        received = []
+        while not received or received[-1] == 'reading':
+            received.append(viewer.next()[0])
+        # Whatever was still queued is dropped in favour of the reset
+        assert received[-1] == 'reset' and len(received) < 200
+    assert not viewer.is_alive()
+
+def metric_samples(http):
+    """{'name{labels}': value} from the Prometheus text endpoint"""
+    response = http.get(f"{BASE_URL}/api/metrics")
+    assert response.status_code == 200 and response.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+    samples = {}
+    for line in response.text.splitlines():
+        if line and not line.startswith('#'):
+            name, value = line.rsplit(' ', 1)
+            samples[name] = float(value)
+    return samples
+
+def test_metrics_count_requests_and_queries(http):
+    created = 'iot_http_request_duration_seconds_count{method="POST",route="/api/data",status="201"}'
+    invalid = 'iot_http_request_duration_seconds_count{method="POST",route="/api/data",status="400"}'
+    # SQLite writes run on the storage writer thread, outside any request
+    inserts = 'iot_db_query_duration_seconds_count{route="background",query="INSERT iot_readings"}'
+    fetched = 'iot_db_query_rows_total{route="/api/crud/device/<device_id>/readings",query="SELECT iot_readings"}'
+    before = metric_samples(http)
+
+    for temperature in (20, 21, 22):
+        assert http.post(DATA_URL, json={"device_id": "metrics_device", "temperature": temperature}).status_code == 201
+    assert http.post(DATA_URL, json={"temperature": 23}).status_code == 400
+    readings = http.get(f"{API_URL}/device/metrics_device/readings").json()['readings']
+    assert len(readings) == 3
+    after = metric_samples(http)
+
+    assert after[created] - before.get(created, 0) == 3
+    assert after[invalid] - before.get(invalid, 0) == 1
+    assert after[inserts] - before.get(inserts, 0) >= 3
+    assert after[fetched] - before.get(fetched, 0) >= 3
+    # Buckets are cumulative and the +Inf bucket is the count
+    infinite = created.replace('_count{', '_bucket{').replace('"}', '",le="+Inf"}')
+    assert after[infinite] == after[created]
+    assert after['iot_http_requests_in_flight'] >= 1
+
+def test_binary_and_compressed_ingest(offline_app, http, monkeypatch):
+    from udp_ingest import encode_datagram
+
+    binary = {'Content-Type': offline_app.BINARY_CONTENT_TYPE}
+    epoch = 1756684800
+    body = encode_datagram('binary_device', [{"timestamp": epoch, "temperature": -3.25, "humidity": None,
+                                              "sensor_data": {"light": 40.5, "light_raw": 812}}])
+    assert len(body) == 2 + len('binary_device') + 12
+    assert http.post(DATA_URL, data=body, headers=binary).status_code == 201
+
+    records = [{"timestamp": epoch + i, "temperature": 20 + i, "humidity": 50} for i in (1, 2)]
+    response = http.post(f"{DATA_URL}/batch", data=gzip.compress(encode_datagram('binary_device', records)),
+                         headers={**binary, 'Content-Encoding': 'gzip'})
+    assert response.status_code == 201 and response.json()['created'] == 2
+
+    raw_deflate = zlib.compressobj(wbits=-15)
+    payload = json.dumps({"device_id": "binary_device", "temperature": 30, "sensor_data": {"light": 1}}).encode()
+    response = http.post(DATA_URL, data=raw_deflate.compress(payload) + raw_deflate.flush(),
+                         headers={'Content-Type': 'application/json', 'Content-Encoding': 'deflate'})
+    assert response.status_code == 201
+
+    stored = sorted(http.get(f"{API_URL}/device/binary_device/readings").json()['readings'],
+                    key=lambda reading: reading['temperature'])
+    assert [(reading['temperature'], reading['humidity']) for reading in stored] == \
+        [(-3.25, None), (21.0, 50.0), (22.0, 50.0), (30.0, None)]
+    assert stored[0]['sensor_data'] == {"light": 40.5, "light_raw": 812}
+    assert stored[0]['timestamp'].startswith(datetime.fromtimestamp(epoch).isoformat())
+
+    assert http.post(DATA_URL, data=body, headers={**binary, 'Content-Encoding': 'br'}).status_code == 415
+    assert http.post(DATA_URL, data=b'not gzip', headers={**binary, 'Content-Encoding': 'gzip'}).status_code == 400
+    assert http.post(DATA_URL, data=body[:-1], headers=binary).status_code == 400
+    assert http.post(DATA_URL, data=b'\x09' + body[1:], headers=binary).status_code == 400
+    # The size limit applies to the inflated body too
+    monkeypatch.setattr(offline_app, 'INGEST_MAX_BODY', 1000)
+    assert http.post(DATA_URL, data=gzip.compress(b' ' * 5000), headers={'Content-Encoding': 'gzip'}).status_code == 413
+    assert http.post(DATA_URL, data=b' ' * 1001).status_code == 413
+
+def test_large_json_responses_are_compressed_when_accepted(offline_app, http, monkeypatch):
+    http.post(f"{DATA_URL}/batch", json=[
+        {"device_id": "compress_device", "temperature": 20 + i / 10, "humidity": 40, "sensor_data": {"light": i}}
+        for i in range(50)
+    ])
+    client = offline_app.app.test_client()
+    url = '/api/data/compress_device'
+    identity = client.get(url)
+    assert 'Content-Encoding' not in identity.headers and len(identity.data) > 1024
+    assert 'Accept-Encoding' in identity.headers['Vary']
+
+    compressed = client.get(url, headers={'Accept-Encoding': 'gzip, deflate'})
+    assert compressed.headers['Content-Encoding'] == 'gzip' and 'Accept-Encoding' in compressed.headers['Vary']
+    assert len(compressed.data) < len(identity.data) / 3
+    assert json.loads(gzip.decompress(compressed.data)) == identity.get_json()
+    deflated = client.get(url, headers={'Accept-Encoding': 'deflate'})
+    assert deflated.headers['Content-Encoding'] == 'deflate'
+    assert zlib.decompress(deflated.data) == identity.data
+
+    # The compressed copy has a weak ETag that still revalidates
+    etag = compressed.headers['ETag']
+    assert etag.startswith('W/') and etag[2:] == identity.headers['ETag']
+    assert client.get(url, headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag}).status_code == 304
+
+    small = client.get('/api/crud/device/compress_device/readings?limit=1', headers={'Accept-Encoding': 'gzip'})
+    assert small.status_code == 200 and 'Content-Encoding' not in small.headers
+    monkeypatch.setitem(offline_app.COMPRESS_CONFIG, 'enabled', False)
+    assert 'Content-Encoding' not in client.get(url, headers={'Accept-Encoding': 'gzip'}).headers
+
+def test_json_encoding_is_the_same_with_and_without_orjson(offline_app, monkeypatch):
+    pytest.importorskip('orjson')
+    value = {"at": datetime(2025, 9, 1, 12, 30, 15, 250000), "day": datetime(2025, 9, 1).date(),
+             "amount": offline_app.decimal.Decimal('1.50'), "reading": {"temperature": 21.5, "sensor_data": None}}
+    fast = offline_app.app.json.dumps(value)
+    with offline_app.app.test_request_context():
+        fast_body = offline_app.jsonify(value).get_json()
+    monkeypatch.setattr(offline_app, 'orjson', None)
+    assert json.loads(offline_app.app.json.dumps(value)) == json.loads(fast)
+    with offline_app.app.test_request_context():
+        assert offline_app.jsonify(value).get_json() == fast_body
+    assert fast_body["at"] == "2025-09-01T12:30:15.250000" and fast_body["amount"] == "1.50"
+
+def test_slow_query_log_records_shapes_with_plans(offline_app, http, monkeypatch):
+    slow_url = f"{BASE_URL}/api/admin/slow-queries"
+    assert offline_app.normalize_sql("SELECT * FROM t WHERE a = 'x''y' AND b IN (%s, %s,%s) LIMIT 10") == \
+        "SELECT * FROM t WHERE a = ? AND b IN (...) LIMIT ?"
+    assert offline_app.normalize_sql("INSERT INTO t (a, b) VALUES (?, ?), (?, ?)") == "INSERT INTO t (a, b) VALUES (...)"
+
+    http.post(DATA_URL, json={"device_id": "private_slow_device", "temperature": 20})
+    monkeypatch.setattr(offline_app.slow_query_log, 'threshold', 0)
+    assert http.delete(slow_url).status_code == 200
+    for _ in range(2):
+        assert http.get(f"{API_URL}/device/private_slow_device/readings").status_code == 200
+
+    route = "/api/crud/device/<device_id>/readings"
+    deadline = time.monotonic() + 5
+    while True:
+        log = http.get(slow_url).json()
+        selects = [shape for shape in log['shapes'] if shape['query'] == "SELECT iot_readings"]
+        if (selects and selects[0]['explain']) or time.monotonic() > deadline:
+            break
+        time.sleep(0.05)
+    assert log['threshold_ms'] == 0 and log['enabled'] is True
+    assert len(selects) == 1 and selects[0]['count'] == 2
+    assert selects[0]['explain'] and selects[0]['explain_error'] is None
+    records = [record for record in log['records'] if record['shape'] == selects[0]['shape']]
+    assert len(records) == 2 and {record['route'] for record in records} == {route}
+    assert records[0]['params_fingerprint'] == records[1]['params_fingerprint'] and records[0]['rows'] == 1
+    # Statements are logged by shape; parameter values never appear
+    assert "private_slow_device" not in json.dumps(log)
+
+    assert http.get(f"{slow_url}?limit=1").json()['records'] == log['records'][:1]
+    assert http.get(f"{slow_url}?limit=all").status_code == 400
+    http.delete(slow_url)
+    assert http.get(slow_url).json()['records'] == []
+
+def test_promoted_sensor_fields_are_searchable_numbers(offline_app, http):
+    assert offline_app.parse_sensor_fields(" light, battery ,light,,") == ('light', 'battery')
+    for spec in ("Light", "humidity", "light-level", "9volt"):
+        with pytest.raises(ValueError):
+            offline_app.parse_sensor_fields(spec)
+
+    readings = [{"light": 200001}, {"light": 200002.5}, {"light": "200003"}, {"light": True, "motion": True},
+                {"light": {"lux": 200004}}, {}]
+    http.post(f"{DATA_URL}/batch", json=[
+        {"device_id": "promoted_device", "temperature": i, "sensor_data": sensor_data}
+        for i, sensor_data in enumerate(readings)
+    ])
+    stored = {reading['temperature']: reading['id']
+              for reading in http.get(f"{API_URL}/device/promoted_device/readings").json()['readings']}
+
+    def bright():
+        response = http.get(f"{API_URL}/readings?light_gt=100000")
+        assert response.status_code == 200
+        return sorted(reading['sensor_data']['light'] for reading in response.json()['readings'])
+
+    # Only JSON numbers are indexed; strings and objects are not coerced
+    assert bright() == [200001, 200002.5]
+    moving = http.get(f"{API_URL}/readings?device_id=promoted_device&motion_eq=1").json()['readings']
+    assert [reading['temperature'] for reading in moving] == [3.0]
+    lit = http.get(f"{API_URL}/readings?device_id=promoted_device&light_lte=1").json()['readings']
+    assert [reading['temperature'] for reading in lit] == [3.0]
+
+    # Updates move readings in and out of the promoted field's index
+    assert http.put(f"{API_URL}/reading/{stored[2.0]}", json={"sensor_data": {"light": 200003}}).status_code == 200
+    assert http.put(f"{API_URL}/reading/{stored[0.0]}", json={"sensor_data": {"battery": 50}}).status_code == 200
+    assert bright() == [200002.5, 200003]
+
+    for query in ("lux_gt=1", "light_gt=bright", "temperature_gt=1"):
+        assert http.get(f"{API_URL}/readings?{query}").status_code == 400
@@ -2,16 +2,253 @@
 """
 Test script for basic CRUD operations to std01_iot_data database
 Run this script to test all CRUD functionality
+
+    python test_crud.py             # against the Flask app running on BASE_URL
+    python test_crud.py --offline   # in-process, on a temporary SQLite database
+    python test_crud.py --plans     # only check search query plans on the configured database
+    python -m pytest test_crud.py   # the offline run under pytest (fixtures in conftest.py)
 """
 
-import requests
+import argparse
+import gzip
 import json
+import os
+import shutil
+import tempfile
 import time
 
 # Configuration
 BASE_URL = "http://127.0.0.1:5001"
 API_URL = f"{BASE_URL}/api/crud"
 
+class OfflineResponse:
+    """The parts of a requests.Response this script uses"""
+    
+    def __init__(self, response):
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self.content = response.get_data()
+        if response.headers.get('Content-Encoding') == 'gzip':
+            # requests decodes gzip bodies as well
+            self.content = gzip.decompress(self.content)
+        self.text = self.content.decode()
+    
+    def json(self):
+        return json.loads(self.text)
+
+class OfflineClient:
+    """requests-style get/post/put/delete calls served by the Flask test client"""
+    
+    def __init__(self, flask_app):
+        self._client = flask_app.test_client()
+    
+    def _request(self, method, url, json=None, data=None, headers=None):
+        path = url[len(BASE_URL):] if url.startswith(BASE_URL) else url
+        return OfflineResponse(self._client.open(path, method=method, json=json, data=data, headers=headers))
+    
+    def get(self, url, **kwargs):
+        return self._request('GET', url, **kwargs)
+    
+    def post(self, url, **kwargs):
+        return self._request('POST', url, **kwargs)
+    
+    def put(self, url, **kwargs):
+        return self._request('PUT', url, **kwargs)
+    
+    def delete(self, url, **kwargs):
+        return self._request('DELETE', url, **kwargs)
+
+def load_offline_app(directory):
+    """Import app.py on the SQLite storage backend, with its files in `directory`"""
+    # Read by app.py at import time
+    os.environ['STORAGE_BACKEND'] = 'sqlite'
+    os.environ['SQLITE_PATH'] = os.path.join(directory, 'iot_data.db')
+    os.environ['ARCHIVE_DIR'] = os.path.join(directory, 'archive')
+    import app
+    app.init_database()
+    return app
+
+def run_offline():
+    """Run the tests in-process with the SQLite storage backend in a temporary directory"""
+    directory = tempfile.mkdtemp(prefix='iot_crud_test_')
+    app = load_offline_app(directory)
+    
+    try:
+        test_crud_operations(OfflineClient(app.app))
+        if not check_query_plans(app):
+            raise SystemExit(1)
+    finally:
+        app.storage.close()
+        shutil.rmtree(directory, ignore_errors=True)
+
+def plan_problems(rows):
+    """
+    Full scans of iot_readings (of the table or of a whole index) in EXPLAIN
+    output, given MySQL rows or SQLite EXPLAIN QUERY PLAN rows
+    """
+    problems = []
+    for row in rows:
+        if 'detail' in row:
+            if row['detail'].startswith('SCAN iot_readings'):
+                problems.append(row['detail'])
+        elif row.get('table') == 'iot_readings' and (row.get('type') in ('ALL', 'index') or not row.get('key')):
+            problems.append(f"type={row.get('type')} key={row.get('key')}")
+    return problems
+
+def check_query_plans(app):
+    """Every search filter shape must be served from an index, never a full scan of iot_readings"""
+    from datetime import datetime
+    from storage import ReadingFilter
+    
+    print_section("QUERY PLANS - Search Filters Stay on Indexes")
+    since = datetime(2025, 8, 1)
+    shapes = [
+        ("device", "test_device_001", None),
+        ("device + time range + temperature", "test_device_001",
+         ReadingFilter(start=since, end=datetime(2025, 9, 1), comparisons=(("temperature", "gte", 30),))),
+        ("device set", None, ReadingFilter(device_ids=("test_device_001", "test_device_002"))),
+        ("device prefix + humidity", None, ReadingFilter(device_prefix="test_", comparisons=(("humidity", "lt", 40),))),
+        ("time range", None, ReadingFilter(start=since)),
+        ("time range + temperature and humidity", None,
+         ReadingFilter(start=since, comparisons=(("temperature", "gt", 20), ("humidity", "lte", 80))))
+    ]
+    shapes += [
+        (f"promoted {field}", None, ReadingFilter(comparisons=((field, "lt", 20),)))
+        for field in app.SENSOR_FIELDS
+    ]
+    
+    failures = 0
+    for name, device_id, filters in shapes:
+        try:
+            plans = app.storage.search_plans(device_id, filters)
+        except app.StorageError as e:
+            plans = [("", [{"detail": f"SCAN iot_readings ({e})"}])]
+        problems = [problem for _, rows in plans for problem in plan_problems(rows)]
+        failures += bool(problems)
+        print(f"{'FAIL' if problems else 'ok  '} {name}{': ' + '; '.join(problems) if problems else ''}")
+    return failures == 0
+
+def test_query_plans(offline_app):
+    assert check_query_plans(offline_app)
+
+def test_mysql_device_prefix_is_an_escaped_like(offline_app):
+    from storage import ReadingFilter
+    
+    repository = offline_app.MySQLRepository()
+    for prefix, pattern in (("esp32_009", r"esp32\_009%"), ("node_z", r"node\_z%"),
+                            ("ESP32_", r"ESP32\_%"), ("50%\\", r"50\%\\%")):
+        _, conditions, params = repository._search(None, ReadingFilter(device_prefix=prefix))
+        assert (conditions, params) == (["device_id LIKE %s"], [pattern])
+
+def test_time_filters_accept_utc_offsets(http):
+    for query in ("from=2025-08-01T00:00:00Z", "from=2025-08-01T00:00:00%2B07:00&to=2025-09-01T00:00:00Z"):
+        response = http.get(f"{API_URL}/readings?{query}")
+        assert response.status_code == 200, response.text
+    assert http.get(f"{BASE_URL}/api/export/test_device_001?from=2025-08-01T00:00:00Z").status_code == 200
+
+def test_cached_readings_match_stored_readings(offline_app, http):
+    device_url = f"{BASE_URL}/api/data/cache_device"
+    http.post(f"{BASE_URL}/api/data", json={"device_id": "cache_device", "temperature": 20.1})
+    http.get(device_url)  # warms the cache
+    appends = offline_app.reading_cache.stats()['appends']
+    
+    http.post(f"{BASE_URL}/api/data", json={"device_id": "cache_device", "temperature": 21.123456789,
+                                           "timestamp": "2099-01-01T12:00:00.123456"})
+    cached = http.get(device_url).json()
+    assert offline_app.reading_cache.stats()['appends'] == appends + 1
+    offline_app.reading_cache.clear()
+    assert http.get(device_url).json() == cached
+
+def test_edit_failures_keep_the_error_envelope(offline_app, http, monkeypatch):
+    reading_id = http.post(f"{API_URL}/reading", json={"device_id": "edit_device", "temperature": 20}).json()['reading_id']
+    client = offline_app.app.test_client()
+    form = {"device_id": "edit_device", "temperature": "21.5", "humidity": "", "sensor_data": "{}"}
+    assert client.post(f"/edit/{reading_id}", data=form).status_code == 302
+    assert client.post(f"/edit/{reading_id}", data={**form, "temperature": "nan"}).status_code == 302
+    
+    def broken(reading_id, fields):
+        raise TypeError("unsupported operand type(s)")
+    
+    monkeypatch.setattr(offline_app.storage, 'update_reading', broken)
+    assert client.post(f"/edit/{reading_id}", data=form).status_code == 302
+    response = http.put(f"{API_URL}/reading/{reading_id}", json={"temperature": 22})
+    assert response.status_code == 500
+    assert response.json() == {"success": False, "error": "unsupported operand type(s)"}
+
+def test_validate_reading_normalises_values(offline_app):
+    from datetime import datetime, timezone
+    
+    reading, error = offline_app.validate_reading({"device_id": "esp32_001", "temperature": "25.5",
+                                                   "timestamp": "2025-08-01T12:00:00Z"})
+    assert error is None and reading['temperature'] == 25.5
+    assert reading['timestamp'].tzinfo is None
+    assert reading['timestamp'] == datetime(2025, 8, 1, 12, tzinfo=timezone.utc).astimezone().replace(tzinfo=None)
+    for value in ("nan", "inf", float("-inf")):
+        assert offline_app.validate_reading({"device_id": "esp32_001", "humidity": value})[0] is None
+
+def test_create_and_update_coerce_values(http):
+    created = http.post(f"{API_URL}/reading", json={"device_id": "coerce_device", "temperature": "25.5"})
+    assert created.status_code == 201
+    reading_id = created.json()['reading_id']
+    assert http.get(f"{API_URL}/reading/{reading_id}").json()['reading']['temperature'] == 25.5
+    
+    assert http.put(f"{API_URL}/reading/{reading_id}", json={"humidity": "61"}).status_code == 200
+    assert http.post(f"{API_URL}/reading", json={"device_id": "coerce_device", "temperature": "warm"}).status_code == 400
+    assert http.put(f"{API_URL}/reading/{reading_id}", json={"humidity": "nan"}).status_code == 400
+    assert http.put(f"{API_URL}/reading/{reading_id}", json={"device_id": 42}).status_code == 400
+
+def ingest_reading(device_id, temperature=21.0):
+    return {"device_id": device_id, "temperature": temperature, "humidity": None, "sensor_data": None, "timestamp": None}
+
+def test_ingest_buffer_drops_only_the_failing_reading(offline_app):
+    buffer = offline_app.IngestBuffer(flush_rows=10, flush_interval=0.05)
+    for temperature in (21.0, 22.0, "not a number", 23.0):
+        # Skips validate_reading, so the bad value fails inside the write
+        buffer.submit(ingest_reading("ingest_device", temperature))
+    buffer.stop()
+    
+    stats = buffer.stats()
+    assert (stats['rows_flushed'], stats['rows_dropped'], stats['queue_depth']) == (3, 1, 0)
+    assert offline_app.storage.device_total("ingest_device") == 3
+
+def test_ingest_buffer_waits_out_a_database_outage(offline_app, monkeypatch):
+    insert_rows = offline_app.storage.insert_rows
+    failures = []
+    
+    def flaky_insert(rows):
+        if len(failures) < 4:
+            failures.append(len(rows))
+            raise offline_app.StorageError("Database connection failed")
+        return insert_rows(rows)
+    
+    monkeypatch.setattr(offline_app.storage, 'insert_rows', flaky_insert)
+    buffer = offline_app.IngestBuffer(flush_rows=10, flush_interval=0.05, max_backoff=0.1)
+    for _ in range(5):
+        buffer.submit(ingest_reading("outage_device"))
+    deadline = time.monotonic() + 10
+    while buffer.stats()['rows_flushed'] < 5 and time.monotonic() < deadline:
+        time.sleep(0.05)
+    buffer.stop()
+    
+    stats = buffer.stats()
+    assert len(failures) == 4
+    assert (stats['rows_flushed'], stats['rows_dropped']) == (5, 0)
+    assert offline_app.storage.device_total("outage_device") == 5
+
+def test_ingest_buffer_counts_readings_it_cannot_write_at_shutdown(offline_app, monkeypatch):
+    def down(rows):
+        raise offline_app.StorageError("Database connection failed")
+    
+    monkeypatch.setattr(offline_app.storage, 'insert_rows', down)
+    buffer = offline_app.IngestBuffer(flush_rows=10, flush_interval=0.05, max_backoff=0.1)
+    for _ in range(3):
+        buffer.submit(ingest_reading("shutdown_device"))
+    time.sleep(0.3)
+    buffer.stop()
+    
+    stats = buffer.stats()
+    assert (stats['rows_flushed'], stats['rows_dropped'], stats['queue_depth']) == (0, 3, 0)
+
 def print_section(title):
     """Print a section header"""
     print(f"\n{'='*50}")
@@ -25,12 +262,12 @@ def print_response(response, operation):
         print(f"{operation}: {response.status_code}")
         print(json.dumps(data, indent=2))
         return data
-    except:
+    except ValueError:
         print(f"{operation}: {response.status_code} - {response.text}")
         return None
 
-def test_crud_operations():
-    """Test all CRUD operations"""
+def test_crud_operations(http):
+    """Test all CRUD operations through `http` (the requests module or an OfflineClient)"""
     
     print_section("TESTING BASIC CRUD OPERATIONS TO std01_iot_data DATABASE")
     
@@ -39,161 +276,153 @@ def test_crud_operations():
     # ========================
     print_section("1. CREATE - Adding New Readings")
     
-    # Create first reading
-    reading1_data = {
-        "device_id": "test_device_001",
-        "temperature": 23.5,
-        "humidity": 65.2,
-        "sensor_data": {
-            "light": 750,
-            "pressure": 1013.25,
-            "battery": 85
-        }
-    }
-    
-    response = requests.post(f"{API_URL}/reading", json=reading1_data)
-    result1 = print_response(response, "Create Reading 1")
-    reading1_id = result1.get('reading_id') if result1 and result1.get('success') else None
-    
-    # Create second reading
-    reading2_data = {
-        "device_id": "test_device_002",
-        "temperature": 28.7,
-        "humidity": 58.9,
-        "sensor_data": {
-            "light": 820,
-            "motion": True,
-            "battery": 92
-        }
-    }
-    
-    response = requests.post(f"{API_URL}/reading", json=reading2_data)
-    result2 = print_response(response, "Create Reading 2")
-    reading2_id = result2.get('reading_id') if result2 and result2.get('success') else None
-    
-    # Create third reading for same device
-    reading3_data = {
-        "device_id": "test_device_001",
-        "temperature": 24.1,
-        "humidity": 63.8,
-        "sensor_data": {
-            "light": 780,
-            "pressure": 1012.1,
-            "battery": 83
-        }
-    }
+    readings = [
+        {"device_id": "test_device_001", "temperature": 23.5, "humidity": 65.2,
+         "sensor_data": {"light": 750, "pressure": 1013.25, "battery": 85}},
+        {"device_id": "test_device_002", "temperature": 28.7, "humidity": 58.9,
+         "sensor_data": {"light": 820, "motion": True, "battery": 92}},
+        {"device_id": "test_device_001", "temperature": 24.1, "humidity": 63.8,
+         "sensor_data": {"light": 780, "pressure": 1012.1, "battery": 83}}
+    ]
+    reading_ids = []
+    for number, reading in enumerate(readings, 1):
+        response = http.post(f"{API_URL}/reading", json=reading)
+        result = print_response(response, f"Create Reading {number}")
+        assert response.status_code == 201 and result['success']
+        reading_ids.append(result['reading_id'])
+    reading1_id, reading2_id, reading3_id = reading_ids
     
-    response = requests.post(f"{API_URL}/reading", json=reading3_data)
-    result3 = print_response(response, "Create Reading 3")
-    reading3_id = result3.get('reading_id') if result3 and result3.get('success') else None
-    
-    time.sleep(1)  # Wait a moment between operations
+    response = http.post(f"{API_URL}/reading", json={"temperature": 20})
+    print_response(response, "Create Reading Without device_id")
+    assert response.status_code == 400
     
     # ========================
     # READ - Get readings
     # ========================
     print_section("2. READ - Retrieving Readings")
     
-    if reading1_id:
-        # Read specific reading
-        response = requests.get(f"{API_URL}/reading/{reading1_id}")
-        print_response(response, f"Read Reading {reading1_id}")
+    response = http.get(f"{API_URL}/reading/{reading1_id}")
+    result = print_response(response, f"Read Reading {reading1_id}")
+    assert response.status_code == 200
+    assert result['reading']['device_id'] == "test_device_001"
+    assert result['reading']['temperature'] == 23.5
+    assert result['reading']['sensor_data'] == readings[0]['sensor_data']
+    
+    response = http.get(f"{API_URL}/readings?limit=10")
+    result = print_response(response, "Read All Readings (limit 10)")
+    assert response.status_code == 200 and 3 <= len(result['readings']) <= 10
     
-    # Read all readings
-    response = requests.get(f"{API_URL}/readings?limit=10")
-    print_response(response, "Read All Readings (limit 10)")
+    response = http.get(f"{API_URL}/device/test_device_001/readings")
+    result = print_response(response, "Read test_device_001 Readings")
+    device_ids = [reading['id'] for reading in result['readings']]
+    assert response.status_code == 200
+    assert {reading1_id, reading3_id} <= set(device_ids) and reading2_id not in device_ids
     
-    # Read device-specific readings
-    response = requests.get(f"{API_URL}/device/test_device_001/readings")
-    print_response(response, "Read test_device_001 Readings")
+    # Server-side search: device set, value ranges and promoted sensor fields
+    response = http.get(f"{API_URL}/readings?device_id=test_device_001,test_device_002&temperature_gte=24")
+    result = print_response(response, "Search Readings (2 devices, temperature >= 24)")
+    assert response.status_code == 200
+    assert {reading2_id, reading3_id} <= {reading['id'] for reading in result['readings']}
+    assert all(reading['temperature'] >= 24 for reading in result['readings'])
     
-    time.sleep(1)
+    response = http.get(f"{API_URL}/readings?device_prefix=test_device_&battery_lt=90")
+    result = print_response(response, "Search Readings (device prefix, battery < 90)")
+    assert response.status_code == 200
+    assert {reading1_id, reading3_id} <= {reading['id'] for reading in result['readings']}
+    assert all(reading['sensor_data']['battery'] < 90 for reading in result['readings'])
     
     # ========================
     # UPDATE - Modify readings
     # ========================
     print_section("3. UPDATE - Modifying Readings")
     
-    if reading2_id:
-        update_data = {
-            "temperature": 29.5,
-            "humidity": 55.0,
-            "sensor_data": {
-                "light": 900,
-                "motion": False,
-                "battery": 90,
-                "updated": True
-            }
-        }
-        
-        response = requests.put(f"{API_URL}/reading/{reading2_id}", json=update_data)
-        print_response(response, f"Update Reading {reading2_id}")
-        
-        # Verify update by reading it back
-        response = requests.get(f"{API_URL}/reading/{reading2_id}")
-        print_response(response, f"Verify Update - Read Reading {reading2_id}")
-    
-    time.sleep(1)
-    
-    # ========================
-    # READ - Get updated data
-    # ========================
-    print_section("4. READ - After Updates")
+    update_data = {
+        "temperature": 29.5,
+        "humidity": 55.0,
+        "sensor_data": {"light": 900, "motion": False, "battery": 90, "updated": True}
+    }
+    response = http.put(f"{API_URL}/reading/{reading2_id}", json=update_data)
+    print_response(response, f"Update Reading {reading2_id}")
+    assert response.status_code == 200
     
-    # Read all readings again to see changes
-    response = requests.get(f"{API_URL}/readings?limit=5")
-    print_response(response, "Read All Readings After Update")
+    response = http.get(f"{API_URL}/reading/{reading2_id}")
+    result = print_response(response, f"Verify Update - Read Reading {reading2_id}")
+    assert result['reading']['temperature'] == 29.5
+    assert result['reading']['humidity'] == 55.0
+    assert result['reading']['sensor_data'] == update_data['sensor_data']
+    assert result['reading']['device_id'] == "test_device_002"
     
-    time.sleep(1)
+    response = http.put(f"{API_URL}/reading/{reading2_id}", json={"note": "no reading fields"})
+    print_response(response, "Update Without Fields")
+    assert response.status_code == 400
     
     # ========================
     # DELETE - Remove readings
     # ========================
-    print_section("5. DELETE - Removing Readings")
+    print_section("4. DELETE - Removing Readings")
+    
+    response = http.delete(f"{API_URL}/reading/{reading3_id}")
+    print_response(response, f"Delete Reading {reading3_id}")
+    assert response.status_code == 200
     
-    if reading3_id:
-        # Delete specific reading
-        response = requests.delete(f"{API_URL}/reading/{reading3_id}")
-        print_response(response, f"Delete Reading {reading3_id}")
-        
-        # Verify deletion
-        response = requests.get(f"{API_URL}/reading/{reading3_id}")
-        print_response(response, f"Verify Deletion - Try to Read {reading3_id}")
+    response = http.get(f"{API_URL}/reading/{reading3_id}")
+    print_response(response, f"Verify Deletion - Try to Read {reading3_id}")
+    assert response.status_code == 404
     
-    # Delete all readings for a device
-    response = requests.delete(f"{API_URL}/device/test_device_001")
-    print_response(response, "Delete All Readings for test_device_001")
+    # Delete all readings for a device; the purge runs in the background
+    response = http.delete(f"{API_URL}/device/test_device_001")
+    result = print_response(response, "Delete All Readings for test_device_001")
+    assert response.status_code == 202 and result['success']
+    job = wait_for_job(http, result['job']['id'])
+    print(f"Purge {job['status']}: {job['progress']['done']} of {job['progress']['total']} readings deleted")
+    assert job['status'] == 'completed'
     
-    time.sleep(1)
+    response = http.get(f"{API_URL}/device/test_device_001/readings")
+    result = print_response(response, "Verify Purge - Read test_device_001 Readings")
+    assert result['readings'] == []
     
     # ========================
-    # FINAL READ - Check remaining data
+    # CLEAN UP
     # ========================
-    print_section("6. FINAL READ - Check Remaining Data")
+    print_section("5. CLEAN UP - Remove Remaining Test Data")
     
-    response = requests.get(f"{API_URL}/readings")
-    final_result = print_response(response, "Final Read - All Remaining Readings")
-    
-    # Clean up remaining test data
-    if final_result and final_result.get('success'):
-        remaining_readings = final_result.get('readings', [])
-        print(f"\nCleaning up {len(remaining_readings)} remaining test readings...")
-        
-        for reading in remaining_readings:
-            if reading['device_id'].startswith('test_device_'):
-                response = requests.delete(f"{API_URL}/reading/{reading['id']}")
-                print(f"Cleaned up reading {reading['id']}: {response.status_code}")
+    response = http.delete(f"{API_URL}/reading/{reading2_id}")
+    print_response(response, f"Delete Reading {reading2_id}")
+    assert response.status_code == 200
     
     print_section("CRUD OPERATIONS TEST COMPLETED")
     print("All basic CRUD operations have been tested!")
     print(f"\nYou can also test the web interface at: {BASE_URL}")
 
+def wait_for_job(http, job_id, timeout=10):
+    """Poll a background job until it leaves queued/running; returns its final state"""
+    deadline = time.monotonic() + timeout
+    while True:
+        job = http.get(f"{BASE_URL}/api/jobs/{job_id}").json()['job']
+        if job['status'] not in ('queued', 'running') or time.monotonic() > deadline:
+            return job
+        time.sleep(0.05)
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Exercise the CRUD API")
+    parser.add_argument('--offline', action='store_true', default=os.environ.get('TEST_CRUD_OFFLINE') == '1',
+                        help="run in-process on a temporary SQLite database (no server or MySQL needed)")
+    parser.add_argument('--plans', action='store_true',
+                        help="only check that search filters use indexes, on the database app.py is configured for")
+    args = parser.parse_args()
+    if args.offline:
+        run_offline()
+        raise SystemExit
+    if args.plans:
+        import app
+        raise SystemExit(0 if check_query_plans(app) else 1)
+    
+    import requests
     try:
-        test_crud_operations()
+        test_crud_operations(requests)
     except requests.exceptions.ConnectionError:
         print("ERROR: Cannot connect to Flask server!")
         print("Make sure the Flask app is running on http://127.0.0.1:5001")
-        print("Run: python app.py")
+        print("Run: python app.py, or test without a server: python test_crud.py --offline")
     except Exception as e:
         print(f"ERROR: {e}")
@@ -0,0 +1,46 @@
+"""
+Tests for the columnar reading archive (reading_archive.ArchiveStore)
+
+    python -m pytest -q test_reading_archive.py
+"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from reading_archive import ArchiveStore
+
+T0 = datetime(2025, 8, 1, 12, 0, 0)
+
+@pytest.fixture
+def store(tmp_path):
+    archive = ArchiveStore(str(tmp_path / 'archive'))
+    yield archive
+    archive.close()
+
+def rows(first_id, count):
+    return [
+        (reading_id, 'esp32_001', T0 + timedelta(seconds=reading_id), 23.5, 60.0, '{"light": 1}', T0)
+        for reading_id in range(first_id, first_id + count)
+    ]
+
+def test_read_merges_segments_newest_first(store):
+    store.write_segment('esp32_001', rows(1, 3))
+    store.write_segment('esp32_001', rows(4, 2))
+    assert [row['id'] for row in store.read('esp32_001')] == [5, 4, 3, 2, 1]
+    assert [row['id'] for row in store.read('esp32_001', descending=False, limit=2)] == [1, 2]
+
+def test_replaced_segments_are_closed_after_their_last_reader(store):
+    store.write_segment('esp32_001', rows(1, 3))
+    with store.segments('esp32_001') as held:
+        old = held[0]
+        store.write_segment('esp32_001', rows(4, 2))
+        assert len(store.read('esp32_001')) == 5
+        # Still mapped for the reader that holds it
+        assert not old._mmap.closed and old.row(0)['id'] == 1
+    assert old._mmap.closed
+
+    current = store._segments['esp32_001'].segments
+    store.remove_device('esp32_001')
+    assert not store.has_segments('esp32_001')
+    assert all(segment._mmap.closed for segment in current)
@@ -0,0 +1,106 @@
+"""
+Tests for the embedded SQLite backend (storage.SQLiteRepository)
+
+    python -m pytest -q test_storage.py
+"""
+
+import time
+from datetime import datetime
+
+import pytest
+
+from storage import ReadingFilter, SQLiteRepository, StorageError, _WriteJob
+
+T0 = datetime(2025, 8, 1, 12, 0, 0)
+
+@pytest.fixture
+def repo(tmp_path):
+    repository = SQLiteRepository(str(tmp_path / 'iot.db'), write_timeout=5)
+    repository.init()
+    yield repository
+    repository.close()
+
+def reading(device_id='esp32_001', temperature=23.5, humidity=60.0):
+    return (device_id, T0, temperature, humidity, None)
+
+def test_insert_and_read_back(repo):
+    first_id = repo.insert_rows([reading(), reading(temperature=24.5)])
+    assert repo.get_reading(first_id)['temperature'] == 23.5
+    assert repo.device_total('esp32_001') == 2
+
+def test_failing_write_is_raised_and_later_writes_still_commit(repo):
+    # A string temperature fails in the device_stats arithmetic, not in SQLite
+    with pytest.raises(TypeError):
+        repo.insert_rows([reading(temperature="25.5")])
+    assert repo.total_readings() == 0
+
+    repo.insert_rows([reading()])
+    assert repo.device_total('esp32_001') == 1
+
+def test_failed_job_only_rolls_back_its_own_savepoint(repo):
+    def insert(cursor, rows):
+        return repo._insert(cursor, rows)
+
+    def fail(cursor):
+        cursor.execute("INSERT INTO iot_readings (device_id, timestamp) VALUES ('esp32_002', '2025-08-01 12:00:00')")
+        raise ValueError("bad job")
+
+    jobs = [_WriteJob(insert, ([reading()],)), _WriteJob(fail, ()), _WriteJob(insert, ([reading()],))]
+    connection = repo._connect()
+    try:
+        repo._commit_batch(connection, jobs)
+    finally:
+        connection.close()
+
+    assert [type(job.error) for job in jobs] == [type(None), ValueError, type(None)]
+    assert all(job.done.is_set() for job in jobs)
+    assert repo.device_total('esp32_001') == 2
+    assert repo.device_total('esp32_002') == 0
+
+def test_sqlite_errors_are_storage_errors(repo):
+    def broken(cursor):
+        cursor.execute("INSERT INTO no_such_table VALUES (1)")
+
+    with pytest.raises(StorageError):
+        repo._write(broken)
+    repo.insert_rows([reading()])
+    assert repo.total_readings() == 1
+
+def test_writer_is_restarted_after_it_stops(repo):
+    repo.insert_rows([reading()])
+    writer = repo._writer
+    repo._jobs.put(None)
+    writer.join(5)
+    assert not writer.is_alive()
+
+    repo.insert_rows([reading()])
+    assert repo._writer is not writer
+    assert repo.device_total('esp32_001') == 2
+
+def test_write_wait_is_bounded(tmp_path):
+    repository = SQLiteRepository(str(tmp_path / 'iot.db'), write_timeout=0.1)
+    repository.init()
+    try:
+        with pytest.raises(StorageError, match="timed out"):
+            repository._write(lambda cursor: time.sleep(0.5))
+        # The slow job still finishes and the writer keeps serving writes
+        repository.write_timeout = 5
+        repository.insert_rows([reading()])
+        assert repository.total_readings() == 1
+    finally:
+        repository.close()
+
+def test_device_prefix_filter(repo):
+    device_ids = ['esp32_009', 'esp32_010', 'esp32_00', 'esp32_0:1', 'node_z1', 'node_za', 'node_{', 'node_Z1', 'ESP32_009']
+    repo.insert_rows([reading(device_id) for device_id in device_ids])
+
+    def matching(prefix):
+        readings, _, _ = repo.readings_page(None, 50, filters=ReadingFilter(device_prefix=prefix))
+        return sorted({row['device_id'] for row in readings})
+
+    assert matching('esp32_009') == ['esp32_009']
+    assert matching('esp32_00') == ['esp32_00', 'esp32_009']
+    assert matching('node_z') == ['node_z1', 'node_za']
+    # device_id is BINARY in SQLite, so prefixes are case-sensitive
+    assert matching('node_Z') == ['node_Z1']
+    assert matching('ESP32_') == ['ESP32_009']
@@ -0,0 +1,61 @@
+"""
+Tests for the UDP ingest listener over loopback (udp_ingest.py)
+
+    python -m pytest -q test_udp_ingest.py
+"""
+
+import json
+import socket
+import threading
+import time
+
+import pytest
+
+@pytest.fixture
+def listener(offline_app):
+    from udp_ingest import UDPIngestListener
+
+    buffer = offline_app.IngestBuffer(flush_rows=50, flush_interval=0.05)
+    udp_listener = UDPIngestListener('127.0.0.1', 0, buffer)
+    thread = threading.Thread(target=udp_listener.serve_forever, daemon=True)
+    thread.start()
+    yield udp_listener
+    udp_listener.stop()  # a no-op after the test stopped it
+    thread.join(5)
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.02)
+    return condition()
+
+def test_loopback_datagrams_are_stored_and_counted(offline_app, listener):
+    from udp_ingest import encode_datagram
+
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sender.sendto(encode_datagram('udp_binary_001', [
+            {"temperature": 21.25, "humidity": 55.5, "sensor_data": {"light": 12.5, "light_raw": 300}},
+            {"temperature": 21.5, "humidity": None, "sensor_data": {"light": None, "light_raw": None}}
+        ]), listener.address)
+        sender.sendto(json.dumps([
+            {"device_id": "udp_json_001", "temperature": "19.5", "timestamp": "2025-08-01T12:00:00Z"},
+            {"device_id": "udp_json_001", "temperature": "warm"}
+        ]).encode(), listener.address)
+        sender.sendto(b'\x07\x03abc', listener.address)
+    finally:
+        sender.close()
+
+    assert wait_for(lambda: listener.stats()['datagrams'] == 3)
+    listener.stop()
+
+    stats = listener.stats()
+    assert stats['malformed_datagrams'] == 1
+    assert (stats['received'], stats['malformed']) == (4, 1)
+    assert (stats['dropped'], stats['written'], stats['write_failed'], stats['queue_depth']) == (0, 3, 0, 0)
+
+    binary = offline_app.storage.latest_readings('udp_binary_001', 10)
+    assert sorted(row['temperature'] for row in binary) == [21.25, 21.5]
+    assert {row['humidity'] for row in binary} == {55.5, None}
+    stored = offline_app.storage.latest_readings('udp_json_001', 10)
+    assert [row['temperature'] for row in stored] == [19.5]
@@ -0,0 +1,211 @@
+"""
+UDP ingest listener for high-frequency sensors
+
+Runs next to app.py as its own process:
+
+    python udp_ingest.py serve [--host 0.0.0.0] [--port 5002]
+
+Each datagram carries one or more readings, either in the binary layout that
+/api/data accepts as application/x-iot-reading, or as a JSON object or array.
+Valid readings go through the same write-behind IngestBuffer that /api/data
+uses, so they are written with multi-row INSERTs. Nothing is sent back to
+the sender. Counters are printed every UDP_INGEST_STATS_INTERVAL seconds.
+
+To try it locally, send readings over loopback from another shell:
+
+    python udp_ingest.py send --count 1000 --per-datagram 50
+"""
+
+import argparse
+import json
+import os
+import random
+import socket
+import struct
+import threading
+import time
+from datetime import datetime
+
+from app import (
+    BINARY_SCHEMAS, INGEST_CONFIG, IngestBuffer, decode_binary_readings, init_database, validate_reading
+)
+
+UDP_CONFIG = {
+    'host': os.environ.get('UDP_INGEST_HOST', '0.0.0.0'),
+    'port': int(os.environ.get('UDP_INGEST_PORT', 5002)),
+    'receive_buffer': int(os.environ.get('UDP_INGEST_RCVBUF', 4 * 1024 * 1024)),  # absorbs bursts during a flush
+    'stats_interval': float(os.environ.get('UDP_INGEST_STATS_INTERVAL', 60))
+}
+
+MAX_DATAGRAM = 65535
+
+def decode_datagram(payload):
+    """Decode a datagram into a list of reading dicts. Raises ValueError when malformed."""
+    if payload[:1] in (b'{', b'['):
+        data = json.loads(payload)
+        return data if isinstance(data, list) else [data]
+    return decode_binary_readings(payload)
+
+def encode_datagram(device_id, readings, schema_id=1):
+    """Pack readings of one device in the binary layout (the inverse of decode_binary_readings)"""
+    record_format, fields = BINARY_SCHEMAS[schema_id]
+    records = []
+    for reading in readings:
+        values = []
+        for target, scale, null in fields:
+            if target.startswith('sensor_data.'):
+                value = (reading.get('sensor_data') or {}).get(target[len('sensor_data.'):])
+            else:
+                value = reading.get(target)
+            values.append(null if value is None else int(round(value * scale)))
+        records.append(struct.pack(record_format, *values))
+    encoded_id = device_id.encode()
+    return bytes([schema_id, len(encoded_id)]) + encoded_id + b''.join(records)
+
+class UDPIngestListener:
+    """Receive reading datagrams and hand valid readings to an IngestBuffer"""
+
+    def __init__(self, host, port, buffer, receive_buffer=UDP_CONFIG['receive_buffer']):
+        self.buffer = buffer
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, receive_buffer)
+        self.sock.bind((host, port))
+        self.sock.settimeout(0.5)
+        self.address = self.sock.getsockname()
+        self._stop = threading.Event()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "datagrams": 0,
+            "malformed_datagrams": 0,
+            "received": 0,
+            "malformed": 0
+        }
+
+    def handle(self, payload):
+        """Decode, validate and queue the readings of one datagram"""
+        try:
+            items = decode_datagram(payload)
+        except ValueError:
+            with self._stats_lock:
+                self._stats["datagrams"] += 1
+                self._stats["malformed_datagrams"] += 1
+            return
+
+        malformed = 0
+        now = datetime.now()
+        for item in items:
+            reading, error = validate_reading(item)
+            if error:
+                malformed += 1
+                continue
+            if reading['timestamp'] is None:
+                reading['timestamp'] = now
+            # A full queue is counted by the buffer as rejected_full
+            self.buffer.submit(reading)
+
+        with self._stats_lock:
+            self._stats["datagrams"] += 1
+            self._stats["received"] += len(items)
+            self._stats["malformed"] += malformed
+
+    def serve_forever(self):
+        self.buffer.start()
+        while not self._stop.is_set():
+            try:
+                payload, _ = self.sock.recvfrom(MAX_DATAGRAM)
+            except socket.timeout:
+                continue
+            except OSError:
+                if self._stop.is_set():
+                    break
+                raise
+            self.handle(payload)
+
+    def stop(self):
+        """Stop receiving, then drain queued readings to the database"""
+        self._stop.set()
+        self.sock.close()
+        self.buffer.stop()
+
+    def stats(self):
+        """Received, dropped, malformed and written reading counters"""
+        buffer_stats = self.buffer.stats()
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats.update({
+            "dropped": buffer_stats["rejected_full"],
+            "written": buffer_stats["rows_flushed"],
+            "queue_depth": buffer_stats["queue_depth"],
+            "flush_errors": buffer_stats["flush_errors"],
+            "write_failed": buffer_stats["rows_dropped"],
+            "rows_per_sec": buffer_stats["rows_per_sec"]
+        })
+        return stats
+
+def serve(host, port):
+    init_database()
+    buffer = IngestBuffer(
+        queue_size=INGEST_CONFIG['queue_size'],
+        flush_rows=INGEST_CONFIG['flush_rows'],
+        flush_interval=INGEST_CONFIG['flush_interval'],
+        max_backoff=INGEST_CONFIG['max_backoff']
+    )
+    listener = UDPIngestListener(host, port, buffer)
+    thread = threading.Thread(target=listener.serve_forever, name="udp-ingest", daemon=True)
+    thread.start()
+    print(f"UDP ingest listening on {listener.address[0]}:{listener.address[1]}")
+    try:
+        while thread.is_alive():
+            thread.join(UDP_CONFIG['stats_interval'])
+            print(f"UDP ingest stats: {json.dumps(listener.stats())}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        listener.stop()
+        print(f"UDP ingest stopped: {json.dumps(listener.stats())}")
+
+def send(host, port, device_id, count, per_datagram, rate):
+    """Loopback sender: `count` random readings in binary datagrams"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sent = 0
+    started = time.monotonic()
+    while sent < count:
+        batch = [
+            {
+                "temperature": round(random.uniform(20, 30), 2),
+                "humidity": round(random.uniform(40, 70), 2),
+                "sensor_data": {"light": round(random.uniform(0, 100), 2), "light_raw": random.randint(0, 4095)}
+            }
+            for _ in range(min(per_datagram, count - sent))
+        ]
+        sock.sendto(encode_datagram(device_id, batch), (host, port))
+        sent += len(batch)
+        if rate:
+            # Pace to `rate` readings per second
+            delay = started + sent / rate - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+    sock.close()
+    print(f"Sent {sent} readings in {time.monotonic() - started:.2f}s")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="UDP ingest listener for IoT readings")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    serve_parser = commands.add_parser('serve', help="Receive datagrams and write readings")
+    serve_parser.add_argument('--host', default=UDP_CONFIG['host'])
+    serve_parser.add_argument('--port', type=int, default=UDP_CONFIG['port'])
+
+    send_parser = commands.add_parser('send', help="Send test readings over loopback")
+    send_parser.add_argument('--host', default='127.0.0.1')
+    send_parser.add_argument('--port', type=int, default=UDP_CONFIG['port'])
+    send_parser.add_argument('--device', default='udp_test_001')
+    send_parser.add_argument('--count', type=int, default=100)
+    send_parser.add_argument('--per-datagram', type=int, default=20, help="readings per datagram (keep under ~120 to avoid IP fragmentation)")
+    send_parser.add_argument('--rate', type=float, default=0, help="readings per second (0 = as fast as possible)")
+
+    args = parser.parse_args()
+    if args.command == 'serve':
+        serve(args.host, args.port)
+    else:
+        send(args.host, args.port, args.device, args.count, args.per_datagram, args.rate)